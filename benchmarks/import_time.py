@@ -0,0 +1,78 @@
+"""Import time benchmark for the CLI entry point
+
+Runs the import of pyportfolio.cli in fresh interpreters with -X importtime and fails when the best
+cumulative import time exceeds the budget, or when a heavy dependency gets imported eagerly.
+
+Usage:
+    python benchmarks/import_time.py [--budget-ms 150] [--runs 5]
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+MODULE = "pyportfolio.cli"
+
+# Dependencies that must only load once a command actually needs them
+DEFERRED_MODULES = ["casparser", "pydantic", "requests", "tabulate", "cutie", "numpy", "pdfminer"]
+
+
+def measure_import_us(module: str) -> int:
+    """Cumulative import time of module in microseconds, as reported by -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1])
+    raise RuntimeError(f"{module} not found in -X importtime output")
+
+
+def measure_help_ms() -> float:
+    """Wall clock time of running the CLI with -h, including interpreter startup"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-m", MODULE, "-h"], capture_output=True, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def get_eagerly_imported(module: str):
+    code = f"import sys, {module}; print(' '.join(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    loaded = set(result.stdout.split())
+    return [name for name in DEFERRED_MODULES if name in loaded]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=150.0)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    import_ms = min(measure_import_us(MODULE) for _ in range(args.runs)) / 1000
+    help_ms = min(measure_help_ms() for _ in range(args.runs))
+    eager = get_eagerly_imported(MODULE)
+
+    print(f"import {MODULE}: {import_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    print(f"{MODULE} -h: {help_ms:.1f} ms wall clock, including interpreter startup")
+
+    failed = False
+    if import_ms > args.budget_ms:
+        print(f"FAIL: import time over budget by {import_ms - args.budget_ms:.1f} ms")
+        failed = True
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Local stand-in for the mfapi.in endpoints, serving the schemes of benchmarks.synthetic
+
+Usage:
+    with MFAPIStub() as stub:
+        ...  # mfhelper now fetches scheme details from the stub
+        print(stub.requests)
+"""
+
+import datetime
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pyportfolio import mfhelper
+
+from .synthetic import HISTORY_START, get_nav_history, get_scheme_category
+
+SCHEME_PATH = re.compile(r"^/mf/(\d+)(/latest)?$")
+
+
+def get_scheme_response(amfi: int, latest: bool = False) -> dict:
+    """Response of https://api.mfapi.in/mf/<amfi>, with the NAV history newest first
+
+    With latest, the response of https://api.mfapi.in/mf/<amfi>/latest, with only the latest NAV.
+    """
+    navs = get_nav_history(amfi)
+    dates = (HISTORY_START + datetime.timedelta(days=day) for day in range(len(navs)))
+    data = [
+        {"date": date.strftime("%d-%m-%Y"), "nav": f"{nav:.4f}"} for date, nav in zip(dates, navs)
+    ]
+    data.reverse()
+    if latest:
+        data = data[:1]
+    return {
+        "meta": {
+            "fund_house": f"Synthetic AMC {amfi % 10} Mutual Fund",
+            "scheme_type": "Open Ended Schemes",
+            "scheme_category": get_scheme_category(amfi),
+            "scheme_code": amfi,
+            "scheme_name": f"Synthetic Fund {amfi} - Direct Plan - Growth",
+        },
+        "data": data,
+        "status": "SUCCESS",
+    }
+
+
+class MFAPIStub:
+    """Threaded HTTP server answering scheme requests, patched into mfhelper while in use
+
+    Args:
+        latency (float): seconds to wait before every response, to simulate the network
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.requests = 0
+        self._responses = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+        self._api_url = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/mf/{{code}}"
+
+    def _get_body(self, amfi: int, latest: bool = False) -> bytes:
+        with self._lock:
+            self.requests += 1
+            body = self._responses.get((amfi, latest))
+        if body is None:
+            body = json.dumps(get_scheme_response(amfi, latest)).encode()
+            with self._lock:
+                self._responses[amfi, latest] = body
+        return body
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                match = SCHEME_PATH.match(self.path)
+                if match is None:
+                    self.send_error(404)
+                    return
+
+                body = stub._get_body(int(match.group(1)), bool(match.group(2)))
+                if stub.latency:
+                    time.sleep(stub.latency)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "MFAPIStub":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self._api_url = mfhelper.SCHEME_API_URL
+        mfhelper.SCHEME_API_URL = self.url
+        return self
+
+    def stop(self) -> None:
+        mfhelper.SCHEME_API_URL = self._api_url
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MFAPIStub":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
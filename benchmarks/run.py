@@ -0,0 +1,191 @@
+"""End-to-end benchmarks on synthetic portfolios, runnable offline
+
+Generates CAS data with benchmarks.synthetic, serves scheme details from a local mfapi stub and
+reports load time, latency of every analysis and peak memory for portfolios of increasing size.
+
+Usage:
+    python -m benchmarks.run [--sizes small medium] [--repeat 3] [--json results.json]
+    python -m benchmarks.run --compare results.json [--max-slowdown 1.5]
+"""
+
+import argparse
+import json
+import logging
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from tabulate import tabulate
+
+
+from pyportfolio.cache import SchemeDetailsCache, set_default_cache
+from pyportfolio.columnar import analyze_ltcg_tax_harvesting_columnar
+from pyportfolio.portfolio import Portfolio
+from pyportfolio.scheme_factory import initialize_and_get_schemes
+from pyportfolio.transaction_utils import get_purchase_transactions_for_active_units
+from pyportfolio.utils import logger
+
+from .mfapi_stub import MFAPIStub
+from .synthetic import count_transactions, generate_cas_data
+
+# generate_cas_data arguments of every size, the largest has about 100k transactions
+SIZES = {
+    "small": dict(folios=2, schemes_per_folio=3, years=3, sip_interval_days=30),
+    "medium": dict(folios=5, schemes_per_folio=4, years=10, sip_interval_days=30),
+    "large": dict(folios=5, schemes_per_folio=6, years=10, sip_interval_days=7),
+    "xlarge": dict(folios=12, schemes_per_folio=10, years=10, sip_interval_days=7),
+}
+
+MIN_REGRESSION_MS = 1.0
+
+
+def best_of(repeat: int, function, setup=None) -> float:
+    """Best wall clock time of function in milliseconds, setup runs untimed before every call"""
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def load_portfolio(data: dict, offline: bool = False) -> Portfolio:
+    portfolio = Portfolio.from_cas_data(data, offline=offline)
+    portfolio.schemes
+    return portfolio
+
+
+def run_analyses(portfolio: Portfolio) -> None:
+    portfolio.ltcg_tax_harvesting_summary()
+    portfolio.get_valuation_summary()
+    portfolio.to_dict()
+
+
+def measure_peak_memory_mb(function) -> float:
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 2**20
+
+
+def benchmark(size: str, repeat: int, cache_dir: Path) -> dict:
+    start = time.perf_counter()
+    data = generate_cas_data(**SIZES[size])
+    result = {
+        "size": size,
+        "transactions": count_transactions(data),
+        "schemes": sum(len(folio["schemes"]) for folio in data["folios"]),
+        "generate_ms": (time.perf_counter() - start) * 1000,
+    }
+
+    # Every scheme fetched from the stub, nothing cached on disk
+    set_default_cache(None)
+    result["load_ms"] = best_of(repeat, lambda: load_portfolio(data))
+    result["initialize_schemes_ms"] = best_of(
+        repeat, lambda: initialize_and_get_schemes(data, scheme_details={})
+    )
+
+    # Offline, with every scheme already in the on-disk cache
+    set_default_cache(SchemeDetailsCache(cache_dir / f"{size}.sqlite3"))
+    load_portfolio(data)
+    result["load_offline_ms"] = best_of(repeat, lambda: load_portfolio(data, offline=True))
+
+    portfolio = load_portfolio(data, offline=True)
+    schemes = portfolio.schemes
+    result["active_units_ms"] = best_of(
+        repeat,
+        lambda: [get_purchase_transactions_for_active_units(s.transactions) for s in schemes],
+    )
+    result["ltcg_summary_ms"] = best_of(
+        repeat, portfolio.ltcg_tax_harvesting_summary, setup=portfolio.invalidate
+    )
+    result["ltcg_summary_memoized_ms"] = best_of(repeat, portfolio.ltcg_tax_harvesting_summary)
+    result["ltcg_columnar_ms"] = best_of(
+        repeat, lambda: [analyze_ltcg_tax_harvesting_columnar(s) for s in schemes]
+    )
+    result["valuation_summary_ms"] = best_of(
+        repeat, portfolio.get_valuation_summary, setup=portfolio.invalidate
+    )
+    result["to_dict_ms"] = best_of(repeat, portfolio.to_dict, setup=portfolio.invalidate)
+    result["valuation_series_ms"] = best_of(
+        repeat, portfolio.valuation_series, setup=portfolio.invalidate
+    )
+
+    result["load_peak_mb"] = measure_peak_memory_mb(lambda: load_portfolio(data, offline=True))
+    result["analyses_peak_mb"] = measure_peak_memory_mb(
+        lambda: run_analyses(load_portfolio(data, offline=True))
+    )
+    result["compact_analyses_peak_mb"] = measure_peak_memory_mb(
+        lambda: run_analyses(load_portfolio(data, offline=True).compact())
+    )
+    return result
+
+
+def format_value(value) -> str:
+    return f"{value:.1f}" if isinstance(value, float) else str(value)
+
+
+def get_regressions(results, baseline, max_slowdown: float):
+    """Timings slower than max_slowdown times the baseline, for sizes present in both
+
+    Differences under MIN_REGRESSION_MS are ignored, sub millisecond timings are mostly noise.
+    """
+    baseline = {result["size"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["size"])
+        if previous is None:
+            continue
+        for key, value in result.items():
+            if key.endswith("_ms") and key != "generate_ms" and key in previous:
+                slower = value > previous[key] * max_slowdown
+                if slower and value - previous[key] > MIN_REGRESSION_MS:
+                    regressions.append((result["size"], key, previous[key], value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated API latency")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    parser.add_argument("--compare", type=Path, help="results file of an earlier run")
+    parser.add_argument("--max-slowdown", type=float, default=1.5)
+    args = parser.parse_args()
+    logger.setLevel(logging.WARNING)
+
+    results = []
+    with tempfile.TemporaryDirectory() as cache_dir, MFAPIStub(args.latency_ms / 1000):
+        try:
+            for size in args.sizes:
+                results.append(benchmark(size, args.repeat, Path(cache_dir)))
+        finally:
+            set_default_cache(None)
+
+    keys = [key for key in results[0] if key != "size"]
+    rows = [[key] + [format_value(result[key]) for result in results] for key in keys]
+    print(tabulate(rows, headers=["metric"] + args.sizes, disable_numparse=True))
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+    if args.compare:
+        regressions = get_regressions(
+            results, json.loads(args.compare.read_text()), args.max_slowdown
+        )
+        for size, key, previous, value in regressions:
+            print(f"REGRESSION {size} {key}: {previous:.1f} ms -> {value:.1f} ms")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Generator of realistic casparser-shaped CAS data, for benchmarks without real statements
+
+Every scheme gets a deterministic NAV history (a seeded random walk), so that the transactions in the
+generated statements and the NAVs served by benchmarks.mfapi_stub agree with each other.
+"""
+
+import datetime
+import random
+from decimal import Decimal
+from typing import List
+
+import numpy as np
+
+# (scheme_category as returned by mfapi, share of schemes)
+CATEGORIES = [
+    ("Equity Scheme - Large Cap Fund", 4),
+    ("Equity Scheme - Flexi Cap Fund", 3),
+    ("Equity Scheme - Mid Cap Fund", 2),
+    ("Equity Scheme - ELSS", 2),
+    ("Other Scheme - Index Funds", 2),
+    ("Debt Scheme - Liquid Fund", 2),
+    ("Debt Scheme - Corporate Bond Fund", 1),
+    ("Hybrid Scheme - Aggressive Hybrid Fund", 1),
+]
+
+FIRST_AMFI_CODE = 100000
+HISTORY_START = datetime.date(2008, 1, 1)
+STAMP_DUTY_START = datetime.date(2020, 7, 1)
+
+UNITS = Decimal("0.001")
+NAV = Decimal("0.0001")
+AMOUNT = Decimal("0.01")
+
+
+def get_scheme_category(amfi: int) -> str:
+    weighted = [category for category, share in CATEGORIES for _ in range(share)]
+    return weighted[amfi % len(weighted)]
+
+
+def get_nav_history(amfi: int, end: datetime.date = None) -> np.ndarray:
+    """Daily NAVs of a scheme from HISTORY_START to end (default today), rounded to 4 places"""
+    end = end or datetime.date.today()
+    days = (end - HISTORY_START).days + 1
+    rng = np.random.default_rng(amfi)
+    debt = get_scheme_category(amfi).startswith("Debt")
+    drift, volatility = (0.00025, 0.0005) if debt else (0.0004, 0.012)
+    returns = rng.normal(drift, volatility, days)
+    navs = (10 + amfi % 90) * np.exp(np.cumsum(returns))
+    return np.round(navs, 4)
+
+
+def _nav_on(navs: np.ndarray, date: datetime.date) -> Decimal:
+    return Decimal(str(navs[(date - HISTORY_START).days])).quantize(NAV)
+
+
+def _transaction(date, description, amount, units, nav, balance, type_, dividend_rate=None):
+    return {
+        "date": date,
+        "description": description,
+        "amount": amount,
+        "units": units,
+        "nav": nav,
+        "balance": balance,
+        "type": type_,
+        "dividend_rate": dividend_rate,
+    }
+
+
+def generate_scheme(
+    amfi: int,
+    years: float,
+    sip_interval_days: int,
+    redemptions_per_year: float,
+    switches_per_year: float,
+    rng: random.Random,
+    today: datetime.date,
+) -> dict:
+    navs = get_nav_history(amfi, today)
+    start = today - datetime.timedelta(days=int(years * 365))
+    sip_amount = Decimal(rng.choice([500, 1000, 2000, 2500, 5000, 10000]))
+    daily_disposal_probability = (redemptions_per_year + switches_per_year) / 365
+    switch_share = switches_per_year / max(redemptions_per_year + switches_per_year, 1e-9)
+
+    transactions: List[dict] = []
+    balance = Decimal("0.000")
+    date = start
+    next_sip = start
+    while date <= today:
+        nav = _nav_on(navs, date)
+        if date >= next_sip:
+            next_sip = date + datetime.timedelta(days=sip_interval_days)
+            lumpsum = rng.random() < 0.03
+            amount = sip_amount * (rng.randint(5, 20) if lumpsum else 1)
+            stamp_duty = Decimal("0.00")
+            if date >= STAMP_DUTY_START:
+                stamp_duty = (amount * Decimal("0.00005")).quantize(AMOUNT)
+            units = ((amount - stamp_duty) / nav).quantize(UNITS)
+            balance += units
+            transactions.append(
+                _transaction(
+                    date,
+                    "Purchase" if lumpsum else "SIP Purchase - Instalment",
+                    amount - stamp_duty,
+                    units,
+                    nav,
+                    balance,
+                    "PURCHASE" if lumpsum else "PURCHASE_SIP",
+                )
+            )
+            if stamp_duty:
+                transactions.append(
+                    _transaction(
+                        date,
+                        "*** Stamp Duty ***",
+                        stamp_duty,
+                        None,
+                        None,
+                        balance,
+                        "STAMP_DUTY_TAX",
+                    )
+                )
+        elif balance > 0 and rng.random() < daily_disposal_probability:
+            units = (balance * Decimal(rng.uniform(0.05, 0.5))).quantize(UNITS)
+            switch = rng.random() < switch_share
+            amount = (units * nav).quantize(AMOUNT)
+            balance -= units
+            transactions.append(
+                _transaction(
+                    date,
+                    "Switch Out" if switch else "Redemption",
+                    -amount,
+                    -units,
+                    nav,
+                    balance,
+                    "SWITCH_OUT" if switch else "REDEMPTION",
+                )
+            )
+        date += datetime.timedelta(days=1)
+
+    valuation_nav = _nav_on(navs, today)
+    return {
+        "scheme": f"Synthetic Fund {amfi} - Direct Plan - Growth",
+        "advisor": "DIRECT",
+        "rta_code": f"S{amfi}",
+        "rta": "CAMS",
+        "isin": f"INF{amfi:09d}",
+        "amfi": str(amfi),
+        "open": Decimal("0.000"),
+        "close": balance,
+        "close_calculated": balance,
+        "valuation": {
+            "date": today,
+            "nav": valuation_nav,
+            "value": (balance * valuation_nav).quantize(AMOUNT),
+        },
+        "transactions": transactions,
+    }
+
+
+def generate_cas_data(
+    folios: int = 2,
+    schemes_per_folio: int = 3,
+    years: float = 3,
+    sip_interval_days: int = 30,
+    redemptions_per_year: float = 0.5,
+    switches_per_year: float = 0.2,
+    seed: int = 0,
+) -> dict:
+    """Data in the shape returned by casparser.read_cas_pdf(..., output="dict")
+
+    Args:
+        folios (int): number of folios, one per AMC
+        schemes_per_folio (int): schemes held in every folio
+        years (float): years of history, every scheme starts its SIP that long ago
+        sip_interval_days (int): days between SIP instalments, 30 for monthly, 7 for weekly
+        redemptions_per_year (float): average redemptions per scheme per year
+        switches_per_year (float): average switch-outs per scheme per year
+        seed (int): seed for the random choices, the same seed generates the same data
+
+    Returns:
+        dict: casparser data dict
+    """
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    data_folios = []
+    for folio in range(folios):
+        schemes = [
+            generate_scheme(
+                FIRST_AMFI_CODE + folio * schemes_per_folio + scheme,
+                years,
+                sip_interval_days,
+                redemptions_per_year,
+                switches_per_year,
+                rng,
+                today,
+            )
+            for scheme in range(schemes_per_folio)
+        ]
+        data_folios.append(
+            {
+                "folio": f"{1000000 + folio} / 0",
+                "amc": f"Synthetic AMC {folio} Mutual Fund",
+                "PAN": "ABCDE1234F",
+                "KYC": "OK",
+                "PANKYC": "OK",
+                "schemes": schemes,
+            }
+        )
+
+    return {
+        "statement_period": {
+            "from": (today - datetime.timedelta(days=int(years * 365))).strftime("%d-%b-%Y"),
+            "to": today.strftime("%d-%b-%Y"),
+        },
+        "folios": data_folios,
+        "investor_info": {
+            "name": "Synthetic Investor",
+            "email": "investor@example.com",
+            "address": "1 Benchmark Road",
+            "mobile": "9999999999",
+        },
+        "cas_type": "DETAILED",
+        "file_type": "CAMS",
+    }
+
+
+def count_transactions(data: dict) -> int:
+    return sum(
+        len(scheme["transactions"]) for folio in data["folios"] for scheme in folio["schemes"]
+    )
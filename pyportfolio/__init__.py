@@ -1,7 +1,26 @@
-from .models import Scheme
-from .portfolio import Portfolio
-from .scheme_factory import create_scheme_from_casparser
-from .__version__ import __version__
-
 __author__ = "Kaushik S Kalmady / kaushiksk"
 __license__ = "MIT"
+
+# Public names are imported on first access, importing them pulls in casparser, pydantic etc.
+_LAZY_IMPORTS = {
+    "__version__": ".__version__",
+    "Portfolio": ".portfolio",
+    "Scheme": ".models",
+    "create_scheme_from_casparser": ".scheme_factory",
+}
+
+__all__ = ["Portfolio", "Scheme", "create_scheme_from_casparser", "__version__"]
+
+
+def __getattr__(name):
+    if name in _LAZY_IMPORTS:
+        import importlib
+
+        value = getattr(importlib.import_module(_LAZY_IMPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_IMPORTS))
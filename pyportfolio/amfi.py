@@ -0,0 +1,212 @@
+"""Scheme details for every scheme from AMFI's daily NAV file, instead of one API call per scheme
+
+AMFI publishes the latest NAV of every scheme in a single text file, grouped under category and
+fund house headings:
+
+    Scheme Code;ISIN Div Payout/ ISIN Growth;ISIN Div Reinvestment;Scheme Name;Net Asset Value;Date
+
+    Open Ended Schemes(Equity Scheme - Large Cap Fund)
+
+    Axis Mutual Fund
+
+    120465;INF846K01EW2;-;Axis Bluechip Fund - Direct Plan - Growth;58.27;17-Oct-2024
+
+The file is parsed once into a table indexed by AMFI code and ISIN, with entries shaped like the
+scheme details of mfhelper.get_scheme_details, and kept on disk so it is downloaded once a day.
+"""
+
+import re
+import time
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from . import metrics
+from .cache import (
+    DEFAULT_NAV_TTL,
+    SchemeDetailsNotCached,
+    dump_compressed,
+    get_cache_dir,
+    load_compressed,
+)
+from .utils import logger
+
+AMFI_NAV_URL = "https://www.amfiindia.com/spages/NAVAll.txt"
+AMFI_CACHE_FILE = Path("amfi") / "NAVAll.pickle.gz"
+DOWNLOAD_TIMEOUT = 60  # seconds
+
+# e.g. "Open Ended Schemes(Debt Scheme - Banking and PSU Fund)"
+CATEGORY_HEADER = re.compile(r"^(.*Schemes?)\s*\((.+)\)$")
+NO_ISIN = "-"
+
+
+def parse_nav_file(lines: Iterable[str]) -> List[dict]:
+    """Scheme details of every scheme with a NAV in the lines of an AMFI NAV file
+
+    Args:
+        lines (Iterable[str]): lines of NAVAll.txt
+
+    Returns:
+        List[dict]: scheme details, with the keys of mfapi's meta along with nav, date and ISINs
+    """
+    schemes = []
+    scheme_type, scheme_category, fund_house = None, None, None
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("Scheme Code"):
+            continue
+
+        fields = line.split(";")
+        if len(fields) < 6:
+            header = CATEGORY_HEADER.match(line)
+            if header:
+                scheme_type, scheme_category = header.group(1).strip(), header.group(2).strip()
+            else:
+                fund_house = line
+            continue
+
+        code, isin_growth, isin_div_reinvestment, name, nav, date = (f.strip() for f in fields[:6])
+        try:
+            Decimal(nav)
+        except InvalidOperation:
+            continue  # "N.A." for schemes without a NAV
+        if not code.isdigit() or scheme_category is None:
+            continue
+
+        schemes.append(
+            {
+                "fund_house": fund_house,
+                "scheme_type": scheme_type,
+                "scheme_category": scheme_category,
+                "scheme_code": int(code),
+                "scheme_name": name,
+                "isin_growth": None if isin_growth == NO_ISIN else isin_growth,
+                "isin_div_reinvestment": (
+                    None if isin_div_reinvestment == NO_ISIN else isin_div_reinvestment
+                ),
+                "nav": nav,
+                "date": date,
+            }
+        )
+
+    return schemes
+
+
+class AMFINavMaster:
+    """Scheme details of every scheme in an AMFI NAV file, looked up by AMFI code or ISIN"""
+
+    def __init__(self, schemes: List[dict], updated: Optional[float] = None) -> None:
+        self.updated = updated if updated is not None else time.time()
+        # Local file the schemes were parsed from, None if they were downloaded
+        self.path = None
+        self.by_amfi: Dict[str, dict] = {}
+        self.by_isin: Dict[str, dict] = {}
+        for scheme in schemes:
+            self.by_amfi[str(scheme["scheme_code"])] = scheme
+            for isin in (scheme["isin_growth"], scheme["isin_div_reinvestment"]):
+                if isin:
+                    self.by_isin[isin] = scheme
+
+    @classmethod
+    def from_file(cls, path) -> "AMFINavMaster":
+        """Parse a NAVAll.txt downloaded earlier"""
+        with metrics.span("amfi.parse"), open(path, encoding="utf-8", errors="replace") as f:
+            master = cls(parse_nav_file(f))
+        master.path = path
+        logger.info(f"Loaded NAVs of {len(master)} schemes from {path}")
+        return master
+
+    @classmethod
+    def download(cls, url: Optional[str] = None) -> "AMFINavMaster":
+        """Download and parse the latest NAV file, from AMFI_NAV_URL unless given another url
+
+        Raises:
+            requests.RequestException if the download fails
+        """
+        from .mfhelper import get_session
+
+        logger.info("Downloading NAVs of all schemes from AMFI")
+        with metrics.span("amfi.download"):
+            response = get_session().get(url or AMFI_NAV_URL, timeout=DOWNLOAD_TIMEOUT)
+            response.raise_for_status()
+        with metrics.span("amfi.parse"):
+            return cls(parse_nav_file(response.text.splitlines()))
+
+    @classmethod
+    def load(
+        cls,
+        path=None,
+        offline: bool = False,
+        max_age: float = DEFAULT_NAV_TTL,
+        cache_path=None,
+    ) -> "AMFINavMaster":
+        """NAV file from the given path, or the copy cached on disk while it is fresh
+
+        A stale or missing cached copy is replaced with a single download of the latest file. If
+        the download fails, a stale copy is used instead.
+
+        Args:
+            path: local NAVAll.txt to parse instead of using the cached or downloaded file
+            offline (bool): only use the cached copy, irrespective of its age
+            max_age (float): seconds after which the cached copy is downloaded again
+            cache_path: file to keep the parsed table in, defaults to one in the cache directory
+
+        Returns:
+            AMFINavMaster
+
+        Raises:
+            SchemeDetailsNotCached in offline mode without a cached copy
+            requests.RequestException if the download fails without a cached copy
+        """
+        if path is not None:
+            return cls.from_file(path)
+
+        cache_path = Path(cache_path) if cache_path else get_cache_dir() / AMFI_CACHE_FILE
+        cached = cls.__load_cached(cache_path)
+        if cached is not None and (offline or time.time() - cached.updated < max_age):
+            return cached
+
+        if offline:
+            raise SchemeDetailsNotCached("AMFI NAV file is not cached, load it once while online")
+
+        import requests
+
+        try:
+            master = cls.download()
+        except requests.RequestException as e:
+            if cached is None:
+                raise
+            logger.warning(f"Using stale AMFI NAV file: {e}")
+            return cached
+
+        master.save(cache_path)
+        return master
+
+    @classmethod
+    def __load_cached(cls, cache_path: Path) -> Optional["AMFINavMaster"]:
+        try:
+            cached = load_compressed(cache_path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable AMFI NAV cache: {e}")
+            return None
+        return cls(cached["schemes"], cached["updated"])
+
+    def save(self, cache_path) -> None:
+        try:
+            dump_compressed(
+                {"updated": self.updated, "schemes": list(self.by_amfi.values())}, cache_path
+            )
+        except OSError as e:
+            logger.warning(f"Could not cache AMFI NAV file: {e}")
+
+    def get(self, amfi_id=None, isin: Optional[str] = None) -> Optional[dict]:
+        """Scheme details by AMFI code, or by ISIN for codes missing from the file"""
+        details = self.by_amfi.get(str(amfi_id)) if amfi_id is not None else None
+        if details is None and isin:
+            details = self.by_isin.get(isin)
+        return details
+
+    def __len__(self) -> int:
+        return len(self.by_amfi)
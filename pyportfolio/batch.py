@@ -0,0 +1,128 @@
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple
+
+from casparser.encoder import CASDataEncoder
+
+from . import metrics
+from .amfi import AMFINavMaster
+from .cache import CASDataCache
+from .constants import DEFAULT_MAX_WORKERS
+from .portfolio import Portfolio, read_cas_data
+from .utils import logger
+
+CASFileEntry = Tuple[Path, str]
+
+
+def get_cas_files(source, password: Optional[str] = None) -> List[CASFileEntry]:
+    """List CAS pdfs to analyze, with their passwords
+
+    Args:
+        source: directory of CAS pdfs, all sharing the given password, or a manifest file. The
+            manifest is a CSV with "path" and "password" columns, or JSON lines with the same keys.
+            Relative paths are resolved against the manifest's directory.
+        password (Optional[str]): password for every pdf in a directory
+
+    Returns:
+        List[CASFileEntry]: (path, password) of every CAS pdf
+    """
+    source = Path(source)
+    if source.is_dir():
+        if password is None:
+            raise ValueError("A password is needed to analyze a directory of CAS pdfs")
+        return [
+            (path, password) for path in sorted(source.iterdir()) if path.suffix.lower() == ".pdf"
+        ]
+
+    with open(source, newline="") as f:
+        if source.suffix in (".jsonl", ".json"):
+            entries = [json.loads(line) for line in f if line.strip()]
+        else:
+            entries = list(csv.DictReader(f))
+
+    return [(source.parent / entry["path"], entry["password"]) for entry in entries]
+
+
+def _parse_cas_file(
+    cas_file: Path, cas_password: str, use_cas_cache: bool = False
+) -> Tuple[dict, float]:
+    """Runs in the worker processes, only the PDF parsing is done there
+
+    Metrics recorded in the workers are lost, so the parse time is returned along with the data.
+    """
+    start = time.perf_counter()
+    data = read_cas_data(cas_file, cas_password, CASDataCache() if use_cas_cache else None)
+    return data, time.perf_counter() - start
+
+
+def analyze_cas_files(
+    cas_files: Iterable[CASFileEntry],
+    output: TextIO,
+    max_processes: Optional[int] = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    offline: bool = False,
+    nav_master: Optional[AMFINavMaster] = None,
+    use_cas_cache: bool = False,
+) -> Dict[str, int]:
+    """Parse CAS pdfs across a process pool and write one JSON line per pdf as soon as it is done
+
+    Worker processes only parse the pdfs. Schemes are resolved in this process against a single
+    scheme details lookup, so a scheme held in many portfolios is fetched only once. A pdf that
+    fails to parse or load is written as an error line and doesn't stop the run.
+
+    Args:
+        cas_files (Iterable[CASFileEntry]): (path, password) of every CAS pdf
+        output (TextIO): file to write JSON lines into
+        max_processes (Optional[int]): number of parser processes, defaults to the CPU count
+        max_workers (int): number of concurrent scheme detail requests
+        offline (bool): resolve scheme details only from the on-disk cache
+        nav_master (Optional[AMFINavMaster]): AMFI NAV file to resolve schemes from, so that
+            only schemes missing from it are fetched from the API
+        use_cas_cache (bool): reuse earlier parsing results for the same pdf and password, stored
+            unencrypted in the cache directory
+
+    Returns:
+        Dict[str, int]: count of analyzed and failed pdfs
+    """
+    scheme_details: Dict[str, Optional[dict]] = {}
+    counts = {"ok": 0, "error": 0}
+
+    with ProcessPoolExecutor(max_workers=max_processes) as executor:
+        futures = {
+            executor.submit(_parse_cas_file, cas_file, cas_password, use_cas_cache): cas_file
+            for cas_file, cas_password in cas_files
+        }
+        for future in as_completed(futures):
+            cas_file = futures[future]
+            record = {"file": str(cas_file)}
+            try:
+                data, parse_seconds = future.result()
+                collector = metrics.get_metrics()
+                if collector is not None:
+                    collector.record("batch.parse", parse_seconds)
+
+                portfolio = Portfolio.from_cas_data(
+                    data,
+                    max_workers=max_workers,
+                    offline=offline,
+                    scheme_details=scheme_details,
+                    nav_master=nav_master,
+                )
+                record.update(
+                    status="ok",
+                    portfolio=portfolio.to_dict(),
+                    ltcg=portfolio.ltcg_tax_harvesting_summary(),
+                    valuation=portfolio.get_valuation_summary(),
+                )
+            except Exception as e:
+                logger.error(f"Failed to analyze {cas_file}: {e}")
+                record.update(status="error", error=f"{type(e).__name__}: {e}")
+
+            counts[record["status"]] += 1
+            output.write(json.dumps(record, cls=CASDataEncoder) + "\n")
+            output.flush()
+
+    return counts
@@ -0,0 +1,251 @@
+import gzip
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, NamedTuple, Optional
+
+from .utils import logger
+
+CACHE_DIR_ENV = "PYPORTFOLIO_CACHE_DIR"
+SCHEME_CACHE_FILE = "schemes.sqlite3"
+CAS_CACHE_DIR = "cas"
+
+# Scheme categories almost never change, NAVs are published once a day
+DEFAULT_META_TTL = 30 * 24 * 60 * 60  # seconds
+DEFAULT_NAV_TTL = 12 * 60 * 60  # seconds
+DEFAULT_MAX_ENTRIES = 20000
+
+
+class SchemeDetailsNotCached(LookupError):
+    """Raised in offline mode when scheme details for a code were never cached"""
+
+
+def get_cache_dir() -> Path:
+    """Returns the per-user cache directory for pyportfolio
+
+    Can be overridden with the PYPORTFOLIO_CACHE_DIR environment variable.
+    """
+    if os.environ.get(CACHE_DIR_ENV):
+        return Path(os.environ[CACHE_DIR_ENV])
+
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local"
+    elif sys.platform == "darwin":
+        base = Path.home() / "Library" / "Caches"
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+
+    return Path(base) / "pyportfolio"
+
+
+class CachedSchemeDetails(NamedTuple):
+    details: Optional[dict]
+    meta_updated: float
+    nav_updated: Optional[float]
+
+
+class SchemeDetailsCache:
+    """SQLite backed cache for mfhelper.get_scheme_details results
+
+    Scheme metadata (category, name etc.) and NAVs expire independently, an expired NAV of a scheme
+    whose metadata is fresh is refreshed on its own with put_nav. Once the cache holds more than
+    max_entries schemes, the least recently used ones are evicted.
+    """
+
+    def __init__(
+        self,
+        path=None,
+        meta_ttl: float = DEFAULT_META_TTL,
+        nav_ttl: float = DEFAULT_NAV_TTL,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        self.path = Path(path) if path is not None else get_cache_dir() / SCHEME_CACHE_FILE
+        self.meta_ttl = meta_ttl
+        self.nav_ttl = nav_ttl
+        self.max_entries = max_entries
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS schemes (
+                    amfi TEXT PRIMARY KEY,
+                    meta TEXT,
+                    meta_updated REAL NOT NULL,
+                    nav TEXT,
+                    nav_updated REAL,
+                    accessed REAL NOT NULL
+                )""")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS schemes_accessed ON schemes (accessed)"
+            )
+
+    def get(self, amfi_id) -> Optional[CachedSchemeDetails]:
+        """Returns the cached entry for a scheme code, irrespective of its age"""
+        code = str(amfi_id)
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT meta, meta_updated, nav, nav_updated FROM schemes WHERE amfi = ?", (code,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE schemes SET accessed = ? WHERE amfi = ?", (time.time(), code)
+            )
+
+        meta, meta_updated, nav, nav_updated = row
+        details = None
+        if meta is not None:
+            details = json.loads(meta)
+            details["nav"] = nav
+
+        return CachedSchemeDetails(details, meta_updated, nav_updated)
+
+    def is_meta_fresh(self, entry: CachedSchemeDetails) -> bool:
+        """Whether the metadata of a cached entry hasn't expired, irrespective of its NAV"""
+        return time.time() - entry.meta_updated < self.meta_ttl
+
+    def is_fresh(self, entry: CachedSchemeDetails) -> bool:
+        """Whether neither the metadata nor the NAV of a cached entry has expired"""
+        if not self.is_meta_fresh(entry):
+            return False
+        if entry.details is None:
+            # Unknown scheme codes are remembered for as long as metadata is
+            return True
+        return entry.nav_updated is not None and time.time() - entry.nav_updated < self.nav_ttl
+
+    def put(self, amfi_id, details: Optional[dict]) -> None:
+        """Stores scheme details (None for unknown codes) and evicts old entries if needed"""
+        code = str(amfi_id)
+        now = time.time()
+        meta, nav, nav_updated = None, None, None
+        if details is not None:
+            meta = {key: value for key, value in details.items() if key != "nav"}
+            meta = json.dumps(meta)
+            nav = details.get("nav")
+            nav_updated = now
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO schemes VALUES (?, ?, ?, ?, ?, ?)",
+                (code, meta, now, nav, nav_updated, now),
+            )
+            self.__evict()
+
+    def put_nav(self, amfi_id, nav) -> None:
+        """Updates only the NAV of an already cached scheme"""
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE schemes SET nav = ?, nav_updated = ?, accessed = ? WHERE amfi = ?",
+                (str(nav), now, now, str(amfi_id)),
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM schemes")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM schemes").fetchone()[0]
+
+    def __evict(self):
+        excess = self._connection.execute("SELECT COUNT(*) FROM schemes").fetchone()[0]
+        excess -= self.max_entries
+        if excess > 0:
+            self._connection.execute(
+                "DELETE FROM schemes WHERE amfi IN "
+                "(SELECT amfi FROM schemes ORDER BY accessed LIMIT ?)",
+                (excess,),
+            )
+
+
+_default_cache = None
+_default_cache_initialized = False
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> Optional[SchemeDetailsCache]:
+    """Returns the process wide scheme details cache, or None if caching is unavailable"""
+    global _default_cache, _default_cache_initialized
+    with _default_cache_lock:
+        if not _default_cache_initialized:
+            try:
+                _default_cache = SchemeDetailsCache()
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"Scheme details cache unavailable, continuing without it: {e}")
+                _default_cache = None
+            _default_cache_initialized = True
+
+    return _default_cache
+
+
+def set_default_cache(cache: Optional[SchemeDetailsCache]) -> None:
+    """Replaces the process wide scheme details cache. Pass None to disable caching"""
+    global _default_cache, _default_cache_initialized
+    with _default_cache_lock:
+        _default_cache = cache
+        _default_cache_initialized = True
+
+
+def dump_compressed(obj: Any, path) -> None:
+    """Writes obj to path as a gzipped pickle, which keeps Decimal and date values exact
+
+    The file is written to a temporary path first so readers never see partial files.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+    with gzip.open(tmp_path, "wb", compresslevel=6) as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_compressed(path) -> Any:
+    """Reads an object written by dump_compressed. Only load files you wrote yourself"""
+    with gzip.open(path, "rb") as f:
+        return pickle.load(f)
+
+
+class CASDataCache:
+    """Cache of casparser output, keyed by the SHA-256 of the PDF bytes and its password
+
+    A different password, right or wrong, is a miss and goes through casparser's password check.
+    Entries are decrypted statements stored unencrypted, so nothing caches them unless asked to.
+    """
+
+    def __init__(self, directory=None) -> None:
+        self.directory = (
+            Path(directory) if directory is not None else get_cache_dir() / CAS_CACHE_DIR
+        )
+
+    @staticmethod
+    def key(pdf_bytes: bytes, password: str) -> str:
+        digest = hashlib.sha256(pdf_bytes)
+        digest.update(b"\0" + str(password).encode())
+        return digest.hexdigest()
+
+    def __path(self, key: str) -> Path:
+        return self.directory / f"{key}.pickle.gz"
+
+    def get(self, key: str) -> Optional[dict]:
+        """Returns the cached casparser data dict, or None if the statement was never parsed"""
+        try:
+            return load_compressed(self.__path(key))
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logger.warning(f"Ignoring unreadable CAS cache entry {key}: {e}")
+            return None
+
+    def put(self, key: str, data: dict) -> None:
+        try:
+            dump_compressed(data, self.__path(key))
+        except OSError as e:
+            logger.warning(f"Could not cache parsed CAS data: {e}")
@@ -1,43 +1,172 @@
 import locale
 import logging
+import sys
 
 import click
-import cutie
 
-from .clihelper import ltcg_tax_harvesting_summary, valuation_summary
-from .portfolio import Portfolio
+from . import metrics
+from .constants import DEFAULT_MAX_WORKERS
 from .utils import logger
 
+# Modules needed by the commands (casparser, pydantic, requests, cutie, tabulate etc.) are imported
+# only when a command runs, so that "-h" and argument errors stay fast
+
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 
 
-@click.command(name="portfolio-cli", context_settings=CONTEXT_SETTINGS)
+jobs_option = click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=DEFAULT_MAX_WORKERS,
+    show_default=True,
+    help="Number of concurrent requests while fetching scheme details",
+)
+offline_option = click.option(
+    "--offline",
+    is_flag=True,
+    help="Use only cached scheme details and NAVs, without calling the API",
+)
+
+amfi_navs_option = click.option(
+    "--amfi-navs",
+    is_flag=True,
+    help="Resolve schemes from AMFI's daily NAV file, downloaded at most once a day",
+)
+amfi_nav_file_option = click.option(
+    "--amfi-nav-file",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    metavar="NAV_FILE",
+    help="Resolve schemes from a NAVAll.txt downloaded from AMFI (implies --amfi-navs)",
+)
+cache_statements_option = click.option(
+    "--cache-statements",
+    is_flag=True,
+    help="Keep parsed statements, unencrypted, in the cache directory to skip parsing them again",
+)
+profile_option = click.option(
+    "--profile",
+    is_flag=True,
+    help="Print a per-phase breakdown of time spent and counters on exit",
+)
+profile_json_option = click.option(
+    "--profile-json",
+    type=click.File("w"),
+    default=None,
+    metavar="FILE",
+    help="Write the per-phase timings and counters as JSON into FILE (implies --profile)",
+)
+
+
+def load_nav_master(amfi_navs, amfi_nav_file, offline):
+    if not (amfi_navs or amfi_nav_file):
+        return None
+
+    from .amfi import AMFINavMaster
+
+    return AMFINavMaster.load(amfi_nav_file, offline=offline)
+
+
+def start_profiling(profile, profile_json):
+    if profile or profile_json:
+        metrics.enable()
+
+
+def finish_profiling(profile_json):
+    collector = metrics.get_metrics()
+    if collector is None:
+        return
+
+    click.echo(collector.report(), err=True)
+    if profile_json:
+        profile_json.write(collector.to_json())
+
+
+@click.group(name="portfolio-cli", context_settings=CONTEXT_SETTINGS, invoke_without_command=True)
 @click.option(
     "-f",
     "--caspdf",
     type=click.Path(exists=True),
     metavar="CAS_PDF_FILE",
-    prompt="CAS PDF File Path",
 )
-def main(caspdf):
+@jobs_option
+@click.option(
+    "-P",
+    "--processes",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of processes extracting the text of long statements  [default: CPU count]",
+)
+@offline_option
+@amfi_navs_option
+@amfi_nav_file_option
+@cache_statements_option
+@profile_option
+@profile_json_option
+@click.pass_context
+def main(
+    ctx,
+    caspdf,
+    jobs,
+    processes,
+    offline,
+    amfi_navs,
+    amfi_nav_file,
+    cache_statements,
+    profile,
+    profile_json,
+):
+    """Analyze a CAS pdf interactively, or run one of the commands below"""
+    if ctx.invoked_subcommand is not None:
+        return
+
+    start_profiling(profile, profile_json)
+
+    import cutie
+    from casparser.exceptions import CASParseError
+
+    from .clihelper import (
+        ltcg_tax_harvesting_summary,
+        realized_gains_summary,
+        valuation_summary,
+    )
+    from .portfolio import Portfolio
+
     logger.setLevel(logging.INFO)
     locale.setlocale(locale.LC_MONETARY, "en_IN")
 
+    if caspdf is None:
+        caspdf = click.prompt("CAS PDF File Path", type=click.Path(exists=True))
+
     password = cutie.secure_input("Please enter the pdf password:")
 
-    portfolio = Portfolio(
-        caspdf,
-        password,
-    )
+    logger.info("Parsing CAS File")
+    try:
+        portfolio = Portfolio.from_cas_pdf(
+            caspdf,
+            password,
+            max_workers=jobs,
+            offline=offline,
+            nav_master=load_nav_master(amfi_navs, amfi_nav_file, offline),
+            processes=processes,
+            use_cas_cache=cache_statements,
+        )
+    except CASParseError as e:
+        logger.error(e)
+        logger.error("Aborting!")
+        sys.exit()
 
     # Options
     LTCG_TAX_HARVEST = "LTGC Tax Harvesting"
     VALUATION = "Portfolio Valuation"
+    REALIZED_GAINS = "Realized Capital Gains"
     EXIT = "Exit"
 
     options = [
         LTCG_TAX_HARVEST,
         VALUATION,
+        REALIZED_GAINS,
         EXIT,
     ]
 
@@ -48,9 +177,108 @@ def main(caspdf):
             ltcg_tax_harvesting_summary(portfolio)
         elif option == VALUATION:
             valuation_summary(portfolio)
+        elif option == REALIZED_GAINS:
+            realized_gains_summary(portfolio)
         elif option == EXIT:
             break
 
+    finish_profiling(profile_json)
+
+
+@main.command(name="batch")
+@click.argument("source", type=click.Path(exists=True), metavar="DIRECTORY_OR_MANIFEST")
+@click.option(
+    "-p",
+    "--password",
+    help="Password of every CAS pdf when analyzing a directory",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.File("w"),
+    default="-",
+    help="JSON lines file to write results into (default: stdout)",
+)
+@click.option(
+    "-P",
+    "--processes",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of processes parsing pdfs (default: CPU count)",
+)
+@jobs_option
+@offline_option
+@amfi_navs_option
+@amfi_nav_file_option
+@cache_statements_option
+@profile_option
+@profile_json_option
+def batch(
+    source,
+    password,
+    output,
+    processes,
+    jobs,
+    offline,
+    amfi_navs,
+    amfi_nav_file,
+    cache_statements,
+    profile,
+    profile_json,
+):
+    """Analyze many CAS pdfs, from a directory or a CSV/JSONL manifest of path and password"""
+    from .batch import analyze_cas_files, get_cas_files
+
+    start_profiling(profile, profile_json)
+
+    try:
+        cas_files = get_cas_files(source, password)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+    counts = analyze_cas_files(
+        cas_files,
+        output,
+        max_processes=processes,
+        max_workers=jobs,
+        offline=offline,
+        nav_master=load_nav_master(amfi_navs, amfi_nav_file, offline),
+        use_cas_cache=cache_statements,
+    )
+    logger.info(f"Analyzed {counts['ok']} CAS pdfs, {counts['error']} failed")
+    finish_profiling(profile_json)
+    if counts["error"]:
+        sys.exit(1)
+
+
+@main.command(name="serve")
+@click.option("--host", default="127.0.0.1", show_default=True, help="Address to listen on")
+@click.option("--port", type=int, default=8000, show_default=True, help="Port to listen on")
+@jobs_option
+@offline_option
+@amfi_navs_option
+@amfi_nav_file_option
+@cache_statements_option
+@profile_option
+@profile_json_option
+def serve(
+    host, port, jobs, offline, amfi_navs, amfi_nav_file, cache_statements, profile, profile_json
+):
+    """Serve LTCG and valuation summaries of uploaded CAS pdfs over HTTP, keeping them in memory"""
+    from .server import AnalysisService, run_server
+
+    start_profiling(profile, profile_json)
+    logger.setLevel(logging.INFO)
+
+    service = AnalysisService(
+        max_workers=jobs,
+        offline=offline,
+        nav_master=load_nav_master(amfi_navs, amfi_nav_file, offline),
+        use_cas_cache=cache_statements,
+    )
+    run_server(service, host, port)
+    finish_profiling(profile_json)
+
 
 if __name__ == "__main__":
     main(prog_name="portfolio-cli")
@@ -1,14 +1,29 @@
-from decimal import Decimal
 import locale
-from collections import defaultdict
+from decimal import Decimal, InvalidOperation
 
 import click
 import cutie
 import tabulate
 
+from .constants import LTCG_EXEMPTION
 from .portfolio import Portfolio
 
 
+class DecimalParamType(click.ParamType):
+    name = "amount"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, Decimal):
+            return value
+        try:
+            amount = Decimal(str(value).replace(",", "").strip())
+        except InvalidOperation:
+            self.fail(f"{value!r} is not a valid amount", param, ctx)
+        if not amount.is_finite() or amount < 0:
+            self.fail(f"{value!r} is not a valid amount", param, ctx)
+        return amount
+
+
 def ltcg_tax_harvesting_summary(portfolio: Portfolio):
     summary = portfolio.ltcg_tax_harvesting_summary()
 
@@ -73,6 +88,44 @@ def ltcg_tax_harvesting_summary(portfolio: Portfolio):
             print(tabulate.tabulate(rows, header, tablefmt="grid"))
             print("\n")
 
+    if cutie.prompt_yes_or_no("Plan sales that keep this FY's LTCG within the exemption?"):
+        ltcg_harvesting_plan(portfolio)
+
+
+def ltcg_harvesting_plan(portfolio: Portfolio):
+    exemption = click.prompt(
+        "Yearly LTCG exemption", default=str(LTCG_EXEMPTION), type=DecimalParamType()
+    )
+    plan = portfolio.ltcg_harvesting_plan(exemption=exemption)
+
+    print(
+        click.style("\nLTCG already realized this FY: ", bold=True)
+        + click.style(locale.currency(plan["realized_ltcg"], grouping=True), bold=True)
+    )
+    print(
+        click.style("LTCG to harvest: ", bold=True)
+        + click.style(locale.currency(plan["ltcg"], grouping=True), bold=True, fg="green")
+        + click.style(f" in {plan['orders']} sell orders worth ", bold=True)
+        + click.style(locale.currency(plan["amount"], grouping=True), bold=True, fg="green")
+    )
+    if not plan["schemes"]:
+        return
+
+    header = ["scheme", "units", "nav", "amount", "ltcg"]
+    rows = [[sale[key] for key in header] for sale in plan["schemes"]]
+    print(tabulate.tabulate(rows, header, tablefmt="fancy_grid"))
+
+    if cutie.prompt_yes_or_no("Show the lots every sale takes units from?"):
+        for sale in plan["schemes"]:
+            print(click.style(sale["scheme"], bold=True))
+            rows = [lot.values() for lot in sale["lots"]]
+            print(tabulate.tabulate(rows, sale["lots"][0].keys(), tablefmt="grid"))
+            print()
+
+
+def format_rate(rate) -> str:
+    return "-" if rate is None else "{0:.2f}%".format(rate * 100)
+
 
 def valuation_summary(portfolio: Portfolio):
     summary = portfolio.get_valuation_summary()
@@ -90,17 +143,18 @@ def valuation_summary(portfolio: Portfolio):
     print(click.style("Debt  : " + " {0:.2f}%".format(debt_percentage), bold=True))
     print(click.style("Equity: " + " {0:.2f}%".format(equity_percentage), bold=True))
 
+    returns = summary["returns"]
+    print(click.style("\nXIRR  : " + format_rate(returns["xirr"]), bold=True))
+    for scheme_type, type_returns in returns["types"].items():
+        print(click.style(" {0:<25} - {1}".format(scheme_type, format_rate(type_returns["xirr"]))))
+
     if cutie.prompt_yes_or_no("Show subtype breakup for debt and equity?"):
         print()
 
         def print_subtypes_summary(summary, title):
-            subtypes = defaultdict(Decimal)
-            subtype_counts = defaultdict(int)
-            for scheme in summary["schemes"]:
-                subtypes[scheme["subtype"]] += scheme["valuation"]
-                subtype_counts[scheme["subtype"]] += 1
-
-            subtypes = sorted(subtypes.items(), key=lambda x: x[1], reverse=True)
+            subtypes = sorted(
+                summary["subtypes"].items(), key=lambda x: x[1]["valuation"], reverse=True
+            )
 
             valuation = summary["valuation"]
             valuation_percentage = (valuation * 100) / total_valuation
@@ -113,11 +167,12 @@ def valuation_summary(portfolio: Portfolio):
                     bold=True,
                 )
             )
-            for subtype, subtype_valuation in subtypes:
+            for subtype, subtype_summary in subtypes:
+                subtype_valuation = subtype_summary["valuation"]
                 print(
                     click.style(
                         " {0:<25} - {1} ({2:.2f}%)".format(
-                            subtype + " ({})".format(subtype_counts[subtype]),
+                            subtype + " ({})".format(subtype_summary["schemes"]),
                             click.style(
                                 locale.currency(subtype_valuation, grouping=True),
                                 fg="green",
@@ -132,3 +187,31 @@ def valuation_summary(portfolio: Portfolio):
 
         print_subtypes_summary(debt_summary, "Debt")
         print_subtypes_summary(equity_summary, "Equity")
+
+
+def realized_gains_summary(portfolio: Portfolio):
+    summary = portfolio.realized_gains_summary()
+    financial_years = summary["financial_years"]
+    if not financial_years:
+        print(click.style("\nNo redemptions found", bold=True))
+        return
+
+    print(
+        click.style("\nTotal STCG: ", bold=True)
+        + click.style(locale.currency(summary["stcg"], grouping=True), bold=True, fg="green")
+    )
+    print(
+        click.style("Total LTCG: ", bold=True)
+        + click.style(locale.currency(summary["ltcg"], grouping=True), bold=True, fg="green")
+    )
+
+    header = ["financial_year", "sale_value", "cost", "stcg", "ltcg"]
+    rows = [[year[key] for key in header] for year in financial_years]
+    print(tabulate.tabulate(rows, header, tablefmt="fancy_grid"))
+
+    if cutie.prompt_yes_or_no("Show scheme wise break-up of every financial year?"):
+        header = ["scheme", "type", "sale_value", "cost", "stcg", "ltcg"]
+        for year in financial_years:
+            print(click.style(f"\nFY {year['financial_year']}", bold=True))
+            rows = [[scheme[key] for key in header] for scheme in year["schemes"]]
+            print(tabulate.tabulate(rows, header, tablefmt="grid"))
@@ -0,0 +1,457 @@
+"""Columnar NumPy representation of scheme transactions for vectorized analytics
+
+Quantities are stored as int64 fixed-point numbers so that results match the Decimal
+computations in scheme_utils exactly:
+    - units and NAVs are held to 4 decimal places (CAS statements report units to 3 places and
+      NAVs to 4), amounts to paise.
+    - inputs with more decimal places are rounded half-even to that precision, all arithmetic after
+      that is exact integer arithmetic and is converted back to Decimal without rounding.
+"""
+
+import datetime
+from decimal import ROUND_HALF_EVEN, Decimal
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from casparser.enums import TransactionType
+
+from . import metrics
+from .lots import ACQUISITION_TYPES, DISPOSAL_TYPES
+from .models import Scheme, Transaction
+from .scheme_utils import get_ltcg_holding_days
+from .utils import logger
+
+UNITS_DECIMALS = 4
+NAV_DECIMALS = 4
+AMOUNT_DECIMALS = 2
+
+TYPE_CODES = {transaction_type.value: code for code, transaction_type in enumerate(TransactionType)}
+ACQUISITION_CODES = np.array([TYPE_CODES[t] for t in sorted(ACQUISITION_TYPES)], dtype=np.int8)
+DISPOSAL_CODES = np.array([TYPE_CODES[t] for t in sorted(DISPOSAL_TYPES)], dtype=np.int8)
+REVERSAL_CODE = TYPE_CODES[TransactionType.REVERSAL.value]
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+_INT64_MAX = np.iinfo(np.int64).max
+
+
+def to_fixed(value, decimals: int) -> int:
+    """Decimal (or None) to an integer with the given number of implied decimal places"""
+    if value is None:
+        return 0
+    return int(Decimal(value).scaleb(decimals).to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+def from_fixed(value, decimals: int) -> Decimal:
+    """Integer with the given number of implied decimal places back to an exact Decimal"""
+    return Decimal(int(value)).scaleb(-decimals)
+
+
+def to_datetime64(date: datetime.date) -> np.datetime64:
+    return np.datetime64(date.toordinal() - _EPOCH_ORDINAL, "D")
+
+
+def _multiply(a: np.ndarray, b) -> np.ndarray:
+    """Exact elementwise product, falling back to Python ints if int64 could overflow"""
+    if len(a) == 0:
+        return a
+    bound = int(np.abs(a).max()) * int(np.abs(b).max())
+    if bound > _INT64_MAX:
+        return a.astype(object) * (b.astype(object) if isinstance(b, np.ndarray) else int(b))
+    return a * b
+
+
+class TransactionTable:
+    """Transactions of a scheme as columns, sorted by date
+
+    Attributes:
+        dates: datetime64[D] transaction dates
+        types: int8 codes from TYPE_CODES
+        units: int64 units with UNITS_DECIMALS implied decimals (0 for transactions without units)
+        navs: int64 NAVs with NAV_DECIMALS implied decimals
+        amounts: int64 amounts in paise
+        index: position of every row in the source transaction list
+    """
+
+    __slots__ = ("dates", "types", "units", "navs", "amounts", "index", "_open_units")
+
+    def __init__(self, dates, types, units, navs, amounts, index) -> None:
+        self.dates = dates
+        self.types = types
+        self.units = units
+        self.navs = navs
+        self.amounts = amounts
+        self.index = index
+        self._open_units = None
+
+    @classmethod
+    def from_transactions(cls, transactions: List[Transaction]) -> "TransactionTable":
+        def column(values, dtype):
+            return np.fromiter(values, dtype=dtype, count=len(transactions))
+
+        return cls.from_columns(
+            ordinals=column((t.date.toordinal() for t in transactions), np.int64),
+            types=column((TYPE_CODES[t.type] for t in transactions), np.int8),
+            units=column((to_fixed(t.units, UNITS_DECIMALS) for t in transactions), np.int64),
+            navs=column((to_fixed(t.nav, NAV_DECIMALS) for t in transactions), np.int64),
+            amounts=column((to_fixed(t.amount, AMOUNT_DECIMALS) for t in transactions), np.int64),
+        )
+
+    @classmethod
+    def from_columns(cls, ordinals, types, units, navs, amounts) -> "TransactionTable":
+        """Build a table from unsorted columns in source order, dates given as ordinals"""
+        index = np.argsort(ordinals, kind="stable")
+        return cls(
+            dates=(ordinals[index] - _EPOCH_ORDINAL).astype("datetime64[D]"),
+            types=types[index],
+            units=units[index],
+            navs=navs[index],
+            amounts=amounts[index],
+            index=index,
+        )
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    @property
+    def acquisitions(self) -> np.ndarray:
+        """Mask of rows that open a lot"""
+        return np.isin(self.types, ACQUISITION_CODES) | (
+            (self.types == REVERSAL_CODE) & (self.units > 0)
+        )
+
+    @property
+    def disposals(self) -> np.ndarray:
+        """Mask of rows that consume lots"""
+        return np.isin(self.types, DISPOSAL_CODES)
+
+    def open_units(self) -> np.ndarray:
+        """Units of every row still held after FIFO matching, same as lots.LotLedger
+
+        With FIFO and no overdrawn balance, the lots left are the acquisitions whose cumulative
+        units exceed all disposed units, so this needs no per-disposal walk. Tables with negative
+        reversals or disposals of more units than held fall back to a sequential walk.
+        """
+        if self._open_units is not None:
+            return self._open_units
+
+        acquired = np.where(self.acquisitions, self.units, 0)
+        disposed = np.where(self.disposals, np.abs(self.units), 0)
+        cancels_latest = (self.types == REVERSAL_CODE) & (self.units < 0)
+        balance = np.cumsum(acquired) - np.cumsum(disposed)
+
+        if cancels_latest.any() or (balance < 0).any():
+            self._open_units = self.__open_units_sequential(acquired, disposed, cancels_latest)
+        else:
+            remaining = np.cumsum(acquired) - disposed.sum()
+            self._open_units = np.clip(remaining, 0, acquired)
+
+        return self._open_units
+
+    def __open_units_sequential(self, acquired, disposed, cancels_latest) -> np.ndarray:
+        logger.debug("Falling back to sequential lot matching")
+        open_units = acquired.copy()
+        oldest = 0
+        for row in range(len(self)):
+            if disposed[row]:
+                units = int(disposed[row])
+                while units > 0 and oldest < row:
+                    taken = min(units, int(open_units[oldest]))
+                    open_units[oldest] -= taken
+                    units -= taken
+                    if open_units[oldest] == 0:
+                        oldest += 1
+            elif cancels_latest[row]:
+                units = -int(self.units[row])
+                latest = row - 1
+                while units > 0 and latest >= oldest:
+                    taken = min(units, int(open_units[latest]))
+                    open_units[latest] -= taken
+                    units -= taken
+                    latest -= 1
+        return open_units
+
+    def until(self, as_of: Optional[datetime.date]) -> "TransactionTable":
+        """Rows dated on or before as_of, the table itself if as_of is None or covers all rows"""
+        if as_of is None:
+            return self
+        end = int(np.searchsorted(self.dates, to_datetime64(as_of), side="right"))
+        if end == len(self):
+            return self
+        return TransactionTable(
+            self.dates[:end],
+            self.types[:end],
+            self.units[:end],
+            self.navs[:end],
+            self.amounts[:end],
+            self.index[:end],
+        )
+
+    def eligible_mask(self, min_days: int, as_of: Optional[datetime.date] = None) -> np.ndarray:
+        """Mask of open lots held for more than min_days as of the given date (default today)"""
+        as_of = as_of or datetime.date.today()
+        age = (to_datetime64(as_of) - self.dates).astype(np.int64)
+        return (age > min_days) & (self.open_units() > 0)
+
+    def open_cost(self) -> Decimal:
+        """Cost of the open units, same as the sum of lots.Lot.amount over the open lots
+
+        Fully held lots cost their amount, partially redeemed ones their units at the purchase NAV.
+        """
+        open_units = self.open_units()
+        held = open_units > 0
+        whole = held & (open_units == self.units)
+        decimals = UNITS_DECIMALS + NAV_DECIMALS
+        amounts = int(self.amounts[whole].sum()) * 10 ** (decimals - AMOUNT_DECIMALS)
+        partial = held & ~whole
+        partial_cost = _multiply(open_units[partial], self.navs[partial]).sum()
+        return from_fixed(amounts + int(partial_cost), decimals)
+
+    def running_holdings(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Units held and their cost (as in open_cost) after every row, in one pass
+
+        With FIFO, after d units have been disposed of in total, every acquisition after the first
+        one whose cumulative units exceed d is still held whole, so the cost after a row is a
+        difference of cumulative amounts plus the partly held lot. Tables needing the sequential
+        walk in open_units are walked once the same way, keeping running totals.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: int64 units with UNITS_DECIMALS implied decimals and
+                cost with UNITS_DECIMALS + NAV_DECIMALS implied decimals
+        """
+        decimals = UNITS_DECIMALS + NAV_DECIMALS
+        acquired = np.where(self.acquisitions, self.units, 0)
+        disposed = np.where(self.disposals, np.abs(self.units), 0)
+        cancels_latest = (self.types == REVERSAL_CODE) & (self.units < 0)
+        total_acquired, total_disposed = np.cumsum(acquired), np.cumsum(disposed)
+        held = total_acquired - total_disposed
+
+        whole_cost = np.where(
+            self.acquisitions, self.amounts * 10 ** (decimals - AMOUNT_DECIMALS), 0
+        )
+        if cancels_latest.any() or (held < 0).any():
+            return self.__running_holdings_sequential(
+                acquired, disposed, cancels_latest, whole_cost
+            )
+
+        total_cost = np.cumsum(whole_cost)
+        rows = np.arange(len(self))
+        # Oldest lot still held after every row, past the row if nothing is held
+        oldest = np.searchsorted(total_acquired, total_disposed, side="right")
+        has_lots = oldest <= rows
+        oldest = np.minimum(oldest, rows)
+        oldest_units = total_acquired[oldest] - total_disposed
+        oldest_cost = np.where(
+            oldest_units == acquired[oldest],
+            whole_cost[oldest],
+            _multiply(oldest_units, self.navs[oldest]),
+        )
+        cost = np.where(has_lots, total_cost - total_cost[oldest] + oldest_cost, 0)
+        return held, cost
+
+    def __running_holdings_sequential(
+        self, acquired, disposed, cancels_latest, whole_cost
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        logger.debug("Falling back to sequential running holdings")
+        acquired, whole_cost = acquired.tolist(), whole_cost.tolist()
+        navs = self.navs.tolist()
+        open_units = list(acquired)
+
+        def lot_cost(lot: int) -> int:
+            if open_units[lot] == acquired[lot]:
+                return whole_cost[lot]
+            return open_units[lot] * navs[lot]
+
+        def take(lot: int, units: int) -> int:
+            nonlocal held, cost
+            taken = min(units, open_units[lot])
+            cost -= lot_cost(lot)
+            open_units[lot] -= taken
+            cost += lot_cost(lot)
+            held -= taken
+            return taken
+
+        units_after, cost_after = [], []
+        held, cost, oldest = 0, 0, 0
+        for row in range(len(self)):
+            if acquired[row]:
+                held += acquired[row]
+                cost += whole_cost[row]
+            elif disposed[row]:
+                units = int(disposed[row])
+                while units > 0 and oldest < row:
+                    units -= take(oldest, units)
+                    if open_units[oldest] == 0:
+                        oldest += 1
+            elif cancels_latest[row]:
+                units = -int(self.units[row])
+                latest = row - 1
+                while units > 0 and latest >= oldest:
+                    units -= take(latest, units)
+                    latest -= 1
+            units_after.append(held)
+            cost_after.append(cost)
+        return np.array(units_after, dtype=np.int64), np.array(cost_after)
+
+    def total_units(self, mask: Optional[np.ndarray] = None) -> Decimal:
+        """Sum of open units, optionally restricted to a mask"""
+        open_units = self.open_units()
+        if mask is not None:
+            open_units = open_units[mask]
+        return from_fixed(open_units.sum(), UNITS_DECIMALS)
+
+    def profit_loss(self, nav, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """(nav - purchase nav) * open units per row, with UNITS_DECIMALS + NAV_DECIMALS decimals"""
+        open_units, navs = self.open_units(), self.navs
+        if mask is not None:
+            open_units, navs = open_units[mask], navs[mask]
+        return _multiply(to_fixed(nav, NAV_DECIMALS) - navs, open_units)
+
+
+def analyze_ltcg_tax_harvesting_columnar(
+    scheme: Scheme,
+    table: Optional[TransactionTable] = None,
+    include_transactions: bool = False,
+    as_of: Optional[datetime.date] = None,
+):
+    """Vectorized version of scheme_utils.analyze_ltcg_tax_harvesting
+
+    Args:
+        scheme (Scheme):
+        table (Optional[TransactionTable]): prebuilt table of scheme.transactions
+        include_transactions (bool): also return the per lot break-up, which is built in Python
+        as_of (Optional[datetime.date]): date of the sale, today by default
+
+    Returns:
+        dict: ltgc stats for given scheme, "transactions" is empty unless include_transactions
+    """
+    num_days = get_ltcg_holding_days(scheme)
+    if num_days is None:
+        return {}
+
+    if table is None:
+        table = TransactionTable.from_transactions(scheme.transactions)
+    table = table.until(as_of)
+    metrics.increment("transactions.analyzed", len(table))
+
+    as_of = as_of or datetime.date.today()
+    mask = table.eligible_mask(num_days, as_of)
+    total_eligible_units = table.total_units(mask)
+    profit_loss = table.profit_loss(scheme.nav, mask)
+    approx_ltcg = Decimal("0.0")
+    if total_eligible_units > 0:
+        approx_ltcg = from_fixed(profit_loss.sum(), UNITS_DECIMALS + NAV_DECIMALS)
+
+    transactions = []
+    if include_transactions:
+        rows = np.flatnonzero(mask)
+        open_units = table.open_units()
+        scheme_transactions = scheme.transactions
+        for row, row_profit_loss in zip(rows, profit_loss):
+            source = scheme_transactions[table.index[row]]
+            transaction = source.dict()
+            transaction["units"] = from_fixed(open_units[row], UNITS_DECIMALS)
+            if transaction["units"] != source.units:
+                transaction["amount"] = transaction["units"] * source.nav
+            transaction["days"] = (as_of - source.date.date()).days
+            transaction["P&L"] = from_fixed(row_profit_loss, UNITS_DECIMALS + NAV_DECIMALS)
+            transactions.append(transaction)
+
+    return {
+        "scheme": scheme.name,
+        "units": total_eligible_units,
+        "nav": scheme.nav,
+        "amount": total_eligible_units * scheme.nav,
+        "ltcg": approx_ltcg,
+        "transactions": transactions,
+    }
+
+
+def get_ltcg_eligibility_calendar(schemes: List[Scheme], as_of: Optional[datetime.date] = None):
+    """Dates on which open lots of equity schemes become long term, and what unlocks on each
+
+    Open lots of all schemes are pooled, sorted once by the date they unlock (the day after they
+    complete the scheme's holding period) and swept in that order.
+
+    Args:
+        schemes (List[Scheme]): schemes or compact scheme records, non-equity schemes are skipped
+        as_of (Optional[datetime.date]): date to list unlocks after, today by default. Lots already
+            long term by then are totalled under "eligible_amount".
+
+    Returns:
+        dict: "as_of", with "eligible_amount" and "eligible_ltcg" of the lots long term as of then,
+            and "calendar", a list of {"date", "amount", "ltcg", "cumulative_amount", "schemes"}
+            for every later unlock date. Amounts are at the current NAVs and "schemes" lists the
+            "folio", "scheme" and "units" of every holding unlocking, a scheme held in many folios
+            is listed once per folio.
+    """
+    as_of = as_of or datetime.date.today()
+    folios, names, unlocks, units, values, gains, owners = [], [], [], [], [], [], []
+    for scheme in schemes:
+        num_days = get_ltcg_holding_days(scheme)
+        if num_days is None:
+            continue
+
+        table = getattr(scheme, "table", None)
+        if table is None:
+            table = TransactionTable.from_transactions(scheme.transactions or [])
+        table = table.until(as_of)
+        is_open = table.open_units() > 0
+        open_units = table.open_units()[is_open]
+
+        unlocks.append(table.dates[is_open].astype(np.int64) + _EPOCH_ORDINAL + num_days + 1)
+        units.append(open_units)
+        values.append(_multiply(open_units, to_fixed(scheme.nav, NAV_DECIMALS)))
+        gains.append(table.profit_loss(scheme.nav, is_open))
+        owners.append(np.full(len(open_units), len(names)))
+        folios.append(scheme.folio)
+        names.append(scheme.name)
+
+    calendar = {
+        "as_of": as_of,
+        "eligible_amount": Decimal(0),
+        "eligible_ltcg": Decimal(0),
+        "calendar": [],
+    }
+    if not names:
+        return calendar
+
+    unlocks = np.concatenate(unlocks)
+    order = np.argsort(unlocks, kind="stable")
+    unlocks, owners = unlocks[order], np.concatenate(owners)[order]
+    units, values = np.concatenate(units)[order], np.concatenate(values)[order]
+    gains = np.concatenate(gains)[order]
+    value_decimals = UNITS_DECIMALS + NAV_DECIMALS
+
+    # Lots unlocked on or before as_of are the head of the sorted lots
+    eligible = int(np.searchsorted(unlocks, as_of.toordinal(), side="right"))
+    cumulative = int(values[:eligible].sum())
+    calendar["eligible_amount"] = from_fixed(cumulative, value_decimals)
+    calendar["eligible_ltcg"] = from_fixed(int(gains[:eligible].sum()), value_decimals)
+
+    # Rows of every unlock date after as_of
+    starts = eligible + np.flatnonzero(np.diff(unlocks[eligible:], prepend=-1) != 0)
+    ends = np.append(starts[1:], len(unlocks))
+    for start, end in zip(starts, ends):
+        value = int(values[start:end].sum())
+        cumulative += value
+        scheme_units: Dict[int, int] = {}
+        for owner, lot_units in zip(owners[start:end].tolist(), units[start:end].tolist()):
+            scheme_units[owner] = scheme_units.get(owner, 0) + lot_units
+
+        calendar["calendar"].append(
+            {
+                "date": datetime.date.fromordinal(int(unlocks[start])),
+                "amount": from_fixed(value, value_decimals),
+                "ltcg": from_fixed(int(gains[start:end].sum()), value_decimals),
+                "cumulative_amount": from_fixed(cumulative, value_decimals),
+                "schemes": [
+                    {
+                        "folio": folios[owner],
+                        "scheme": names[owner],
+                        "units": from_fixed(total, UNITS_DECIMALS),
+                    }
+                    for owner, total in scheme_units.items()
+                ],
+            }
+        )
+    return calendar
@@ -1,6 +1,14 @@
+from decimal import Decimal
+
 # Scheme Types
 EQUITY = "Equity Scheme"
 DEBT = "Debt Scheme"
 
 # Scheme Subtypes
 ELSS = "ELSS"
+
+# Long term capital gains on equity exempt from tax every financial year
+LTCG_EXEMPTION = Decimal("125000")
+
+# Number of concurrent requests while fetching scheme details
+DEFAULT_MAX_WORKERS = 8
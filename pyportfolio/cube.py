@@ -0,0 +1,148 @@
+"""Valuation, cost and scheme counts of a portfolio aggregated by type, subtype, AMC and folio
+
+The cube is built in one pass over the schemes and holds a cell for every (type, subtype, AMC, folio)
+combination that has schemes. Rollups over any subset of those dimensions, and drill-downs into a
+slice of them, are answered from the cells without looking at the schemes again:
+
+    cube.rollup("type")                       # {"Equity Scheme": {...}, "Debt Scheme": {...}}
+    cube.rollup("subtype", type=EQUITY)       # subtypes of equity schemes
+    cube.rollup("amc", "folio")               # {(amc, folio): {...}}
+    cube.total(type=DEBT)
+
+When a scheme's NAV or units change, update replaces only that scheme's contribution.
+"""
+
+from decimal import Decimal
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from .columnar import TransactionTable
+from .models import Scheme
+
+DIMENSIONS = ("type", "subtype", "amc", "folio")
+
+CellKey = Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]
+
+
+class Contribution(NamedTuple):
+    """What one scheme adds to its cell"""
+
+    key: CellKey
+    units: Decimal
+    valuation: Decimal
+    invested: Decimal
+
+
+def get_invested_amount(scheme: Scheme) -> Decimal:
+    """Cost of the scheme's open units, see TransactionTable.open_cost"""
+    table = getattr(scheme, "table", None)
+    if table is None:
+        table = TransactionTable.from_transactions(scheme.transactions or [])
+    return table.open_cost()
+
+
+class ValuationCube:
+    """Aggregates of schemes by DIMENSIONS, see the module docstring
+
+    Attributes:
+        cells (Dict[CellKey, dict]): "valuation", "invested" and "schemes" (count) of every cell
+    """
+
+    def __init__(self) -> None:
+        self.cells: Dict[CellKey, dict] = {}
+        self._contributions: Dict[int, Contribution] = {}
+
+    @classmethod
+    def from_schemes(cls, schemes: Iterable[Scheme]) -> "ValuationCube":
+        """Cube of the schemes, each identified by its position for later updates
+
+        Args:
+            schemes (Iterable[Scheme]): schemes or compact scheme records
+        """
+        cube = cls()
+        for position, scheme in enumerate(schemes):
+            cube.add(position, scheme)
+        return cube
+
+    def add(self, position: int, scheme: Scheme, invested: Optional[Decimal] = None) -> None:
+        key = (scheme.type, scheme.subtype, scheme.amc, scheme.folio)
+        valuation = scheme.units * scheme.nav if scheme.nav is not None else Decimal(0)
+        if invested is None:
+            invested = get_invested_amount(scheme)
+        contribution = Contribution(key, scheme.units, valuation, invested)
+        self._contributions[position] = contribution
+
+        cell = self.cells.setdefault(
+            key, {"valuation": Decimal(0), "invested": Decimal(0), "schemes": 0}
+        )
+        cell["valuation"] += valuation
+        cell["invested"] += invested
+        cell["schemes"] += 1
+
+    def remove(self, position: int) -> None:
+        """Take the scheme at the position out of its cell, if it was added"""
+        contribution = self._contributions.pop(position, None)
+        if contribution is None:
+            return
+
+        cell = self.cells[contribution.key]
+        cell["schemes"] -= 1
+        if cell["schemes"] == 0:
+            del self.cells[contribution.key]
+        else:
+            cell["valuation"] -= contribution.valuation
+            cell["invested"] -= contribution.invested
+
+    def update(self, position: int, scheme: Scheme) -> None:
+        """Replace the contribution of the scheme at the position after its NAV or units changed
+
+        The cost of the open units is only recomputed if the units changed.
+        """
+        previous = self._contributions.get(position)
+        invested = None
+        if previous is not None and previous.units == scheme.units:
+            invested = previous.invested
+        self.remove(position)
+        self.add(position, scheme, invested)
+
+    def rollup(self, *dimensions: str, **filters) -> Dict[object, dict]:
+        """Aggregates grouped by the given dimensions, over the cells matching the filters
+
+        Args:
+            dimensions (str): names from DIMENSIONS to group by, none for a single total
+            filters: dimension=value pairs a cell must match, e.g. type=EQUITY
+
+        Returns:
+            Dict[object, dict]: "valuation", "invested" and "schemes" by the value of the dimension,
+                or by a tuple of values when grouping by more than one
+        """
+        positions = [_position(dimension) for dimension in dimensions]
+        matches = [(_position(dimension), value) for dimension, value in filters.items()]
+
+        groups: Dict[object, dict] = {}
+        for key, cell in self.cells.items():
+            if any(key[position] != value for position, value in matches):
+                continue
+            group_key = tuple(key[position] for position in positions)
+            if len(group_key) == 1:
+                group_key = group_key[0]
+
+            group = groups.setdefault(
+                group_key, {"valuation": Decimal(0), "invested": Decimal(0), "schemes": 0}
+            )
+            group["valuation"] += cell["valuation"]
+            group["invested"] += cell["invested"]
+            group["schemes"] += cell["schemes"]
+        return groups
+
+    def total(self, **filters) -> dict:
+        """Aggregate of all cells matching the filters, see rollup"""
+        return self.rollup(**filters).get(
+            (), {"valuation": Decimal(0), "invested": Decimal(0), "schemes": 0}
+        )
+
+
+def _position(dimension: str) -> int:
+    try:
+        return DIMENSIONS.index(dimension)
+    except ValueError:
+        raise ValueError(f"Unknown dimension {dimension}, must be one of {DIMENSIONS}")
@@ -0,0 +1,259 @@
+"""Streaming export of schemes and transactions as flat rows
+
+Rows are yielded one at a time and written in batches, so exporting many portfolios never holds
+more than one scheme's rows and one batch in memory:
+
+    rows = itertools.chain.from_iterable(
+        iter_transaction_rows(portfolio, portfolio_id=name) for name, portfolio in portfolios
+    )
+    write_parquet(rows, "transactions.parquet")
+    # or into MongoDB
+    write_batches(rows, collection.insert_many, transform=to_mongo_document)
+
+Parquet and Arrow output needs pyarrow, installed with the "arrow" extra.
+"""
+
+import itertools
+import json
+from decimal import Decimal
+from typing import Callable, Iterable, Iterator, List, Optional, TextIO
+
+from casparser.encoder import CASDataEncoder
+
+from .models import Scheme
+
+DEFAULT_BATCH_SIZE = 10000
+
+SCHEME_FIELDS = (
+    "portfolio_id",
+    "name",
+    "amfi",
+    "type",
+    "subtype",
+    "units",
+    "nav",
+    "valuation",
+    "transactions",
+)
+TRANSACTION_FIELDS = (
+    "portfolio_id",
+    "scheme",
+    "amfi",
+    "date",
+    "description",
+    "amount",
+    "units",
+    "nav",
+    "balance",
+    "type",
+    "dividend_rate",
+    "days",
+)
+
+# Arrow type of every field, exact decimals wide enough for units * nav
+_ARROW_TYPES = {
+    "portfolio_id": "string",
+    "name": "string",
+    "scheme": "string",
+    "amfi": "string",
+    "type": "string",
+    "subtype": "string",
+    "description": "string",
+    "units": "decimal",
+    "nav": "decimal",
+    "valuation": "decimal",
+    "amount": "decimal",
+    "balance": "decimal",
+    "dividend_rate": "decimal",
+    "transactions": "int64",
+    "days": "int64",
+    "date": "timestamp",
+}
+
+
+def _iter_schemes(source) -> Iterator[Scheme]:
+    # Portfolios build and export one scheme at a time
+    return source.iter_schemes() if hasattr(source, "iter_schemes") else iter(source)
+
+
+def iter_scheme_rows(source, portfolio_id: Optional[str] = None) -> Iterator[dict]:
+    """One flat row per scheme
+
+    Args:
+        source: Portfolio or iterable of Scheme
+        portfolio_id (Optional[str]): identifies the portfolio in every row
+
+    Yields:
+        dict: row with the keys in SCHEME_FIELDS
+    """
+    for scheme in _iter_schemes(source):
+        yield {
+            "portfolio_id": portfolio_id,
+            "name": scheme.name,
+            "amfi": scheme.amfi,
+            "type": scheme.type,
+            "subtype": scheme.subtype,
+            "units": scheme.units,
+            "nav": scheme.nav,
+            "valuation": scheme.valuation,
+            "transactions": len(scheme.transactions or []),
+        }
+
+
+def iter_transaction_rows(source, portfolio_id: Optional[str] = None) -> Iterator[dict]:
+    """One flat row per transaction, with the scheme it belongs to
+
+    Args:
+        source: Portfolio or iterable of Scheme
+        portfolio_id (Optional[str]): identifies the portfolio in every row
+
+    Yields:
+        dict: row with the keys in TRANSACTION_FIELDS
+    """
+    for scheme in _iter_schemes(source):
+        for transaction in scheme.transactions or []:
+            yield {
+                "portfolio_id": portfolio_id,
+                "scheme": scheme.name,
+                "amfi": scheme.amfi,
+                "date": transaction.date,
+                "description": transaction.description,
+                "amount": transaction.amount,
+                "units": transaction.units,
+                "nav": transaction.nav,
+                "balance": transaction.balance,
+                "type": transaction.type,
+                "dividend_rate": transaction.dividend_rate,
+                "days": transaction.days,
+            }
+
+
+def batched(rows: Iterable[dict], batch_size: int) -> Iterator[List[dict]]:
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_jsonl(rows: Iterable[dict], output: TextIO) -> int:
+    """Write rows as JSON lines, Decimals as strings and dates in ISO format
+
+    Returns:
+        int: number of rows written
+    """
+    count = 0
+    for row in rows:
+        output.write(json.dumps(row, cls=CASDataEncoder) + "\n")
+        count += 1
+    return count
+
+
+def write_batches(
+    rows: Iterable[dict],
+    insert_many: Callable[[List[dict]], object],
+    batch_size: int = 1000,
+    transform: Optional[Callable[[dict], dict]] = None,
+) -> int:
+    """Write rows with a bulk insert function, e.g. a pymongo collection's insert_many
+
+    Args:
+        rows (Iterable[dict]): rows from iter_scheme_rows or iter_transaction_rows
+        insert_many (Callable[[List[dict]], object]): called with every batch of rows
+        batch_size (int): rows per call
+        transform (Optional[Callable[[dict], dict]]): applied to every row, e.g. to_mongo_document
+
+    Returns:
+        int: number of rows written
+    """
+    count = 0
+    for batch in batched(rows, batch_size):
+        if transform is not None:
+            batch = [transform(row) for row in batch]
+        insert_many(batch)
+        count += len(batch)
+    return count
+
+
+def to_mongo_document(row: dict) -> dict:
+    """Row with Decimals as BSON Decimal128, which MongoDB stores exactly (needs pymongo)"""
+    from bson.decimal128 import Decimal128
+
+    return {
+        key: Decimal128(value) if isinstance(value, Decimal) else value
+        for key, value in row.items()
+    }
+
+
+def get_arrow_schema(fields=TRANSACTION_FIELDS):
+    """pyarrow schema of rows with the given fields, SCHEME_FIELDS or TRANSACTION_FIELDS"""
+    pa = _import_pyarrow()
+    types = {
+        "string": pa.string(),
+        "decimal": pa.decimal128(38, 10),
+        "int64": pa.int64(),
+        "timestamp": pa.timestamp("us"),
+    }
+    return pa.schema([(field, types[_ARROW_TYPES[field]]) for field in fields])
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError(
+            "Arrow and Parquet export need pyarrow: pip install pyportfolio[arrow]"
+        ) from e
+    return pyarrow
+
+
+def _iter_record_batches(rows, schema, batch_size):
+    pa = _import_pyarrow()
+    for batch in batched(rows, batch_size):
+        yield pa.RecordBatch.from_pylist(batch, schema=schema)
+
+
+def write_parquet(
+    rows: Iterable[dict],
+    path,
+    fields=TRANSACTION_FIELDS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    """Write rows to a Parquet file, one row group per batch
+
+    Args:
+        rows (Iterable[dict]): rows from iter_scheme_rows or iter_transaction_rows
+        path: file to write
+        fields: SCHEME_FIELDS or TRANSACTION_FIELDS, whichever the rows have
+        batch_size (int): rows per row group
+
+    Returns:
+        int: number of rows written
+    """
+    schema = get_arrow_schema(fields)
+    import pyarrow.parquet as pq
+
+    count = 0
+    with pq.ParquetWriter(str(path), schema) as writer:
+        for record_batch in _iter_record_batches(rows, schema, batch_size):
+            writer.write_batch(record_batch)
+            count += record_batch.num_rows
+    return count
+
+
+def write_arrow(
+    rows: Iterable[dict],
+    path,
+    fields=TRANSACTION_FIELDS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    """Write rows to an Arrow IPC (Feather v2) file, see write_parquet for the arguments"""
+    pa = _import_pyarrow()
+    schema = get_arrow_schema(fields)
+    count = 0
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for record_batch in _iter_record_batches(rows, schema, batch_size):
+            writer.write_batch(record_batch)
+            count += record_batch.num_rows
+    return count
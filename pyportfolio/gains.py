@@ -0,0 +1,264 @@
+"""Realized short and long term capital gains of every redemption, for all financial years at once
+
+The transactions of every scheme are replayed once in date order through a LotLedger. Every
+redemption or switch-out is matched FIFO to the lots it extinguished, and each match is one
+realized gain:
+
+    sale value = units * NAV of the redemption
+    cost       = units * NAV of the purchase
+
+Units of equity schemes held for more than a year are long term. Units of other schemes are long
+term after three years, or after two years when they are redeemed on or after 23-Jul-2024, and
+those bought on or after 1-Apr-2023 are always short term.
+
+Long term gains on equity units bought before 1-Feb-2018 are grandfathered: their cost is the
+higher of the actual cost and the lower of the fair market value on 31-Jan-2018 and the sale
+value. Fair market values are the NAVs as of that date, looked up for all schemes in one batch from
+a NavStore after fetching the histories it is missing.
+"""
+
+import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from . import metrics
+from .columnar import NAV_DECIMALS, from_fixed
+from .constants import DEFAULT_MAX_WORKERS, EQUITY
+from .lots import LotLedger, sorted_by_date
+from .mfhelper import refresh_nav_histories
+from .models import Scheme
+from .navstore import NavStore, get_default_nav_store
+from .utils import logger
+
+EQUITY_LTCG_HOLDING_DAYS = 365
+OTHER_LTCG_HOLDING_DAYS = 365 * 3
+# Other schemes redeemed from this date on are long term after two years instead of three
+REDUCED_OTHER_LTCG_HOLDING_DAYS = 365 * 2
+REDUCED_HOLDING_PERIOD_FROM = datetime.date(2024, 7, 23)
+GRANDFATHERING_DATE = datetime.date(2018, 1, 31)
+# Gains on other schemes bought from this date on are short term however long they are held
+SHORT_TERM_ONLY_FROM = datetime.date(2023, 4, 1)
+
+
+def get_financial_year(date: datetime.date) -> str:
+    """Indian financial year (April to March) of the date, e.g. "2017-18" """
+    start = date.year if date.month >= 4 else date.year - 1
+    return f"{start}-{(start + 1) % 100:02d}"
+
+
+def _as_date(value) -> datetime.date:
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+class RealizedGain(NamedTuple):
+    """Units of one purchase lot disposed of by one redemption or switch-out
+
+    Attributes:
+        fair_market_value: NAV on GRANDFATHERING_DATE if the gain is grandfathered, else None
+    """
+
+    scheme: str
+    amfi: Optional[str]
+    type: Optional[str]
+    purchase_date: datetime.date
+    sale_date: datetime.date
+    units: Decimal
+    purchase_nav: Decimal
+    sale_nav: Decimal
+    long_term: bool
+    fair_market_value: Optional[Decimal] = None
+
+    @property
+    def financial_year(self) -> str:
+        return get_financial_year(self.sale_date)
+
+    @property
+    def grandfathered(self) -> bool:
+        """Long term equity gain on units bought before 1-Feb-2018"""
+        return self.long_term and self.type == EQUITY and self.purchase_date <= GRANDFATHERING_DATE
+
+    @property
+    def sale_value(self) -> Decimal:
+        return self.units * self.sale_nav
+
+    @property
+    def cost(self) -> Decimal:
+        cost = self.units * self.purchase_nav
+        if self.fair_market_value is not None:
+            cost = max(cost, min(self.units * self.fair_market_value, self.sale_value))
+        return cost
+
+    @property
+    def gain(self) -> Decimal:
+        return self.sale_value - self.cost
+
+
+def is_long_term(
+    scheme_type: Optional[str], purchase_date: datetime.date, sale_date: datetime.date
+) -> bool:
+    """Whether units of a scheme of the type bought and sold on the dates are a long term gain"""
+    if scheme_type == EQUITY:
+        holding_days = EQUITY_LTCG_HOLDING_DAYS
+    elif purchase_date >= SHORT_TERM_ONLY_FROM:
+        return False
+    elif sale_date >= REDUCED_HOLDING_PERIOD_FROM:
+        holding_days = REDUCED_OTHER_LTCG_HOLDING_DAYS
+    else:
+        holding_days = OTHER_LTCG_HOLDING_DAYS
+    return (sale_date - purchase_date).days > holding_days
+
+
+def iter_realized_gains(scheme: Scheme) -> Iterator[RealizedGain]:
+    """Realized gains of the scheme in the order of the redemptions, without grandfathering
+
+    Args:
+        scheme (Scheme): scheme or compact scheme record
+
+    Yields:
+        RealizedGain: one per purchase lot a redemption took units from
+    """
+    ledger = LotLedger([])
+    for transaction in sorted_by_date(scheme.transactions or []):
+        sale_date = _as_date(transaction.date)
+        for lot, units in ledger.add(transaction):
+            purchase_date = _as_date(lot.date)
+            yield RealizedGain(
+                scheme=scheme.name,
+                amfi=scheme.amfi,
+                type=scheme.type,
+                purchase_date=purchase_date,
+                sale_date=sale_date,
+                units=units,
+                purchase_nav=lot.nav,
+                sale_nav=transaction.nav,
+                long_term=is_long_term(scheme.type, purchase_date, sale_date),
+            )
+
+    if ledger.unmatched_units:
+        logger.warning(
+            f"{scheme.name}: no purchases found for {ledger.unmatched_units} redeemed units, "
+            "their gains are not included"
+        )
+
+
+def get_fair_market_values(
+    amfi_ids: Iterable,
+    nav_store: Optional[NavStore] = None,
+    offline: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> Dict[str, Decimal]:
+    """NAVs of the schemes as of GRANDFATHERING_DATE, in one lookup
+
+    Schemes whose stored history doesn't go back that far are fetched first, those that fail to
+    fetch are left out and their gains are not grandfathered.
+
+    Args:
+        amfi_ids (Iterable): scheme codes
+        nav_store (Optional[NavStore]): store to read from and record into, defaults to the
+            default store or one in the cache directory
+        offline (bool): only use stored NAVs
+        max_workers (int): number of concurrent NAV history requests
+
+    Returns:
+        Dict[str, Decimal]: NAV by scheme code, for the schemes that have one
+    """
+    nav_store = nav_store or get_default_nav_store() or NavStore()
+    codes = list(dict.fromkeys(str(amfi_id) for amfi_id in amfi_ids))
+
+    missing = [
+        code
+        for code in codes
+        if len(nav_store.history(code)) == 0
+        or nav_store.history(code)["date"][0] > GRANDFATHERING_DATE.toordinal()
+    ]
+    if missing and not offline:
+        refresh_nav_histories(missing, nav_store, max_workers)
+
+    navs = nav_store.lookup(codes, [GRANDFATHERING_DATE] * len(codes))
+    return {
+        code: from_fixed(nav, NAV_DECIMALS)
+        for code, nav, found in zip(codes, navs.navs, navs.found)
+        if found
+    }
+
+
+def _new_totals() -> dict:
+    return {
+        "sale_value": Decimal("0.0"),
+        "cost": Decimal("0.0"),
+        "stcg": Decimal("0.0"),
+        "ltcg": Decimal("0.0"),
+    }
+
+
+def _add_gain(totals: dict, gain: RealizedGain) -> None:
+    totals["sale_value"] += gain.sale_value
+    totals["cost"] += gain.cost
+    totals["ltcg" if gain.long_term else "stcg"] += gain.gain
+
+
+def get_realized_gains(
+    schemes: Iterable[Scheme],
+    nav_store: Optional[NavStore] = None,
+    offline: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> dict:
+    """Realized gains of the schemes over their whole history, by financial year and scheme
+
+    Args:
+        schemes (Iterable[Scheme]): schemes or compact scheme records
+        nav_store (Optional[NavStore]): store of NAV histories for grandfathering, see
+            get_fair_market_values
+        offline (bool): only use stored NAVs
+        max_workers (int): number of concurrent NAV history requests
+
+    Returns:
+        dict: total "stcg" and "ltcg", and "financial_years" in order, each with its sale value,
+            cost, stcg and ltcg, and the same for every scheme with redemptions in the year
+    """
+    with metrics.span("gains.match"):
+        gains: List[RealizedGain] = [
+            gain for scheme in schemes for gain in iter_realized_gains(scheme)
+        ]
+    metrics.increment("gains.matched", len(gains))
+
+    grandfathered = {gain.amfi for gain in gains if gain.grandfathered and gain.amfi is not None}
+    if grandfathered:
+        with metrics.span("gains.fair_market_values"):
+            fair_market_values = get_fair_market_values(
+                grandfathered, nav_store, offline, max_workers
+            )
+        for code in grandfathered - fair_market_values.keys():
+            logger.warning(f"No NAV of {code} on {GRANDFATHERING_DATE}, gains not grandfathered")
+        gains = [
+            (
+                gain._replace(fair_market_value=fair_market_values.get(gain.amfi))
+                if gain.grandfathered
+                else gain
+            )
+            for gain in gains
+        ]
+
+    total = _new_totals()
+    years: Dict[str, dict] = {}
+    for gain in gains:
+        _add_gain(total, gain)
+        year = years.setdefault(gain.financial_year, {**_new_totals(), "schemes": {}})
+        _add_gain(year, gain)
+        scheme = year["schemes"].setdefault(
+            gain.scheme, {"scheme": gain.scheme, "type": gain.type, **_new_totals()}
+        )
+        _add_gain(scheme, gain)
+
+    return {
+        "stcg": total["stcg"],
+        "ltcg": total["ltcg"],
+        "financial_years": [
+            {
+                "financial_year": financial_year,
+                **{key: value for key, value in year.items() if key != "schemes"},
+                "schemes": list(year["schemes"].values()),
+            }
+            for financial_year, year in sorted(years.items())
+        ],
+    }
@@ -0,0 +1,306 @@
+"""Sell plan that harvests long term gains up to the annual exemption
+
+Redemptions are matched FIFO, so selling units of a scheme always takes its oldest lots first and
+the LTCG realized grows along the scheme's eligible lots in date order. For every equity scheme the
+eligible open lots (see analyze_ltcg_tax_harvesting) are turned into running totals of units and
+gain, as exact fixed point integers. The scheme can contribute any gain up to the peak of its
+running gain, so the exemption can be met exactly as long as the schemes have enough gain in total.
+
+The plan harvests min(exemption left, total gain available) with as few sell orders as possible,
+and then tries to redeem as little value as it can.
+
+Schemes are filled along the upper concave hull of their running (value redeemed, gain) after
+every lot. Because units leave FIFO, a later lot with a better gain per rupee can only be reached
+by selling the lots before it, and the hull groups such lots into one segment. Hull segments of all
+schemes are sold in order of gain per rupee. The last segment is sold along the actual lots only as
+far as the exemption left. This is the least value for the amount harvested except within that
+last segment, where the actual lots fall below the hull.
+
+    - greedy: hull segments of all schemes are filled.
+    - fewest_orders: every combination of the fewest schemes that can cover the exemption is
+      filled the same way and the one redeeming the least value is kept, as long as there are at
+      most MAX_COMBINATIONS of them. Beyond that the greedy plan is kept if it needs no more orders
+      than that, otherwise the schemes with the largest gains are filled ("largest_gains").
+
+Eligible units have been held for more than a year, past the exit load period of most equity
+schemes, so fewer orders and less value redeemed are what keep the cost of harvesting low.
+"""
+
+import datetime
+import itertools
+import math
+from decimal import Decimal
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from . import metrics
+from .columnar import NAV_DECIMALS, UNITS_DECIMALS, TransactionTable, from_fixed, to_fixed
+from .models import Scheme
+from .scheme_utils import get_ltcg_holding_days
+
+GAIN_DECIMALS = UNITS_DECIMALS + NAV_DECIMALS
+# Units are redeemed in multiples of 0.001, the precision of CAS statements
+SALE_UNITS_QUANTUM = 10 ** (UNITS_DECIMALS - 3)
+MAX_COMBINATIONS = 10000
+
+
+class Candidate(NamedTuple):
+    """Eligible open lots of a scheme in FIFO order, quantities as fixed point integers
+
+    Attributes:
+        units: units of every lot, with UNITS_DECIMALS implied decimals
+        navs: purchase NAV of every lot, with NAV_DECIMALS implied decimals
+        gains: running gain after selling each lot, with GAIN_DECIMALS implied decimals
+        peak: index of the lot after which the running gain is highest
+        segment_values: value redeemed by every segment of the upper concave hull of (value
+            redeemed, gain) after every lot up to the peak, with GAIN_DECIMALS implied decimals
+        segment_gains: gain of every hull segment, with GAIN_DECIMALS implied decimals
+    """
+
+    scheme: Scheme
+    nav: int
+    dates: np.ndarray
+    units: np.ndarray
+    navs: np.ndarray
+    gains: np.ndarray
+    peak: int
+    segment_values: np.ndarray
+    segment_gains: np.ndarray
+
+    @property
+    def peak_gain(self) -> int:
+        return int(self.gains[self.peak])
+
+
+def _hull_segments(units: np.ndarray, nav: int, gains: np.ndarray, peak: int):
+    """Segments of the upper concave hull of (value, gain) after every lot up to the peak
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: value and gain of every segment
+    """
+    units_sold = np.cumsum(units[: peak + 1]).tolist()
+    points = [(0, 0)] + [
+        (sold * nav, int(gain)) for sold, gain in zip(units_sold, gains[: peak + 1].tolist())
+    ]
+    hull = []
+    for value, gain in points:
+        # Drop the last vertex while it isn't above the line from the one before it to this point
+        while len(hull) >= 2:
+            (value_0, gain_0), (value_1, gain_1) = hull[-2], hull[-1]
+            if (value_1 - value_0) * (gain - gain_0) < (gain_1 - gain_0) * (value - value_0):
+                break
+            hull.pop()
+        hull.append((value, gain))
+
+    return (
+        np.array([value - previous for (previous, _), (value, _) in zip(hull, hull[1:])]),
+        np.array([gain - previous for (_, previous), (_, gain) in zip(hull, hull[1:])]),
+    )
+
+
+def get_candidate(scheme: Scheme, as_of: Optional[datetime.date] = None) -> Optional[Candidate]:
+    """Eligible open lots of an equity scheme, None if selling them can't realize a gain"""
+    num_days = get_ltcg_holding_days(scheme)
+    if num_days is None or scheme.nav is None:
+        return None
+
+    table = getattr(scheme, "table", None)
+    if table is None:
+        table = TransactionTable.from_transactions(scheme.transactions or [])
+    table = table.until(as_of)
+
+    mask = table.eligible_mask(num_days, as_of)
+    if not mask.any():
+        return None
+
+    gains = np.cumsum(table.profit_loss(scheme.nav, mask))
+    peak = int(np.argmax(gains))
+    if gains[peak] <= 0:
+        return None
+
+    nav = to_fixed(scheme.nav, NAV_DECIMALS)
+    units = table.open_units()[mask]
+    segment_values, segment_gains = _hull_segments(units, nav, gains, peak)
+    return Candidate(
+        scheme=scheme,
+        nav=nav,
+        dates=table.dates[mask],
+        units=units,
+        navs=table.navs[mask],
+        gains=gains,
+        peak=peak,
+        segment_values=segment_values,
+        segment_gains=segment_gains,
+    )
+
+
+class Sale(NamedTuple):
+    """Units of a candidate to sell, up to and including lot `last`"""
+
+    candidate: Candidate
+    last: int
+    units: int
+    gain: int
+
+    @property
+    def value(self) -> int:
+        return self.units * self.candidate.nav
+
+
+def _sell_up_to(candidate: Candidate, gain: int) -> Sale:
+    """Fewest units of the candidate, oldest first, realizing at most the given gain"""
+    if gain >= candidate.peak_gain:
+        return Sale(
+            candidate,
+            candidate.peak,
+            int(candidate.units[: candidate.peak + 1].sum()),
+            candidate.peak_gain,
+        )
+
+    # The first lot that takes the running gain to the target, its units have a gain
+    last = int(np.argmax(candidate.gains >= gain))
+    before = int(candidate.gains[last - 1]) if last > 0 else 0
+    units_before = int(candidate.units[:last].sum())
+    gain_per_unit = candidate.nav - int(candidate.navs[last])
+    units = (gain - before) // gain_per_unit
+    units -= units % SALE_UNITS_QUANTUM
+    if units == 0:
+        # Nothing of the partial lot is sold, the sale ends with the lot before it
+        last -= 1
+    return Sale(candidate, last, units_before + units, before + units * gain_per_unit)
+
+
+def _fill(candidates: List[Candidate], budget: int) -> List[Sale]:
+    """Sell hull segments of the candidates in order of gain per rupee until the budget is met"""
+    if not candidates or budget <= 0:
+        return []
+
+    owners = np.concatenate(
+        [np.full(len(candidate.segment_gains), i) for i, candidate in enumerate(candidates)]
+    )
+    values = np.concatenate([candidate.segment_values for candidate in candidates])
+    gains = np.concatenate([candidate.segment_gains for candidate in candidates])
+    # Hulls are concave, so segments of a candidate stay in their order
+    order = np.argsort(-(gains.astype(np.float64) / values.astype(np.float64)), kind="stable")
+    harvested = np.cumsum(gains[order])
+    full = int(np.searchsorted(harvested, budget, side="left"))
+
+    targets = [0] * len(candidates)
+    for segment in order[:full].tolist():
+        targets[owners[segment]] += int(gains[segment])
+    if full < len(order):
+        targets[owners[order[full]]] += budget - (int(harvested[full - 1]) if full else 0)
+
+    sales = []
+    for candidate, target in zip(candidates, targets):
+        if target > 0:
+            sale = _sell_up_to(candidate, target)
+            if sale.units > 0:
+                sales.append(sale)
+    return sales
+
+
+def _plan_value(sales: List[Sale]) -> int:
+    return sum(sale.value for sale in sales)
+
+
+def plan_sales(candidates: List[Candidate], budget: int):
+    """Sales harvesting up to the budget (fixed point, GAIN_DECIMALS), see the module docstring
+
+    Returns:
+        Tuple[List[Sale], str]: the sales and the method that chose them
+    """
+    sales = _fill(candidates, budget)
+
+    by_gain = sorted(candidates, key=lambda candidate: candidate.peak_gain, reverse=True)
+    running = list(itertools.accumulate(candidate.peak_gain for candidate in by_gain))
+    fewest = next((count + 1 for count, gain in enumerate(running) if gain >= budget), len(by_gain))
+    if math.comb(len(by_gain), fewest) > MAX_COMBINATIONS:
+        if len(sales) <= fewest:
+            return sales, "greedy"
+        return _fill(by_gain[:fewest], budget), "largest_gains"
+
+    # The gain the fewest schemes can harvest, short of the budget only if all schemes are
+    target = min(budget, running[-1]) if running else 0
+    best = None
+    for combination in itertools.combinations(by_gain, fewest):
+        if sum(candidate.peak_gain for candidate in combination) < target:
+            continue
+        combination_sales = _fill(list(combination), budget)
+        if best is None or _plan_value(combination_sales) < _plan_value(best):
+            best = combination_sales
+    return best, "fewest_orders"
+
+
+def _sale_dict(sale: Sale) -> dict:
+    candidate = sale.candidate
+    lots = []
+    units_left = sale.units
+    for row in range(sale.last + 1):
+        units = min(int(candidate.units[row]), units_left)
+        units_left -= units
+        lots.append(
+            {
+                "date": candidate.dates[row].astype(object),
+                "units": from_fixed(units, UNITS_DECIMALS),
+                "nav": from_fixed(candidate.navs[row], NAV_DECIMALS),
+                "ltcg": from_fixed(
+                    units * (candidate.nav - int(candidate.navs[row])), GAIN_DECIMALS
+                ),
+            }
+        )
+
+    return {
+        "scheme": candidate.scheme.name,
+        "amfi": candidate.scheme.amfi,
+        "nav": candidate.scheme.nav,
+        "units": from_fixed(sale.units, UNITS_DECIMALS),
+        "amount": from_fixed(sale.value, GAIN_DECIMALS),
+        "ltcg": from_fixed(sale.gain, GAIN_DECIMALS),
+        "lots": lots,
+    }
+
+
+def get_ltcg_harvesting_plan(
+    schemes: List[Scheme],
+    exemption: Decimal,
+    realized_ltcg: Decimal = Decimal("0.0"),
+    as_of: Optional[datetime.date] = None,
+) -> dict:
+    """Which units to sell so that the year's LTCG ends up just within the exemption
+
+    Args:
+        schemes (List[Scheme]): schemes or compact scheme records, non-equity schemes are skipped
+        exemption (Decimal): LTCG exempt from tax in a financial year
+        realized_ltcg (Decimal): equity LTCG already realized in the financial year
+        as_of (Optional[datetime.date]): date of the sale, today by default, at the current NAVs
+
+    Returns:
+        dict: "budget" (exemption left), total "ltcg" and "amount" of the plan, number of
+            "orders", the "method" that chose them and the sale of every scheme under "schemes",
+            with the lots it takes units from
+    """
+    as_of = as_of or datetime.date.today()
+    budget = max(exemption - realized_ltcg, Decimal("0.0"))
+
+    with metrics.span("harvest.candidates"):
+        candidates = [get_candidate(scheme, as_of) for scheme in schemes]
+        candidates = [candidate for candidate in candidates if candidate is not None]
+    metrics.increment("harvest.lots", sum(len(candidate.units) for candidate in candidates))
+
+    with metrics.span("harvest.plan"):
+        sales, method = plan_sales(candidates, to_fixed(budget, GAIN_DECIMALS))
+    sale_dicts = [_sale_dict(sale) for sale in sales]
+
+    return {
+        "as_of": as_of,
+        "exemption": exemption,
+        "realized_ltcg": realized_ltcg,
+        "budget": budget,
+        "ltcg": sum((sale["ltcg"] for sale in sale_dicts), Decimal("0.0")),
+        "amount": sum((sale["amount"] for sale in sale_dicts), Decimal("0.0")),
+        "orders": len(sales),
+        "method": method,
+        "schemes": sale_dicts,
+    }
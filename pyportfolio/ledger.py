@@ -0,0 +1,202 @@
+"""Persistent ledger of casparser data, merged incrementally from statements of later periods
+
+A CAS covering only the last month repeats none of the history before it, and overlapping
+statements repeat some transactions. The ledger keeps every scheme's transactions across all merged
+statements, dedupes transactions by (folio, AMFI code, date, type, units, amount) and reports which
+schemes changed, so a portfolio rebuilds only those.
+"""
+
+import datetime
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from casparser.types import CASParserDataType, SchemeType as CASParserSchemeType
+
+from . import metrics
+from .cache import dump_compressed, load_compressed
+from .scheme_factory import add_folio_details
+from .utils import logger
+
+LEDGER_VERSION = 1
+STATEMENT_DATE_FORMAT = "%d-%b-%Y"
+
+SchemeKey = Tuple[str, str]
+
+
+def get_scheme_key(folio: str, scheme_dict: CASParserSchemeType) -> SchemeKey:
+    """Identifies a scheme within a folio, by AMFI code, ISIN or name in that order"""
+    return folio, str(scheme_dict.get("amfi") or scheme_dict.get("isin") or scheme_dict["scheme"])
+
+
+def get_transaction_key(folio: str, scheme_dict: CASParserSchemeType, transaction: dict) -> tuple:
+    return (
+        folio,
+        scheme_dict.get("amfi"),
+        transaction["date"],
+        transaction["type"],
+        transaction["units"],
+        transaction["amount"],
+    )
+
+
+def _parse_statement_date(value) -> Optional[datetime.date]:
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        return datetime.datetime.strptime(value, STATEMENT_DATE_FORMAT).date()
+    except (TypeError, ValueError):
+        return None
+
+
+class PortfolioLedger:
+    """All schemes and transactions merged from one investor's CAS statements
+
+    Attributes:
+        investor_info (dict): investor info of the latest statement
+        statement_from (Optional[datetime.date]): start of the earliest merged statement
+        statement_to (Optional[datetime.date]): end of the latest merged statement
+        scheme_dicts (List[dict]): casparser scheme dicts, in the order schemes were first seen
+    """
+
+    def __init__(self) -> None:
+        self.investor_info: dict = {}
+        self.statement_from: Optional[datetime.date] = None
+        self.statement_to: Optional[datetime.date] = None
+        self.folios: Dict[str, dict] = {}
+        self.scheme_dicts: List[dict] = []
+        self.scheme_folios: List[str] = []
+        self._index: Dict[SchemeKey, int] = {}
+        self._transaction_keys: List[Counter] = []
+
+    def merge(self, data: CASParserDataType) -> List[int]:
+        """Merge a statement into the ledger
+
+        Transactions already in the ledger are skipped, as many times as they occur in it, so
+        repeated identical transactions (e.g. two SIPs on the same day) are kept. Closing balances,
+        valuations and folio details are taken from the statement unless it ends before the ledger
+        does, folios seen for the first time are always added.
+
+        Args:
+            data (CASParserDataType): data from casparser.read_cas_pdf
+
+        Returns:
+            List[int]: positions in scheme_dicts of the schemes that were added or changed
+        """
+        period = data.get("statement_period") or {}
+        statement_from = _parse_statement_date(period.get("from"))
+        statement_to = _parse_statement_date(period.get("to"))
+        is_latest = (
+            self.statement_to is None or statement_to is None or statement_to >= self.statement_to
+        )
+
+        if is_latest:
+            self.investor_info = data["investor_info"]
+            self.statement_to = statement_to or self.statement_to
+        if statement_from and (self.statement_from is None or statement_from < self.statement_from):
+            self.statement_from = statement_from
+
+        changed = []
+        added_transactions = 0
+        for folio_dict in data["folios"]:
+            folio = folio_dict["folio"]
+            if is_latest or folio not in self.folios:
+                self.folios[folio] = {k: v for k, v in folio_dict.items() if k != "schemes"}
+            for scheme_dict in folio_dict["schemes"]:
+                index, is_new, added = self.__merge_scheme(folio, scheme_dict, is_latest)
+                if is_new or added:
+                    changed.append(index)
+                added_transactions += added
+
+        metrics.increment("ledger.transactions_added", added_transactions)
+        logger.info(f"Merged {added_transactions} new transactions into {len(changed)} schemes")
+        return changed
+
+    def __merge_scheme(
+        self, folio: str, scheme_dict: CASParserSchemeType, is_latest: bool
+    ) -> Tuple[int, bool, int]:
+        """Position of the scheme, whether it is new and the number of transactions added"""
+        key = get_scheme_key(folio, scheme_dict)
+        index = self._index.get(key)
+        if index is None:
+            index = len(self.scheme_dicts)
+            self._index[key] = index
+            self.scheme_dicts.append({**scheme_dict, "transactions": []})
+            self.scheme_folios.append(folio)
+            self._transaction_keys.append(Counter())
+            return index, True, self.__add_transactions(index, scheme_dict["transactions"])
+
+        existing = self.scheme_dicts[index]
+        added = self.__add_transactions(index, scheme_dict["transactions"])
+        if is_latest:
+            for field in ("close", "close_calculated", "valuation"):
+                if field in scheme_dict:
+                    existing[field] = scheme_dict[field]
+        return index, False, added
+
+    def __add_transactions(self, index: int, transactions: List[dict]) -> int:
+        scheme_dict = self.scheme_dicts[index]
+        folio = self.scheme_folios[index]
+        seen = self._transaction_keys[index]
+        in_statement = Counter()
+        new = []
+        for transaction in transactions:
+            key = get_transaction_key(folio, scheme_dict, transaction)
+            in_statement[key] += 1
+            if in_statement[key] > seen[key]:
+                new.append(transaction)
+
+        if not new:
+            return 0
+
+        for transaction in new:
+            seen[get_transaction_key(folio, scheme_dict, transaction)] += 1
+
+        merged = scheme_dict["transactions"]
+        in_order = not merged or merged[-1]["date"] <= new[0]["date"]
+        merged.extend(new)
+        if not in_order:
+            merged.sort(key=lambda transaction: transaction["date"])
+        return len(new)
+
+    def get_scheme_dict(self, index: int) -> CASParserSchemeType:
+        """Scheme dict at the position, with its folio number and AMC like get_scheme_dicts"""
+        folio = self.scheme_folios[index]
+        return add_folio_details(self.scheme_dicts[index], self.folios[folio])
+
+    def to_data(self) -> dict:
+        """casparser shaped data of the whole ledger"""
+        folios = {folio: {**folio_dict, "schemes": []} for folio, folio_dict in self.folios.items()}
+        for folio, scheme_dict in zip(self.scheme_folios, self.scheme_dicts):
+            folios[folio]["schemes"].append(scheme_dict)
+
+        def to_string(date):
+            return date.strftime(STATEMENT_DATE_FORMAT) if date else None
+
+        return {
+            "statement_period": {
+                "from": to_string(self.statement_from),
+                "to": to_string(self.statement_to),
+            },
+            "folios": list(folios.values()),
+            "investor_info": self.investor_info,
+        }
+
+    def save(self, path) -> None:
+        dump_compressed({"version": LEDGER_VERSION, "ledger": self.__dict__}, path)
+
+    @classmethod
+    def load(cls, path) -> "PortfolioLedger":
+        """Ledger written by save
+
+        Raises:
+            ValueError if the file was written by an incompatible version
+        """
+        saved = load_compressed(path)
+        if saved.get("version") != LEDGER_VERSION:
+            raise ValueError(f"Unsupported portfolio ledger version: {saved.get('version')}")
+        ledger = cls.__new__(cls)
+        ledger.__dict__.update(saved["ledger"])
+        return ledger
+
+    def __len__(self) -> int:
+        return len(self.scheme_dicts)
@@ -0,0 +1,164 @@
+from collections import deque
+from decimal import Decimal
+from typing import Deque, Iterator, List, Tuple
+from casparser.enums import TransactionType
+
+from .models import Transaction
+from .utils import logger
+
+# Transactions that add units to a folio and the ones that extinguish them
+ACQUISITION_TYPES = frozenset(
+    transaction_type.value
+    for transaction_type in (
+        TransactionType.PURCHASE,
+        TransactionType.PURCHASE_SIP,
+        TransactionType.DIVIDEND_REINVEST,
+        TransactionType.SWITCH_IN,
+        TransactionType.SWITCH_IN_MERGER,
+    )
+)
+DISPOSAL_TYPES = frozenset(
+    transaction_type.value
+    for transaction_type in (
+        TransactionType.REDEMPTION,
+        TransactionType.SWITCH_OUT,
+        TransactionType.SWITCH_OUT_MERGER,
+    )
+)
+
+
+class Lot:
+    """Units of a single acquisition that are still held
+
+    A lightweight view over the acquiring transaction, the transaction itself is never modified.
+    """
+
+    __slots__ = ("transaction", "units")
+
+    def __init__(self, transaction: Transaction, units: Decimal) -> None:
+        self.transaction = transaction
+        self.units = units
+
+    @property
+    def date(self):
+        return self.transaction.date
+
+    @property
+    def days(self) -> int:
+        return self.transaction.days
+
+    @property
+    def type(self) -> str:
+        return self.transaction.type
+
+    @property
+    def nav(self) -> Decimal:
+        return self.transaction.nav
+
+    @property
+    def amount(self) -> Decimal:
+        """Cost of the held units, the original amount unless the lot was partially redeemed"""
+        if self.units == self.transaction.units:
+            return self.transaction.amount
+        return self.units * self.transaction.nav
+
+    def dict(self) -> dict:
+        """Transaction dict of the acquisition, with units and amount of the held part"""
+        lot_dict = self.transaction.dict()
+        lot_dict["units"] = self.units
+        lot_dict["amount"] = self.amount
+        return lot_dict
+
+    def __repr__(self) -> str:
+        return f"Lot(date={self.date}, units={self.units}, nav={self.nav})"
+
+
+class LotLedger:
+    """FIFO ledger of open lots, built in a single chronological pass over the transactions
+
+    Every acquisition (purchase, SIP, switch-in, dividend reinvestment) opens a lot and every
+    redemption or switch-out consumes the oldest open lots first. Reversals with negative units
+    cancel the most recent lot.
+    """
+
+    def __init__(self, transactions: List[Transaction]) -> None:
+        self.open_lots: Deque[Lot] = deque()
+        # Units disposed of in excess of the known lots, e.g. from an opening balance
+        self.unmatched_units = Decimal("0.0")
+
+        for transaction in sorted_by_date(transactions):
+            self.add(transaction)
+
+        if self.unmatched_units:
+            logger.debug(f"{self.unmatched_units} disposed units could not be matched to lots")
+
+    def add(self, transaction: Transaction) -> List[Tuple[Lot, Decimal]]:
+        """Apply a single transaction, which must not be older than those already applied
+
+        Returns:
+            List[Tuple[Lot, Decimal]]: lots a disposal took units from, see consume. Empty for
+                other transactions.
+        """
+        if not transaction.units:
+            return []
+
+        if transaction.type in ACQUISITION_TYPES:
+            self.open_lots.append(Lot(transaction, transaction.units))
+        elif transaction.type in DISPOSAL_TYPES:
+            return self.consume(abs(transaction.units))
+        elif transaction.type == TransactionType.REVERSAL.value:
+            if transaction.units > 0:
+                self.open_lots.append(Lot(transaction, transaction.units))
+            else:
+                self.__cancel_latest(-transaction.units)
+        return []
+
+    def consume(self, units: Decimal) -> List[Tuple[Lot, Decimal]]:
+        """Extinguish units from the oldest open lots
+
+        Returns:
+            List[Tuple[Lot, Decimal]]: lots the units were taken from, with the units taken
+        """
+        matched = []
+        while units > 0 and self.open_lots:
+            lot = self.open_lots[0]
+            if lot.units <= units:
+                self.open_lots.popleft()
+                matched.append((lot, lot.units))
+                units -= lot.units
+            else:
+                matched.append((lot, units))
+                lot.units -= units
+                units = Decimal("0.0")
+
+        self.unmatched_units += units
+        return matched
+
+    def __cancel_latest(self, units: Decimal) -> None:
+        while units > 0 and self.open_lots:
+            lot = self.open_lots[-1]
+            if lot.units <= units:
+                self.open_lots.pop()
+                units -= lot.units
+            else:
+                lot.units -= units
+                units = Decimal("0.0")
+
+        self.unmatched_units += units
+
+    @property
+    def units(self) -> Decimal:
+        return sum((lot.units for lot in self.open_lots), Decimal("0.0"))
+
+    def __iter__(self) -> Iterator[Lot]:
+        return iter(self.open_lots)
+
+    def __len__(self) -> int:
+        return len(self.open_lots)
+
+
+def sorted_by_date(transactions: List[Transaction]) -> List[Transaction]:
+    """Stable sort of transactions by date, skipped when they are already in order"""
+    if all(transactions[i].date <= transactions[i + 1].date for i in range(len(transactions) - 1)):
+        return transactions
+    return sorted(transactions, key=lambda transaction: transaction.date)
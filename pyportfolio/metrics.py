@@ -0,0 +1,147 @@
+"""Named timing spans and counters around the phases of loading and analyzing a portfolio
+
+Instrumentation is disabled by default, span() then returns a shared no-op context manager and
+increment() returns immediately. Enable it to find out where the time goes:
+
+    metrics.enable()
+    portfolio = Portfolio(cas_file, cas_password)
+    portfolio.ltcg_tax_harvesting_summary()
+    print(metrics.get_metrics().report())
+
+Spans and counters are recorded from every thread into the one enabled collector. Spans may nest, so
+span totals are not additive, and spans recorded from worker threads add up their wall time.
+"""
+
+import functools
+import json
+import threading
+import time
+from contextlib import nullcontext
+from typing import Dict, Optional
+
+_NULL_SPAN = nullcontext()
+
+
+class Span:
+    """Times the enclosed block into the collector's span with the same name"""
+
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics: "Metrics", name: str) -> None:
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+
+
+class Metrics:
+    """Collector of span timings (calls and total seconds) and counters"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.spans: Dict[str, list] = {}
+        self.counters: Dict[str, int] = {}
+
+    def span(self, name: str) -> Span:
+        return Span(self, name)
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            span = self.spans.setdefault(name, [0, 0.0])
+            span[0] += 1
+            span[1] += seconds
+
+    def increment(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self) -> None:
+        with self._lock:
+            self.spans.clear()
+            self.counters.clear()
+
+    def as_dict(self) -> dict:
+        """Spans as {"calls", "total_ms", "mean_ms"} by name, and counters, for JSON export"""
+        with self._lock:
+            spans = {
+                name: {
+                    "calls": calls,
+                    "total_ms": round(seconds * 1000, 3),
+                    "mean_ms": round(seconds * 1000 / calls, 3),
+                }
+                for name, (calls, seconds) in self.spans.items()
+            }
+            return {"spans": spans, "counters": dict(self.counters)}
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), indent=2)
+
+    def report(self) -> str:
+        """Per-phase breakdown as plain text, slowest span first"""
+        data = self.as_dict()
+        lines = [f"{'span':<32} {'calls':>8} {'total ms':>12} {'mean ms':>10}"]
+        spans = sorted(data["spans"].items(), key=lambda item: item[1]["total_ms"], reverse=True)
+        for name, span in spans:
+            lines.append(
+                f"{name:<32} {span['calls']:>8} {span['total_ms']:>12.1f} {span['mean_ms']:>10.2f}"
+            )
+        if data["counters"]:
+            lines.append("")
+            lines.append(f"{'counter':<32} {'value':>8}")
+            for name, value in sorted(data["counters"].items()):
+                lines.append(f"{name:<32} {value:>8}")
+        return "\n".join(lines)
+
+
+_metrics: Optional[Metrics] = None
+
+
+def enable(collector: Optional[Metrics] = None) -> Metrics:
+    """Start recording into the given collector, or a new one, and return it"""
+    global _metrics
+    _metrics = collector if collector is not None else Metrics()
+    return _metrics
+
+
+def disable() -> None:
+    global _metrics
+    _metrics = None
+
+
+def get_metrics() -> Optional[Metrics]:
+    """The enabled collector, None while instrumentation is disabled"""
+    return _metrics
+
+
+def span(name: str):
+    """Context manager timing the enclosed block, a no-op while disabled"""
+    collector = _metrics
+    if collector is None:
+        return _NULL_SPAN
+    return Span(collector, name)
+
+
+def timed(name: str):
+    """Decorator recording every call of the function as a span"""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def increment(name: str, value: int = 1) -> None:
+    """Add to a counter, a no-op while disabled"""
+    collector = _metrics
+    if collector is not None:
+        collector.increment(name, value)
@@ -1,28 +1,238 @@
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+from .cache import SchemeDetailsNotCached, get_default_cache
+from .constants import DEFAULT_MAX_WORKERS
+from .utils import logger
+
+if TYPE_CHECKING:
+    import numpy as np
+
+    from .navstore import NavStore
 
 SCHEME_API_URL = "https://api.mfapi.in/mf/{code}"
-session = requests.Session()
+# Appended to a scheme's URL to get its metadata with only the latest NAV
+LATEST_NAV_PATH = "/latest"
+
+REQUEST_TIMEOUT = 10  # seconds, per request
+MAX_RETRIES = 3
+
+# requests.Session is not guaranteed to be thread-safe, so every worker thread gets its own
+_thread_local = threading.local()
+
 
+def get_session() -> requests.Session:
+    """Returns the requests session for the current thread, with retries configured"""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        retry = Retry(
+            total=MAX_RETRIES,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+        )
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(max_retries=retry))
+        session.mount("http://", HTTPAdapter(max_retries=retry))
+        _thread_local.session = session
 
-def get_scheme_details(amfi_id):
+    return session
+
+
+def get_scheme_details(amfi_id, offline: bool = False, refresh: bool = False):
     """
-    gets the scheme info for a given scheme code
+    gets the scheme info for a given scheme code, from the on-disk cache while it is fresh
+    only the latest NAV is fetched for cached schemes whose metadata hasn't expired
+    :param code: scheme code
+    :param offline: only use cached values, irrespective of their age
+    :param refresh: fetch the NAV from the API even if the cached value is fresh
+    :return: dict or None
+    :raises: HTTPError, URLError, SchemeDetailsNotCached
+    """
+    code = str(amfi_id)
+    cache = get_default_cache()
+    cached = cache.get(code) if cache is not None else None
+
+    if cached is not None and (offline or (not refresh and cache.is_fresh(cached))):
+        metrics.increment("scheme_cache.hits")
+        return cached.details
+
+    metrics.increment("scheme_cache.misses")
+
+    if offline:
+        raise SchemeDetailsNotCached(
+            f"Scheme details for {code} are not cached, load the portfolio once while online"
+        )
+
+    nav_only = cached is not None and cached.details is not None and cache.is_meta_fresh(cached)
+    try:
+        if nav_only:
+            nav = fetch_latest_nav(code)
+        else:
+            scheme_info = fetch_scheme_details(code)
+    except requests.RequestException as e:
+        metrics.increment("api.errors")
+        if cached is None:
+            raise
+        logger.warning(f"Using stale scheme details for {code}: {e}")
+        return cached.details
+
+    if nav_only:
+        if nav is None:
+            return cached.details
+        cache.put_nav(code, nav)
+        return dict(cached.details, nav=nav)
+
+    if cache is not None:
+        cache.put(code, scheme_info)
+
+    return scheme_info
+
+
+def fetch_scheme_details(amfi_id):
+    """
+    gets the scheme info for a given scheme code from the API, bypassing the cache
     :param code: scheme code
     :return: dict or None
     :raises: HTTPError, URLError
     """
     code = str(amfi_id)
     url = SCHEME_API_URL.format(code=code)
-    response = session.get(url).json()
+    metrics.increment("api.requests")
+    with metrics.span("api.request"):
+        response = get_session().get(url, timeout=REQUEST_TIMEOUT).json()
 
     scheme_info = response["meta"]
     if scheme_info:
         scheme_info["nav"] = response["data"][0]["nav"]
+        # navstore pulls in numpy, only pay for it once a response is in hand
+        from .navstore import get_default_nav_store
+
+        nav_store = get_default_nav_store()
+        if nav_store is not None:
+            nav_store.update(code, parse_nav_history(response["data"]))
         return scheme_info
 
     return None
 
 
+def fetch_latest_nav(amfi_id) -> Optional[str]:
+    """
+    gets only the latest NAV of a scheme from the API, a much smaller response than its details
+    :param code: scheme code
+    :return: NAV or None if the API has none
+    :raises: HTTPError, URLError
+    """
+    url = SCHEME_API_URL.format(code=str(amfi_id)) + LATEST_NAV_PATH
+    metrics.increment("api.requests")
+    with metrics.span("api.request"):
+        response = get_session().get(url, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+
+    data = response.json().get("data")
+    return data[0]["nav"] if data else None
+
+
+def parse_nav_history(data: List[dict]) -> List[Tuple[datetime.date, str]]:
+    """(date, NAV) pairs from the "data" of an API response, dates there are dd-mm-yyyy"""
+    return [
+        (
+            datetime.date(int(row["date"][6:]), int(row["date"][3:5]), int(row["date"][:2])),
+            row["nav"],
+        )
+        for row in data
+    ]
+
+
+def get_nav_history(
+    amfi_id, nav_store: Optional["NavStore"] = None, offline: bool = False, refresh: bool = False
+) -> "np.ndarray":
+    """
+    gets the NAV history of a scheme, from the NAV store if it has any NAVs of the scheme
+    :param amfi_id: scheme code
+    :param nav_store: store to read from and record into, defaults to the default store or one in
+        the cache directory
+    :param offline: only use stored NAVs
+    :param refresh: fetch from the API and append NAVs published since the last stored one
+    :return: navstore.RECORD array of dates and NAVs, sorted by date
+    :raises: HTTPError, URLError
+    """
+    from .navstore import NavStore, get_default_nav_store
+
+    code = str(amfi_id)
+    nav_store = nav_store or get_default_nav_store() or NavStore()
+
+    if not offline and (refresh or len(nav_store.history(code)) == 0):
+        response = get_session().get(SCHEME_API_URL.format(code=code), timeout=REQUEST_TIMEOUT)
+        metrics.increment("api.requests")
+        response.raise_for_status()
+        data = response.json().get("data") or []
+        added = nav_store.update(code, parse_nav_history(data))
+        logger.debug(f"Stored {added} new NAVs of {code}")
+
+    return nav_store.history(code)
+
+
+def refresh_nav_histories(
+    amfi_ids: Iterable, nav_store: "NavStore", max_workers: int = DEFAULT_MAX_WORKERS
+) -> List[str]:
+    """
+    fetches the NAV histories of many schemes into the store, with at most max_workers requests in
+    flight. A scheme whose history can't be fetched keeps its stored NAVs and is logged
+    :param amfi_ids: scheme codes, duplicates are fetched only once
+    :param nav_store: store to record into
+    :param max_workers: number of concurrent requests
+    :return: codes of the schemes that couldn't be fetched
+    """
+    codes = list(dict.fromkeys(str(amfi_id) for amfi_id in amfi_ids))
+    if not codes:
+        return []
+
+    def refresh(code: str) -> bool:
+        try:
+            get_nav_history(code, nav_store=nav_store, refresh=True)
+        except requests.RequestException as e:
+            metrics.increment("api.errors")
+            logger.warning(f"Using stored NAVs of {code}, fetching its NAV history failed: {e}")
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(codes))) as executor:
+        return [code for code, ok in zip(codes, executor.map(refresh, codes)) if not ok]
+
+
+def get_scheme_details_bulk(
+    amfi_ids: Iterable,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    offline: bool = False,
+    refresh: bool = False,
+) -> Dict[str, Optional[dict]]:
+    """
+    gets the scheme info for many scheme codes, with at most max_workers requests in flight
+    :param amfi_ids: scheme codes, duplicates are fetched only once
+    :param max_workers: number of concurrent requests, 1 fetches sequentially
+    :param offline: only use cached values, irrespective of their age
+    :param refresh: fetch from the API even if the cached values are fresh
+    :return: dict of scheme code to scheme info (or None)
+    :raises: HTTPError, URLError, SchemeDetailsNotCached
+    """
+    codes = list(dict.fromkeys(str(amfi_id) for amfi_id in amfi_ids))
+    get_details = partial(get_scheme_details, offline=offline, refresh=refresh)
+
+    if offline or max_workers <= 1 or len(codes) <= 1:
+        return {code: get_details(code) for code in codes}
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(codes))) as executor:
+        return dict(zip(codes, executor.map(get_details, codes)))
+
+
 if __name__ == "__main__":
     print(get_scheme_details(119551))
     print(get_scheme_details(111))
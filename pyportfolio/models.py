@@ -21,6 +21,8 @@ class Scheme(BaseModel):
     nav: Decimal
     type: Union[str, None]
     subtype: Union[str, None]
+    folio: Optional[str] = None
+    amc: Optional[str] = None
     valuation: Optional[Decimal]
     transactions: Optional[List[Transaction]]
 
@@ -0,0 +1,192 @@
+"""On-disk store of historical NAVs, memory-mapped so histories are never loaded into Python objects
+
+Every scheme has one binary file of fixed size records, sorted by date:
+
+    date: int32 proleptic Gregorian ordinal
+    nav:  int64 NAV with NAV_DECIMALS implied decimal places
+
+Lookups binary search the memory-mapped date column, the NAV as of a date is the one published on
+the latest date not after it. New NAVs are appended, only backfilled older dates rewrite the file.
+"""
+
+import datetime
+import os
+import threading
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, Iterable, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .cache import get_cache_dir
+from .columnar import NAV_DECIMALS, from_fixed, to_fixed
+from .utils import logger
+
+NAV_STORE_DIR = "navs"
+RECORD = np.dtype([("date", "<i4"), ("nav", "<i8")])
+
+
+class AsOfNavs(NamedTuple):
+    """Result of NavStore.lookup, one element per requested (scheme, date) pair
+
+    Attributes:
+        navs: int64 NAVs with NAV_DECIMALS implied decimals, 0 where not found
+        ordinals: int32 ordinals of the dates the NAVs were published on, 0 where not found
+        found: bool mask of pairs with a NAV on or before the date
+    """
+
+    navs: np.ndarray
+    ordinals: np.ndarray
+    found: np.ndarray
+
+
+class NavStore:
+    """Directory of per-scheme NAV history files, see the module docstring for the format"""
+
+    def __init__(self, directory=None) -> None:
+        self.directory = (
+            Path(directory) if directory is not None else get_cache_dir() / NAV_STORE_DIR
+        )
+        self._maps: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def path(self, amfi_id) -> Path:
+        return self.directory / f"{amfi_id}.nav"
+
+    def history(self, amfi_id) -> np.ndarray:
+        """Read-only RECORD array of the scheme's NAVs, empty if none are stored"""
+        code = str(amfi_id)
+        with self._lock:
+            records = self._maps.get(code)
+            if records is None:
+                records = self.__map(code)
+                self._maps[code] = records
+        return records
+
+    def __map(self, code: str) -> np.ndarray:
+        path = self.path(code)
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return np.empty(0, dtype=RECORD)
+        if size < RECORD.itemsize:
+            return np.empty(0, dtype=RECORD)
+        if size % RECORD.itemsize:
+            logger.warning(f"Ignoring truncated record at the end of {path}")
+        return np.memmap(path, dtype=RECORD, mode="r", shape=(size // RECORD.itemsize,))
+
+    def last_date(self, amfi_id) -> Optional[datetime.date]:
+        records = self.history(amfi_id)
+        if len(records) == 0:
+            return None
+        return datetime.date.fromordinal(int(records["date"][-1]))
+
+    def update(self, amfi_id, navs: Iterable[Tuple[datetime.date, object]]) -> int:
+        """Add NAVs of a scheme, ignoring dates that are already stored
+
+        Args:
+            amfi_id: scheme code
+            navs (Iterable[Tuple[datetime.date, object]]): (date, NAV) pairs in any order, NAVs as
+                Decimal, str or anything else Decimal accepts
+
+        Returns:
+            int: number of NAVs added
+        """
+        new = np.array(
+            [(date.toordinal(), to_fixed(nav, NAV_DECIMALS)) for date, nav in navs], dtype=RECORD
+        )
+        if len(new) == 0:
+            return 0
+        new = new[np.argsort(new["date"], kind="stable")]
+        # Keep the first NAV of every date
+        new = new[np.concatenate(([True], np.diff(new["date"]) != 0))]
+
+        code = str(amfi_id)
+        with self._lock:
+            existing = self.__map(code)
+            self._maps.pop(code, None)
+
+            path = self.path(code)
+            aligned = not path.exists() or path.stat().st_size % RECORD.itemsize == 0
+            if aligned and (len(existing) == 0 or new["date"][0] > existing["date"][-1]):
+                added = new
+                self.directory.mkdir(parents=True, exist_ok=True)
+                with open(path, "ab") as f:
+                    f.write(added.tobytes())
+            else:
+                added = new[~np.isin(new["date"], existing["date"])]
+                if len(added) or not aligned:
+                    merged = np.concatenate((existing, added))
+                    del existing  # unmap before the file is replaced
+                    self.__rewrite(code, merged[np.argsort(merged["date"], kind="stable")])
+
+        return len(added)
+
+    def __rewrite(self, code: str, records: np.ndarray) -> None:
+        path = self.path(code)
+        tmp_path = path.with_name(path.name + f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(records.tobytes())
+        os.replace(tmp_path, path)
+
+    def nav_on(self, amfi_id, date: datetime.date) -> Optional[Decimal]:
+        """NAV of the scheme as of the date, None if no NAV was published on or before it"""
+        records = self.history(amfi_id)
+        row = np.searchsorted(records["date"], date.toordinal(), side="right") - 1
+        if row < 0:
+            return None
+        return from_fixed(records["nav"][row], NAV_DECIMALS)
+
+    def lookup(self, amfi_ids: Sequence, dates: Sequence[datetime.date]) -> AsOfNavs:
+        """NAVs as of many (scheme, date) pairs, with one vectorized search per scheme
+
+        Args:
+            amfi_ids (Sequence): scheme code of every pair
+            dates (Sequence[datetime.date]): date of every pair, or an array of ordinals
+
+        Returns:
+            AsOfNavs: NAVs in the order of the pairs
+        """
+        codes = np.asarray([str(amfi_id) for amfi_id in amfi_ids])
+        if isinstance(dates, np.ndarray) and dates.dtype.kind == "i":
+            ordinals = dates.astype(np.int32)
+        else:
+            ordinals = np.fromiter(
+                (date.toordinal() for date in dates), dtype=np.int32, count=len(dates)
+            )
+
+        navs = np.zeros(len(codes), dtype=np.int64)
+        found_ordinals = np.zeros(len(codes), dtype=np.int32)
+        found = np.zeros(len(codes), dtype=bool)
+        unique_codes, inverse = np.unique(codes, return_inverse=True)
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.searchsorted(inverse[order], np.arange(len(unique_codes) + 1))
+        for index, code in enumerate(unique_codes):
+            pairs = order[bounds[index] : bounds[index + 1]]
+            records = self.history(code)
+            rows = np.searchsorted(records["date"], ordinals[pairs], side="right") - 1
+            hit = rows >= 0
+            pairs, rows = pairs[hit], rows[hit]
+            navs[pairs] = records["nav"][rows]
+            found_ordinals[pairs] = records["date"][rows]
+            found[pairs] = True
+
+        return AsOfNavs(navs, found_ordinals, found)
+
+    def close(self) -> None:
+        """Drop the memory maps, they are reopened on the next lookup"""
+        with self._lock:
+            self._maps.clear()
+
+
+_default_nav_store: Optional[NavStore] = None
+
+
+def get_default_nav_store() -> Optional[NavStore]:
+    """Store that mfhelper records fetched NAV histories into, None (the default) to not record"""
+    return _default_nav_store
+
+
+def set_default_nav_store(store: Optional[NavStore]) -> None:
+    global _default_nav_store
+    _default_nav_store = store
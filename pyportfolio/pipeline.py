@@ -0,0 +1,328 @@
+"""Pipelined loading of a CAS pdf, overlapping text extraction with scheme detail lookups
+
+casparser.read_cas_pdf extracts the text of every page before parsing any of it, and scheme details
+are only requested once the whole statement is parsed, so loading takes the parsing time plus the
+network time. The pipeline instead:
+
+    - extracts the text of the pages in chunks, across a process pool for long statements
+    - scans every chunk for scheme lines as soon as it is extracted, and starts fetching the
+      details of their AMFI codes while the following chunks are still being extracted
+    - parses the complete text with casparser, giving the same data as read_cas_pdf
+    - builds every scheme as soon as its details have arrived, while the rest are still in flight
+
+    data, schemes = load_cas_pdf(cas_file, cas_password)
+
+The scan only starts lookups early. Schemes it misses, e.g. a scheme line split across two chunks,
+are fetched after parsing like any other.
+"""
+
+import io
+import itertools
+import re
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from casparser.enums import FileType
+from casparser.exceptions import CASParseError
+from casparser.parsers.utils import PartialCASData
+from casparser.process import process_cas_text
+from casparser.process.regex import FOLIO_RE, REGISTRAR_RE, SCHEME_RE
+from casparser.process.utils import isin_search
+
+from . import metrics
+from .amfi import AMFINavMaster
+from .cache import CASDataCache
+from .constants import DEFAULT_MAX_WORKERS
+from .mfhelper import get_scheme_details
+from .models import Scheme
+from .scheme_factory import create_scheme_with_details, get_scheme_dicts
+from .utils import logger
+
+# Pages extracted per task, small enough for the first lookups to start early
+PAGES_PER_TASK = 4
+
+
+def _open_document(fp, password):
+    from pdfminer.pdfdocument import PDFDocument, PDFPasswordIncorrect, PDFSyntaxError
+    from pdfminer.pdfparser import PDFParser
+
+    try:
+        return PDFDocument(PDFParser(fp), password=password)
+    except PDFPasswordIncorrect:
+        raise CASParseError("Incorrect PDF password!")
+    except PDFSyntaxError:
+        raise CASParseError("Unhandled error while opening file")
+
+
+def count_pages(pdf_bytes: bytes, password) -> int:
+    from pdfminer.pdfpage import PDFPage
+
+    with io.BytesIO(pdf_bytes) as fp:
+        return sum(1 for _ in PDFPage.create_pages(_open_document(fp, password)))
+
+
+def extract_pages(
+    pdf_bytes: bytes, password, start: int = 0, stop: Optional[int] = None
+) -> PartialCASData:
+    """Text lines of pages [start, stop) of a CAS pdf, as casparser's pdfminer parser extracts them
+
+    Runs in the worker processes. Lines are grouped page by page, so the lines of consecutive page
+    ranges add up to the lines of the whole pdf. The investor info is only read from the first page.
+
+    Returns:
+        PartialCASData: file type (None if not found in these pages), investor info (None unless
+            start is 0) and lines
+    """
+    from casparser.parsers.pdfminer import (
+        detect_pdf_source,
+        group_similar_rows,
+        parse_investor_info,
+    )
+    from pdfminer.converter import PDFPageAggregator
+    from pdfminer.layout import LAParams, LTTextBoxHorizontal, LTTextBoxVertical
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+
+    with io.BytesIO(pdf_bytes) as fp:
+        document = _open_document(fp, password)
+        line_margin = {FileType.KFINTECH: 0.1, FileType.CAMS: 0.2}.get(
+            detect_pdf_source(document), 0.2
+        )
+        resource_manager = PDFResourceManager()
+        device = PDFPageAggregator(
+            resource_manager, laparams=LAParams(line_margin=line_margin, detect_vertical=True)
+        )
+        interpreter = PDFPageInterpreter(resource_manager, device)
+
+        file_type = None
+        investor_info = None
+        pages = []
+        for page in itertools.islice(PDFPage.create_pages(document), start, stop):
+            interpreter.process_page(page)
+            layout = device.get_result()
+            if file_type is None:
+                for element in layout:
+                    if not isinstance(element, LTTextBoxVertical):
+                        continue
+                    if re.search("CAMSCASWS", element.get_text()):
+                        file_type = FileType.CAMS
+                    if re.search("KFINCASWS", element.get_text()):
+                        file_type = FileType.KFINTECH
+            if start == 0 and investor_info is None:
+                investor_info = parse_investor_info(layout, *page.mediabox[2:])
+            pages.append(
+                [element for element in layout if isinstance(element, LTTextBoxHorizontal)]
+            )
+
+        return PartialCASData(
+            file_type=file_type, investor_info=investor_info, lines=group_similar_rows(pages)
+        )
+
+
+def iter_text_chunks(
+    pdf_bytes: bytes, password, processes: Optional[int] = None
+) -> Iterator[PartialCASData]:
+    """Text of a CAS pdf in chunks of PAGES_PER_TASK pages, in page order
+
+    Args:
+        pdf_bytes (bytes): contents of the CAS pdf
+        password: CAS pdf password
+        processes (Optional[int]): number of extracting processes, defaults to the CPU count.
+            Statements of a single chunk, or processes=1, are extracted in this process.
+
+    Yields:
+        PartialCASData: extracted chunks, see extract_pages
+    """
+    try:
+        # casparser prefers mupdf when installed, which reads a whole statement quickly
+        from casparser.parsers.mupdf import cas_pdf_to_text
+    except ImportError:
+        pass
+    else:
+        yield cas_pdf_to_text(io.BytesIO(pdf_bytes), password)
+        return
+
+    page_count = count_pages(pdf_bytes, password)
+    ranges = [(start, start + PAGES_PER_TASK) for start in range(0, page_count, PAGES_PER_TASK)]
+    if processes == 1 or len(ranges) <= 1:
+        for start, stop in ranges:
+            yield extract_pages(pdf_bytes, password, start, stop)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [
+            executor.submit(extract_pages, pdf_bytes, password, start, stop)
+            for start, stop in ranges
+        ]
+        for future in futures:
+            yield future.result()
+
+
+def scan_scheme_codes(lines: List[str]) -> List[Tuple[Optional[str], Optional[str]]]:
+    """(AMFI code, ISIN) of the scheme lines in extracted text, matched the way casparser does"""
+    codes = []
+    for index, line in enumerate(lines):
+        if re.search(REGISTRAR_RE, line) and index + 1 < len(lines):
+            line = "\t\t".join([lines[index + 1], line])
+        if re.search(FOLIO_RE, line, re.I | re.DOTALL):
+            continue
+        m = re.search(SCHEME_RE, line, re.DOTALL | re.MULTILINE | re.I)
+        if m is None:
+            continue
+        scheme = re.sub(r"\(formerly.+?\)", "", m.group(2), flags=re.I | re.DOTALL).strip()
+        isin, amfi = isin_search(scheme, m.group(4).strip(), m.group(1).strip())
+        if amfi is not None:
+            codes.append((amfi, isin))
+    return codes
+
+
+class SchemeDetailsPrefetch:
+    """Scheme details by AMFI code, fetched in the background as soon as the codes are known
+
+    Args:
+        executor (Executor): runs the scheme detail requests
+        offline (bool): resolve scheme details only from the on-disk cache
+        scheme_details (Optional[Dict[str, Optional[dict]]]): scheme details by AMFI code, shared
+            between calls. Codes missing from it are fetched and added to it.
+        nav_master (Optional[AMFINavMaster]): AMFI NAV file to look schemes up in first
+    """
+
+    def __init__(
+        self,
+        executor: Executor,
+        offline: bool = False,
+        scheme_details: Optional[Dict[str, Optional[dict]]] = None,
+        nav_master: Optional[AMFINavMaster] = None,
+    ) -> None:
+        self.scheme_details = scheme_details if scheme_details is not None else {}
+        self._executor = executor
+        self._offline = offline
+        self._nav_master = nav_master
+        self._pending: Dict[str, Future] = {}
+
+    def request(self, amfi, isin: Optional[str] = None) -> None:
+        """Start resolving the scheme's details, unless they are known or requested already"""
+        code = str(amfi)
+        if code in self.scheme_details or code in self._pending:
+            return
+
+        if self._nav_master is not None:
+            details = self._nav_master.get(amfi, isin)
+            if details is not None:
+                metrics.increment("amfi.hits")
+                self.scheme_details[code] = details
+                return
+
+        metrics.increment("pipeline.requests")
+        self._pending[code] = self._executor.submit(get_scheme_details, code, offline=self._offline)
+
+    def get(self, amfi) -> Optional[dict]:
+        """Details of a requested scheme, waiting for them if they are still being fetched"""
+        code = str(amfi)
+        future = self._pending.pop(code, None)
+        if future is not None:
+            with metrics.span("schemes.resolve"):
+                self.scheme_details[code] = future.result()
+        return self.scheme_details.get(code)
+
+
+def _read_pdf_bytes(cas_file) -> bytes:
+    if isinstance(cas_file, io.IOBase):
+        return cas_file.read()
+    with open(cas_file, "rb") as f:
+        return f.read()
+
+
+def _parse_cas_text(
+    pdf_bytes: bytes, password, prefetch: SchemeDetailsPrefetch, processes: Optional[int]
+) -> dict:
+    """casparser.read_cas_pdf data of the pdf, requesting scheme details as pages are extracted"""
+    file_type = None
+    investor_info = None
+    lines: List[str] = []
+
+    chunks = iter_text_chunks(pdf_bytes, password, processes)
+    while True:
+        with metrics.span("cas.extract"):
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+
+        file_type = file_type or chunk.file_type
+        investor_info = investor_info or chunk.investor_info
+        lines.extend(chunk.lines)
+        with metrics.span("pipeline.scan"):
+            for amfi, isin in scan_scheme_codes(chunk.lines):
+                prefetch.request(amfi, isin)
+
+    if file_type is None:
+        raise CASParseError("Unable to detect the CAS file type")
+
+    with metrics.span("cas.process"):
+        data = process_cas_text("\u2029".join(lines))
+    data.update({"file_type": file_type.name, "investor_info": investor_info._asdict()})
+    return data
+
+
+def load_cas_pdf(
+    cas_file,
+    cas_password,
+    cas_cache: Optional[CASDataCache] = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    offline: bool = False,
+    scheme_details: Optional[Dict[str, Optional[dict]]] = None,
+    nav_master: Optional[AMFINavMaster] = None,
+    validate: bool = False,
+    processes: Optional[int] = None,
+) -> Tuple[dict, List[Scheme]]:
+    """Parse a CAS pdf and build its schemes, fetching scheme details while the pdf is parsed
+
+    Args:
+        cas_file: path or binary file object of the CAS pdf
+        cas_password: CAS pdf password
+        cas_cache (Optional[CASDataCache]): cache of parsed statements, None disables caching
+        max_workers (int): number of concurrent scheme detail requests
+        offline (bool): resolve scheme details only from the on-disk cache
+        scheme_details (Optional[Dict[str, Optional[dict]]]): scheme details by AMFI code, shared
+            between calls. Codes missing from it are fetched and added to it.
+        nav_master (Optional[AMFINavMaster]): AMFI NAV file to look schemes up in first
+        validate (bool): validate every value with pydantic instead of trusting casparser's types
+        processes (Optional[int]): number of processes extracting the text of long statements,
+            defaults to the CPU count
+
+    Returns:
+        Tuple[dict, List[Scheme]]: data from casparser.read_cas_pdf and the schemes in it
+
+    Raises:
+        CASParseError if the pdf can't be parsed
+    """
+    pdf_bytes = _read_pdf_bytes(cas_file)
+    key = cas_cache.key(pdf_bytes, cas_password) if cas_cache is not None else None
+    data = cas_cache.get(key) if cas_cache is not None else None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        prefetch = SchemeDetailsPrefetch(executor, offline, scheme_details, nav_master)
+
+        if data is None:
+            if cas_cache is not None:
+                metrics.increment("cas_cache.misses")
+            with metrics.span("cas.parse"):
+                data = _parse_cas_text(pdf_bytes, cas_password, prefetch, processes)
+            if cas_cache is not None:
+                cas_cache.put(key, data)
+        else:
+            metrics.increment("cas_cache.hits")
+            logger.info("Using previously parsed CAS data")
+
+        scheme_dicts = get_scheme_dicts(data)
+        for scheme_dict in scheme_dicts:
+            if scheme_dict["amfi"] is not None:
+                prefetch.request(scheme_dict["amfi"], scheme_dict.get("isin"))
+
+        schemes = []
+        for scheme_dict in scheme_dicts:
+            details = prefetch.get(scheme_dict["amfi"]) if scheme_dict["amfi"] is not None else None
+            schemes.append(create_scheme_with_details(scheme_dict, details, validate))
+            logger.debug(f"Done loading {schemes[-1].name}")
+
+    return data, schemes
@@ -1,39 +1,541 @@
 import casparser
+import datetime
+import io
+import os
 import sys
+from decimal import Decimal
 from casparser.exceptions import CASParseError
-from typing import List
+from typing import Dict, Iterator, List, Optional, Set, Union
 
 from .scheme_utils import (
     analyze_ltcg_tax_harvesting,
     get_valuation_summary_for_schemes,
-    get_filtered_schemes,
 )
-from .scheme_filters import debt_scheme_filter, equity_scheme_filter
-from .scheme_factory import initialize_and_get_schemes
-from .models import Scheme
-from .utils import logger
+from .scheme_filters import SchemeFilterType, debt_scheme_filter, equity_scheme_filter
+from .transaction_filters import TransactionFilterType
+from .scheme_factory import create_scheme_with_details, get_scheme_dicts, resolve_scheme_details
+from . import metrics
+from .amfi import AMFINavMaster
+from .constants import DEBT, DEFAULT_MAX_WORKERS, EQUITY, LTCG_EXEMPTION
+from .mfhelper import get_scheme_details_bulk
+from .cache import CASDataCache, dump_compressed, load_compressed
+from .cube import ValuationCube
+from .gains import get_financial_year, get_realized_gains
+from .harvest import get_ltcg_harvesting_plan
+from .models import Scheme, Transaction
+from .columnar import analyze_ltcg_tax_harvesting_columnar, get_ltcg_eligibility_calendar
+from .ledger import PortfolioLedger
+from .query import SchemeIndex, TransactionIndex
+from .records import CompactScheme
+from .returns import get_returns_summary
+from .timeseries import DAILY, ValuationSeries, get_valuation_series
+from .utils import logger, memoize
+
+SNAPSHOT_VERSION = 1
+
+
+def read_cas_data(cas_file, cas_password, cas_cache: Optional[CASDataCache] = None) -> dict:
+    """Parse a CAS pdf with casparser, reusing earlier results for the same file contents
+
+    Args:
+        cas_file: path or binary file object of the CAS pdf
+        cas_password: CAS pdf password
+        cas_cache (Optional[CASDataCache]): cache of parsed statements, None disables caching
+
+    Returns:
+        dict: data from casparser.read_cas_pdf
+    """
+    if isinstance(cas_file, os.PathLike):
+        # casparser only takes a str or a file object
+        cas_file = os.fspath(cas_file)
+
+    if cas_cache is None:
+        with metrics.span("cas.parse"):
+            return casparser.read_cas_pdf(cas_file, cas_password)
+
+    if isinstance(cas_file, io.IOBase):
+        pdf_bytes = cas_file.read()
+    else:
+        with open(cas_file, "rb") as f:
+            pdf_bytes = f.read()
+
+    key = cas_cache.key(pdf_bytes, cas_password)
+    data = cas_cache.get(key)
+    if data is None:
+        metrics.increment("cas_cache.misses")
+        with metrics.span("cas.parse"):
+            data = casparser.read_cas_pdf(io.BytesIO(pdf_bytes), cas_password)
+        cas_cache.put(key, data)
+    else:
+        metrics.increment("cas_cache.hits")
+        logger.info("Using previously parsed CAS data")
+
+    return data
 
 
 class Portfolio:
-    def __init__(self, cas_file, cas_password) -> None:
+    def __init__(
+        self,
+        cas_file,
+        cas_password,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        offline: bool = False,
+        use_cas_cache: bool = False,
+        nav_master: Optional[AMFINavMaster] = None,
+        validate: bool = False,
+    ) -> None:
         logger.info("Parsing CAS File")
 
         try:
-            data = casparser.read_cas_pdf(cas_file, cas_password)
+            data = read_cas_data(cas_file, cas_password, CASDataCache() if use_cas_cache else None)
         except CASParseError as e:
             logger.error(e)
             logger.error("Aborting!")
             sys.exit()
 
+        self._load(
+            data,
+            max_workers=max_workers,
+            offline=offline,
+            nav_master=nav_master,
+            validate=validate,
+        )
+
+    def _load(
+        self,
+        data: dict,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        offline: bool = False,
+        scheme_details: Optional[Dict[str, Optional[dict]]] = None,
+        nav_master: Optional[AMFINavMaster] = None,
+        validate: bool = False,
+    ) -> None:
         self.investor_info = data["investor_info"]
+        self._max_workers = max_workers
+        self._offline = offline
+        self._nav_master = nav_master
+        self._validate = validate
+        self._scheme_details = scheme_details if scheme_details is not None else {}
+        self._memo = {}
+        self._metrics = metrics.get_metrics()
+        self._ledger: Optional[PortfolioLedger] = None
+        self._cube: Optional[ValuationCube] = None
+        # Positions of schemes changed since the cube was last updated
+        self._cube_stale: Set[int] = set()
+
+        # Schemes are built from their casparser dicts on first access
+        self._scheme_dicts = get_scheme_dicts(data)
+        self._schemes: List[Optional[Scheme]] = [None] * len(self._scheme_dicts)
+
+    @classmethod
+    def from_cas_data(
+        cls,
+        data: dict,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        offline: bool = False,
+        scheme_details: Optional[Dict[str, Optional[dict]]] = None,
+        nav_master: Optional[AMFINavMaster] = None,
+        validate: bool = False,
+    ) -> "Portfolio":
+        """Build a portfolio from data already parsed with casparser.read_cas_pdf
+
+        Args:
+            data (dict): data from casparser.read_cas_pdf
+            max_workers (int): number of concurrent scheme detail requests
+            offline (bool): resolve scheme details only from the on-disk cache
+            scheme_details (Optional[Dict[str, Optional[dict]]]): scheme details by AMFI code,
+                shared between portfolios so that every scheme is fetched only once
+            nav_master (Optional[AMFINavMaster]): AMFI NAV file to resolve schemes from, only
+                schemes missing from it are fetched from the API
+            validate (bool): validate every value with pydantic while building the schemes,
+                instead of trusting the types casparser produced
+
+        Returns:
+            Portfolio
+        """
+        portfolio = cls.__new__(cls)
+        portfolio._load(
+            data,
+            max_workers=max_workers,
+            offline=offline,
+            scheme_details=scheme_details,
+            nav_master=nav_master,
+            validate=validate,
+        )
+        return portfolio
+
+    @classmethod
+    def from_cas_pdf(
+        cls,
+        cas_file,
+        cas_password,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        offline: bool = False,
+        use_cas_cache: bool = False,
+        scheme_details: Optional[Dict[str, Optional[dict]]] = None,
+        nav_master: Optional[AMFINavMaster] = None,
+        validate: bool = False,
+        processes: Optional[int] = None,
+    ) -> "Portfolio":
+        """Parse a CAS pdf and load all its schemes, fetching scheme details during parsing
+
+        Unlike the constructor, which parses the whole pdf before any scheme is resolved, pages are
+        extracted in parallel and scheme details requested as soon as their pages are read, see
+        pipeline.load_cas_pdf. Every scheme is built by the time this returns.
+
+        Args:
+            cas_file: path or binary file object of the CAS pdf
+            cas_password: CAS pdf password
+            max_workers (int): number of concurrent scheme detail requests
+            offline (bool): resolve scheme details only from the on-disk cache
+            use_cas_cache (bool): reuse earlier parsing results for the same pdf and password,
+                stored unencrypted in the cache directory
+            scheme_details (Optional[Dict[str, Optional[dict]]]): scheme details by AMFI code,
+                shared between portfolios so that every scheme is fetched only once
+            nav_master (Optional[AMFINavMaster]): AMFI NAV file to resolve schemes from
+            validate (bool): validate every value with pydantic while building the schemes
+            processes (Optional[int]): number of processes extracting the text of long
+                statements, defaults to the CPU count
+
+        Returns:
+            Portfolio
+
+        Raises:
+            CASParseError if the pdf can't be parsed
+        """
+        from .pipeline import load_cas_pdf
+
+        if scheme_details is None:
+            scheme_details = {}
+        data, schemes = load_cas_pdf(
+            cas_file,
+            cas_password,
+            cas_cache=CASDataCache() if use_cas_cache else None,
+            max_workers=max_workers,
+            offline=offline,
+            scheme_details=scheme_details,
+            nav_master=nav_master,
+            validate=validate,
+            processes=processes,
+        )
+
+        portfolio = cls.__new__(cls)
+        portfolio._load(
+            {"investor_info": data["investor_info"], "folios": []},
+            max_workers=max_workers,
+            offline=offline,
+            scheme_details=scheme_details,
+            nav_master=nav_master,
+            validate=validate,
+        )
+        portfolio._schemes = schemes
+        portfolio._scheme_dicts = [None] * len(schemes)
+        return portfolio
+
+    @classmethod
+    def from_ledger(
+        cls,
+        ledger: PortfolioLedger,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        offline: bool = False,
+        scheme_details: Optional[Dict[str, Optional[dict]]] = None,
+        nav_master: Optional[AMFINavMaster] = None,
+        validate: bool = False,
+    ) -> "Portfolio":
+        """Build a portfolio from a ledger of merged statements, see merge_cas_data
+
+        Args:
+            ledger (PortfolioLedger): ledger the portfolio is built from and later merges into
+            max_workers (int): number of concurrent scheme detail requests
+            offline (bool): resolve scheme details only from the on-disk cache
+            scheme_details (Optional[Dict[str, Optional[dict]]]): scheme details by AMFI code
+            nav_master (Optional[AMFINavMaster]): AMFI NAV file to resolve schemes from
+            validate (bool): validate every value with pydantic while building the schemes
+
+        Returns:
+            Portfolio
+        """
+        portfolio = cls.__new__(cls)
+        portfolio._load(
+            {"investor_info": ledger.investor_info, "folios": []},
+            max_workers=max_workers,
+            offline=offline,
+            scheme_details=scheme_details,
+            nav_master=nav_master,
+            validate=validate,
+        )
+        portfolio._ledger = ledger
+        portfolio._scheme_dicts = [ledger.get_scheme_dict(index) for index in range(len(ledger))]
+        portfolio._schemes = [None] * len(ledger)
+        return portfolio
+
+    def merge_cas_data(self, data: dict) -> int:
+        """Merge a newer, possibly partial period statement into the portfolio's ledger
+
+        Only the schemes with new transactions (or new schemes) are rebuilt, on next access.
+
+        Args:
+            data (dict): data from casparser.read_cas_pdf
+
+        Returns:
+            int: number of schemes added or changed
+
+        Raises:
+            ValueError if the portfolio was not built with from_ledger
+        """
+        if self._ledger is None:
+            raise ValueError("Only portfolios built with Portfolio.from_ledger can be merged into")
+
+        changed = self._ledger.merge(data)
+        self.investor_info = self._ledger.investor_info
+        for index in changed:
+            if index == len(self._schemes):
+                self._schemes.append(None)
+                self._scheme_dicts.append(None)
+            self._schemes[index] = None
+            self._scheme_dicts[index] = self._ledger.get_scheme_dict(index)
+        self._cube_stale.update(changed)
+
+        if changed:
+            self.invalidate()
+        return len(changed)
+
+    @classmethod
+    def from_cache(cls, snapshot_path) -> "Portfolio":
+        """Load a portfolio written by save_snapshot, without parsing the CAS or calling the API
+
+        Args:
+            snapshot_path: path of the snapshot file
+
+        Returns:
+            Portfolio: portfolio with the schemes and NAVs as they were when saved
+        """
+        snapshot = load_compressed(snapshot_path)
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported portfolio snapshot version: {snapshot.get('version')}")
+
+        portfolio = cls.__new__(cls)
+        portfolio._load({"investor_info": snapshot["investor_info"], "folios": []})
+        portfolio._schemes = [Scheme(**scheme_dict) for scheme_dict in snapshot["schemes"]]
+        portfolio._scheme_dicts = [None] * len(portfolio._schemes)
+        return portfolio
+
+    def save_snapshot(self, snapshot_path) -> None:
+        """Save the fully loaded portfolio, including resolved NAVs, for Portfolio.from_cache"""
+        dump_compressed(
+            {
+                "version": SNAPSHOT_VERSION,
+                "investor_info": self.investor_info,
+                "schemes": [scheme.dict() for scheme in self.schemes],
+            },
+            snapshot_path,
+        )
+
+    @property
+    def schemes(self) -> List[Scheme]:
+        """All schemes in the portfolio, details of the ones not built yet are fetched in bulk"""
+        return [self.__export(entry) for entry in self.__get_entries()]
+
+    def iter_schemes(self) -> Iterator[Scheme]:
+        """Schemes one at a time, compact records are converted to models only as they are reached"""
+        for entry in self.__get_entries():
+            yield self.__export(entry)
+
+    def __get_entries(self) -> List[Union[Scheme, CompactScheme]]:
+        pending = [index for index, scheme in enumerate(self._schemes) if scheme is None]
+        if pending:
+            logger.info("Loading schemes in portfolio")
+            with metrics.span("portfolio.load_schemes"):
+                resolve_scheme_details(
+                    [self._scheme_dicts[index] for index in pending],
+                    max_workers=self._max_workers,
+                    offline=self._offline,
+                    scheme_details=self._scheme_details,
+                    nav_master=self._nav_master,
+                )
+                for index in pending:
+                    self.__build_scheme(index)
+
+        return self._schemes
+
+    @staticmethod
+    def __export(entry: Union[Scheme, CompactScheme]) -> Scheme:
+        return entry.to_scheme() if isinstance(entry, CompactScheme) else entry
 
-        logger.info("Loading schemes in portfolio")
-        self.schemes: List[Scheme] = initialize_and_get_schemes(data)
+    def compact(self) -> "Portfolio":
+        """Hold all schemes as compact records to reduce memory, for long lived portfolios
 
-    def ltcg_tax_harvesting_summary(self):
-        equity_schemes = get_filtered_schemes(equity_scheme_filter, self.schemes)
+        Scheme models are rebuilt from the records whenever they are accessed, summaries are
+        computed on the records directly.
+
+        Returns:
+            Portfolio: self
+        """
+        for index, entry in enumerate(self.__get_entries()):
+            if isinstance(entry, CompactScheme):
+                continue
+            try:
+                self._schemes[index] = CompactScheme.from_scheme(entry)
+            except ValueError as e:
+                logger.debug(f"Keeping {entry.name} as a model: {e}")
+
+        self.invalidate()
+        return self
+
+    def get_scheme(self, name_or_amfi: str) -> Optional[Scheme]:
+        """Scheme with the given name or AMFI code, fetching only its own details if needed"""
+        for index, scheme in enumerate(self._schemes):
+            if scheme is not None:
+                name, amfi = scheme.name, scheme.amfi
+            else:
+                name, amfi = self._scheme_dicts[index]["scheme"], self._scheme_dicts[index]["amfi"]
+
+            if name_or_amfi not in (name, amfi):
+                continue
+
+            if scheme is None:
+                resolve_scheme_details(
+                    [self._scheme_dicts[index]],
+                    offline=self._offline,
+                    scheme_details=self._scheme_details,
+                    nav_master=self._nav_master,
+                )
+                scheme = self.__build_scheme(index)
+            return self.__export(scheme)
+
+        return None
+
+    def __build_scheme(self, index: int) -> Scheme:
+        scheme_dict = self._scheme_dicts[index]
+        scheme = create_scheme_with_details(
+            scheme_dict, self._scheme_details.get(str(scheme_dict["amfi"])), self._validate
+        )
+        logger.debug(f"Done loading {scheme.name}")
+        self._schemes[index] = scheme
+        self._scheme_dicts[index] = None  # the model holds everything needed from here on
+        return scheme
+
+    def refresh_navs(self, scheme_details: Optional[Dict[str, Optional[dict]]] = None) -> None:
+        """Fetch the latest NAVs of all schemes and drop every memoized result
+
+        Offline portfolios reread them from the on-disk cache instead.
+
+        Args:
+            scheme_details (Optional[Dict[str, Optional[dict]]]): latest scheme details by AMFI
+                code, already fetched for many portfolios at once. Fetched here if not given.
+        """
+        entries = self.__get_entries()
+        if scheme_details is None:
+            scheme_details = get_scheme_details_bulk(
+                [entry.amfi for entry in entries if entry.amfi is not None],
+                max_workers=self._max_workers,
+                offline=self._offline,
+                refresh=True,
+            )
+        self._scheme_details.update(scheme_details)
+
+        for index, entry in enumerate(entries):
+            details = scheme_details.get(str(entry.amfi))
+            if details:
+                entry.nav = Decimal(details["nav"])
+                if isinstance(entry, Scheme):
+                    entry.valuation = entry.units * entry.nav
+                self._cube_stale.add(index)
+
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        """Drop memoized summaries, to be called after schemes are modified"""
+        self._memo.clear()
+
+    def valuation_cube(self) -> ValuationCube:
+        """Valuation, cost and scheme counts by type, subtype, AMC and folio
+
+        Built in one pass on first use and then kept, schemes whose NAVs were refreshed or that
+        were merged into are updated in it on the next call.
+        """
+        entries = self.__get_entries()
+        if self._cube is None:
+            with metrics.span("analysis.valuation_cube"):
+                self._cube = ValuationCube.from_schemes(entries)
+        else:
+            for index in sorted(self._cube_stale):
+                self._cube.update(index, entries[index])
+        self._cube_stale.clear()
+        return self._cube
+
+    def get_filtered_schemes(self, filter_to_apply: SchemeFilterType) -> List[Scheme]:
+        """Schemes the filter selects, answered from an index built once
+
+        Results of arbitrary filters aren't memoized, only those of the filters in scheme_filters
+        that the summaries use.
+        """
+        entries = self.__scheme_index().select(filter_to_apply)
+        return [self.__export(entry) for entry in entries]
+
+    @memoize(copy_result=False)
+    def __get_filtered_entries(self, filter_to_apply: SchemeFilterType):
+        # Scheme filters only look at scheme attributes, which compact records share
+        return self.__scheme_index().select(filter_to_apply)
+
+    @memoize(copy_result=False)
+    def __scheme_index(self) -> SchemeIndex:
+        return SchemeIndex(self.__get_entries())
+
+    def get_filtered_transactions(
+        self, filter_to_apply: TransactionFilterType
+    ) -> List[Transaction]:
+        """Transactions of all schemes that the filter selects, answered from indexes built once
+
+        Transactions of compact records are converted to models to build the index, which is kept
+        until the portfolio is invalidated.
+        """
+        return self.__transaction_index().select(filter_to_apply)
+
+    @memoize(copy_result=False)
+    def __transaction_index(self) -> TransactionIndex:
+        return TransactionIndex(
+            transaction
+            for scheme in self.iter_schemes()
+            for transaction in scheme.transactions or []
+        )
+
+    @property
+    def timings(self) -> dict:
+        """Per-phase span timings and counters, recorded only while metrics are enabled
+
+        Metrics are recorded into the collector enabled with metrics.enable, which is shared by
+        everything running while it is enabled, not only this portfolio.
+
+        Returns:
+            dict: {"spans": {name: {"calls", "total_ms", "mean_ms"}}, "counters": {name: value}}
+        """
+        collector = self._metrics or metrics.get_metrics()
+        if collector is None:
+            return {"spans": {}, "counters": {}}
+        return collector.as_dict()
+
+    def ltcg_tax_harvesting_summary(self, as_of: Optional[datetime.date] = None):
+        """LTCG harvesting opportunities of equity schemes if sold on as_of (default today)
+
+        Holding periods are counted up to as_of from the transaction dates, at the current NAVs,
+        so any date can be evaluated without rebuilding the portfolio.
+        """
+        return self.__ltcg_tax_harvesting_summary(as_of or datetime.date.today())
+
+    @memoize
+    @metrics.timed("analysis.ltcg_tax_harvesting")
+    def __ltcg_tax_harvesting_summary(self, as_of: datetime.date):
+        equity_schemes = self.__get_filtered_entries(equity_scheme_filter)
         tax_harvesting_opportunities = [
-            analyze_ltcg_tax_harvesting(scheme) for scheme in equity_schemes
+            (
+                analyze_ltcg_tax_harvesting_columnar(
+                    scheme, scheme.table, include_transactions=True, as_of=as_of
+                )
+                if isinstance(scheme, CompactScheme)
+                else analyze_ltcg_tax_harvesting(scheme, as_of)
+            )
+            for scheme in equity_schemes
         ]
         tax_harvesting_opportunities = list(
             filter(lambda x: x["ltcg"] != 0, tax_harvesting_opportunities)
@@ -47,22 +549,129 @@ class Portfolio:
             "schemes": tax_harvesting_opportunities,
         }
 
+    def ltcg_harvesting_plan(
+        self,
+        as_of: Optional[datetime.date] = None,
+        exemption: Decimal = LTCG_EXEMPTION,
+        realized_ltcg: Optional[Decimal] = None,
+    ) -> dict:
+        """Units to sell on as_of (default today) so that the year's LTCG stays within the exemption
+
+        Args:
+            as_of (Optional[datetime.date]): date of the sale, at the current NAVs
+            exemption (Decimal): LTCG exempt from tax in a financial year
+            realized_ltcg (Optional[Decimal]): equity LTCG already realized in the financial year
+                of as_of, taken from realized_gains_summary if not given
+
+        Returns:
+            dict: see harvest.get_ltcg_harvesting_plan
+        """
+        as_of = as_of or datetime.date.today()
+        if realized_ltcg is None:
+            financial_year = get_financial_year(as_of)
+            realized_ltcg = sum(
+                (
+                    scheme["ltcg"]
+                    for year in self.realized_gains_summary()["financial_years"]
+                    if year["financial_year"] == financial_year
+                    for scheme in year["schemes"]
+                    if scheme["type"] == EQUITY
+                ),
+                Decimal("0.0"),
+            )
+        return self.__ltcg_harvesting_plan(as_of, exemption, realized_ltcg)
+
+    @memoize
+    @metrics.timed("analysis.ltcg_harvesting_plan")
+    def __ltcg_harvesting_plan(
+        self, as_of: datetime.date, exemption: Decimal, realized_ltcg: Decimal
+    ) -> dict:
+        return get_ltcg_harvesting_plan(
+            self.__get_filtered_entries(equity_scheme_filter), exemption, realized_ltcg, as_of
+        )
+
+    def ltcg_eligibility_calendar(self, as_of: Optional[datetime.date] = None) -> dict:
+        """When the open lots of equity schemes become long term, see get_ltcg_eligibility_calendar"""
+        return self.__ltcg_eligibility_calendar(as_of or datetime.date.today())
+
+    @memoize
+    @metrics.timed("analysis.ltcg_eligibility_calendar")
+    def __ltcg_eligibility_calendar(self, as_of: datetime.date) -> dict:
+        return get_ltcg_eligibility_calendar(
+            self.__get_filtered_entries(equity_scheme_filter), as_of
+        )
+
+    @memoize
+    @metrics.timed("analysis.realized_gains")
+    def realized_gains_summary(self) -> dict:
+        """Realized STCG and LTCG of every financial year and scheme, see gains.get_realized_gains
+
+        NAV histories needed for grandfathering are read from the default NAV store, and fetched
+        into it unless the portfolio is offline.
+        """
+        return get_realized_gains(
+            self.iter_schemes(), offline=self._offline, max_workers=self._max_workers
+        )
+
+    def valuation_series(
+        self,
+        start: Optional[datetime.date] = None,
+        end: Optional[datetime.date] = None,
+        frequency: str = DAILY,
+    ) -> ValuationSeries:
+        """Value and invested amount of every scheme from start to end (default today)
+
+        Args:
+            start (Optional[datetime.date]): first date, the first transaction by default
+            end (Optional[datetime.date]): last date
+            frequency (str): "D", "W" or "M" for daily, weekly or monthly dates
+
+        Returns:
+            ValuationSeries: see timeseries.get_valuation_series
+        """
+        return self.__valuation_series(start, end or datetime.date.today(), frequency)
+
+    @memoize
+    @metrics.timed("analysis.valuation_series")
+    def __valuation_series(
+        self, start: Optional[datetime.date], end: datetime.date, frequency: str
+    ) -> ValuationSeries:
+        return get_valuation_series(
+            self.__get_entries(),
+            start,
+            end,
+            frequency,
+            offline=self._offline,
+            max_workers=self._max_workers,
+        )
+
+    @memoize
+    @metrics.timed("analysis.valuation_summary")
     def get_valuation_summary(self):
-        debt_schemes = get_filtered_schemes(debt_scheme_filter, self.schemes)
-        equity_schemes = get_filtered_schemes(equity_scheme_filter, self.schemes)
+        debt_schemes = self.__get_filtered_entries(debt_scheme_filter)
+        equity_schemes = self.__get_filtered_entries(equity_scheme_filter)
 
         debt_valuation = get_valuation_summary_for_schemes(debt_schemes)
         equity_valuation = get_valuation_summary_for_schemes(equity_schemes)
 
+        # Subtype break-ups are rolled up from the cube instead of regrouping the schemes
+        cube = self.valuation_cube()
+        debt_valuation["subtypes"] = cube.rollup("subtype", type=DEBT)
+        equity_valuation["subtypes"] = cube.rollup("subtype", type=EQUITY)
+
         return {
             "valuation": debt_valuation["valuation"] + equity_valuation["valuation"],
             "debt_valuation": debt_valuation,
             "equity_valuation": equity_valuation,
+            "returns": get_returns_summary(self.__get_entries()),
         }
 
+    @memoize
+    @metrics.timed("analysis.to_dict")
     def to_dict(self):
+        schemes = self.schemes
         return {
             "user_info": self.investor_info,
-            "schemes": [scheme.dict() for scheme in self.schemes],
-            "valuation": sum([scheme.valuation for scheme in self.schemes]),
+            "schemes": [scheme.dict() for scheme in schemes],
+            "valuation": sum([scheme.valuation for scheme in schemes]),
         }
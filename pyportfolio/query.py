@@ -0,0 +1,119 @@
+"""Indexed queries over schemes and transactions, answering filters without calling them per object
+
+Filters built by scheme_filters, transaction_filters and utils.and_filter/or_filter carry an
+"index" attribute describing what they select, e.g. ("type", "Equity Scheme") or
+("before", date ordinal). An index answers those from lookups built once, on first use:
+
+    - schemes by type and by (type, subtype)
+    - transactions by type
+    - transactions sorted by date, so "older than N days" as of any date is a bisect
+
+and_filter and or_filter run as intersections and unions of positions. Filters without an index,
+e.g. arbitrary lambdas, are called on every object as before; inside and_filter they are only
+called on the objects the indexed filters selected.
+"""
+
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable, Dict, Generic, List, Optional, Sequence, Set, TypeVar
+
+from . import metrics
+
+T = TypeVar("T")
+
+
+class QueryIndex(Generic[T]):
+    """Lookups over a fixed sequence of objects, extended by kind of filter in subclasses"""
+
+    def __init__(self, objects: Sequence[T]) -> None:
+        self.objects = list(objects)
+        self._lookups: Dict[str, object] = {}
+
+    def select(self, filter_to_apply: Callable[[T], bool]) -> List[T]:
+        """Objects the filter selects, in their original order"""
+        positions = self.positions(filter_to_apply)
+        if positions is None:
+            metrics.increment("query.scans")
+            return list(filter(filter_to_apply, self.objects))
+        metrics.increment("query.indexed")
+        return [self.objects[position] for position in sorted(positions)]
+
+    def positions(self, filter_to_apply: Callable[[T], bool]) -> Optional[Set[int]]:
+        """Positions of the objects the filter selects, None if no index can answer it"""
+        index = getattr(filter_to_apply, "index", None)
+        if index is None:
+            return None
+
+        kind, *args = index
+        if kind == "and":
+            return self.__intersect(args[0])
+        if kind == "or":
+            parts = [self.positions(f) for f in args[0]]
+            if any(part is None for part in parts):
+                return None
+            return set().union(*parts)
+        return self._lookup(kind, *args)
+
+    def __intersect(self, filters) -> Optional[Set[int]]:
+        parts = [(f, self.positions(f)) for f in filters]
+        indexed = sorted((part for _, part in parts if part is not None), key=len)
+        if not indexed:
+            return None
+
+        positions = indexed[0].intersection(*indexed[1:])
+        unindexed = [f for f, part in parts if part is None]
+        if unindexed:
+            positions = {
+                position
+                for position in positions
+                if all(f(self.objects[position]) for f in unindexed)
+            }
+        return positions
+
+    def _lookup(self, kind: str, *args) -> Optional[Set[int]]:
+        return None
+
+    def _group_by(self, kind: str, key: Callable[[T], object]) -> Dict[object, Set[int]]:
+        lookup = self._lookups.get(kind)
+        if lookup is None:
+            lookup = defaultdict(set)
+            for position, obj in enumerate(self.objects):
+                lookup[key(obj)].add(position)
+            self._lookups[kind] = lookup
+        return lookup
+
+
+class SchemeIndex(QueryIndex):
+    """Schemes (or compact scheme records) by type and subtype"""
+
+    def _lookup(self, kind: str, *args) -> Optional[Set[int]]:
+        if kind == "type":
+            return self._group_by(kind, lambda scheme: scheme.type).get(args[0], set())
+        if kind == "subtype":
+            by_subtype = self._group_by(kind, lambda scheme: (scheme.type, scheme.subtype))
+            return by_subtype.get(tuple(args), set())
+        return None
+
+
+class TransactionIndex(QueryIndex):
+    """Transactions (or lots) by type and by date"""
+
+    def _lookup(self, kind: str, *args) -> Optional[Set[int]]:
+        if kind == "type":
+            # Types are str enums, equal to and hashed like their values
+            return self._group_by(kind, lambda transaction: transaction.type).get(args[0], set())
+        if kind == "before":
+            ordinals, order = self.__by_date()
+            return set(order[: bisect_left(ordinals, args[0])])
+        return None
+
+    def __by_date(self):
+        """Date ordinals in ascending order along with the positions they belong to"""
+        lookup = self._lookups.get("before")
+        if lookup is None:
+            ordinals = [transaction.date.toordinal() for transaction in self.objects]
+            # Transactions are mostly chronological already, which sorted() handles in linear time
+            order = sorted(range(len(ordinals)), key=ordinals.__getitem__)
+            lookup = ([ordinals[position] for position in order], order)
+            self._lookups["before"] = lookup
+        return lookup
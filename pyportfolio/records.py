@@ -0,0 +1,203 @@
+"""Compact, array backed representation of schemes for keeping many portfolios in memory
+
+A Scheme model holds one pydantic Transaction per transaction, each with several Decimals and a
+datetime. CompactScheme keeps the same data as NumPy columns of integers instead: dates as ordinals,
+units, NAVs and balances as fixed-point integers and amounts in paise. Repeated descriptions (SIP
+instalments etc.) are interned. Models are rebuilt only when requested through to_scheme.
+"""
+
+import datetime
+import sys
+from decimal import Decimal
+from typing import List, Optional
+
+import numpy as np
+
+from .columnar import (
+    AMOUNT_DECIMALS,
+    NAV_DECIMALS,
+    TYPE_CODES,
+    UNITS_DECIMALS,
+    TransactionTable,
+    from_fixed,
+)
+from .models import Scheme, Transaction
+
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+
+# Stands in for None in integer columns
+NULL = np.iinfo(np.int64).min
+
+
+def _places(value: Decimal) -> int:
+    return max(0, -value.as_tuple().exponent)
+
+
+def _fixed_column(values: List[Optional[Decimal]], max_places: int):
+    """Column of exact fixed-point integers and the decimal places they are scaled by
+
+    Raises:
+        ValueError if a value needs more than max_places decimal places
+    """
+    places = max((_places(value) for value in values if value is not None), default=0)
+    if places > max_places:
+        raise ValueError(f"Value with {places} decimal places can't be stored exactly")
+
+    column = np.fromiter(
+        (NULL if value is None else int(value.scaleb(places)) for value in values),
+        dtype=np.int64,
+        count=len(values),
+    )
+    return column, places
+
+
+def _from_fixed_or_none(value, places: int) -> Optional[Decimal]:
+    return None if value == NULL else from_fixed(value, places)
+
+
+class CompactScheme:
+    """A Scheme whose transactions are stored as NumPy columns, convertible back without loss"""
+
+    __slots__ = (
+        "name",
+        "amfi",
+        "units",
+        "nav",
+        "type",
+        "subtype",
+        "folio",
+        "amc",
+        "dates",
+        "types",
+        "descriptions",
+        "transaction_units",
+        "navs",
+        "amounts",
+        "balances",
+        "dividend_rates",
+        "places",
+        "_table",
+    )
+
+    @classmethod
+    def from_scheme(cls, scheme: Scheme) -> "CompactScheme":
+        """Compact a Scheme model
+
+        Raises:
+            ValueError if a value can't be stored exactly in fixed-point
+        """
+        transactions = scheme.transactions or []
+        compact = cls()
+        compact.name = scheme.name
+        compact.amfi = scheme.amfi
+        compact.units = scheme.units
+        compact.nav = scheme.nav
+        compact.type = scheme.type
+        compact.subtype = scheme.subtype
+        compact.folio = scheme.folio
+        compact.amc = scheme.amc
+
+        compact.dates = np.fromiter(
+            (t.date.toordinal() for t in transactions), dtype=np.int32, count=len(transactions)
+        )
+        compact.types = np.fromiter(
+            (TYPE_CODES[t.type] for t in transactions), dtype=np.int8, count=len(transactions)
+        )
+        compact.descriptions = tuple(sys.intern(t.description) for t in transactions)
+
+        places = {}
+        compact.transaction_units, places["units"] = _fixed_column(
+            [t.units for t in transactions], UNITS_DECIMALS
+        )
+        compact.navs, places["nav"] = _fixed_column([t.nav for t in transactions], NAV_DECIMALS)
+        compact.amounts, places["amount"] = _fixed_column(
+            [t.amount for t in transactions], AMOUNT_DECIMALS
+        )
+        compact.balances, places["balance"] = _fixed_column(
+            [t.balance for t in transactions], UNITS_DECIMALS
+        )
+        compact.places = places
+
+        # Only dividends carry a rate
+        compact.dividend_rates = {
+            row: t.dividend_rate
+            for row, t in enumerate(transactions)
+            if t.dividend_rate is not None
+        }
+        compact._table = None
+        return compact
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    @property
+    def valuation(self) -> Decimal:
+        return self.units * self.nav
+
+    @property
+    def table(self) -> TransactionTable:
+        """Date sorted columnar table of the transactions, for the vectorized analytics"""
+        if self._table is None:
+
+            def rescale(column, places, decimals):
+                return np.where(column == NULL, 0, column) * 10 ** (decimals - places)
+
+            self._table = TransactionTable.from_columns(
+                ordinals=self.dates.astype(np.int64),
+                types=self.types,
+                units=rescale(self.transaction_units, self.places["units"], UNITS_DECIMALS),
+                navs=rescale(self.navs, self.places["nav"], NAV_DECIMALS),
+                amounts=rescale(self.amounts, self.places["amount"], AMOUNT_DECIMALS),
+            )
+        return self._table
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the transaction columns"""
+        arrays = (
+            self.dates,
+            self.types,
+            self.transaction_units,
+            self.navs,
+            self.amounts,
+            self.balances,
+        )
+        return sum(array.nbytes for array in arrays) + sys.getsizeof(self.descriptions)
+
+    @property
+    def transactions(self) -> List[Transaction]:
+        """Rebuild the Transaction models, without validating values that were already valid"""
+        today = datetime.date.today()
+        places = self.places
+        transactions = []
+        for row in range(len(self)):
+            date = datetime.date.fromordinal(int(self.dates[row]))
+            transactions.append(
+                Transaction.construct(
+                    date=datetime.datetime(date.year, date.month, date.day),
+                    description=self.descriptions[row],
+                    amount=from_fixed(self.amounts[row], places["amount"]),
+                    units=_from_fixed_or_none(self.transaction_units[row], places["units"]),
+                    nav=_from_fixed_or_none(self.navs[row], places["nav"]),
+                    balance=_from_fixed_or_none(self.balances[row], places["balance"]),
+                    type=TYPE_NAMES[int(self.types[row])],
+                    dividend_rate=self.dividend_rates.get(row),
+                    days=(today - date).days,
+                )
+            )
+        return transactions
+
+    def to_scheme(self) -> Scheme:
+        """Export to the Scheme model"""
+        return Scheme.construct(
+            name=self.name,
+            amfi=self.amfi,
+            units=self.units,
+            nav=self.nav,
+            type=self.type,
+            subtype=self.subtype,
+            folio=self.folio,
+            amc=self.amc,
+            valuation=self.valuation,
+            transactions=self.transactions,
+        )
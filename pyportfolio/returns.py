@@ -0,0 +1,296 @@
+"""XIRR and CAGR of schemes and of groups of schemes, solved for all of them at once
+
+Every transaction becomes a cash flow from the investor's point of view: purchases, switch-ins and
+taxes are outflows, redemptions, switch-outs and dividend payouts are inflows. Reinvested dividends
+move no cash. The current value of the held units is a final inflow on the valuation date.
+
+XIRR is the rate r at which the value of all flows on the valuation date is zero:
+
+    f(r) = sum(amount * (1 + r) ** years_before_valuation) = 0
+
+Flows of all schemes (or groups) are kept in flat arrays tagged with their group, so every Newton
+step is a few NumPy operations over all groups together. Groups Newton doesn't converge for are
+solved by bisection.
+"""
+
+import datetime
+from decimal import Decimal
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+from casparser.enums import TransactionType
+
+from .columnar import AMOUNT_DECIMALS, TYPE_CODES, TransactionTable, from_fixed, to_datetime64
+from .lots import ACQUISITION_TYPES, DISPOSAL_TYPES
+from .models import Scheme
+
+DAYS_PER_YEAR = 365.0
+MAX_NEWTON_ITERATIONS = 50
+MAX_BISECTION_ITERATIONS = 200
+TOLERANCE = 1e-9
+# Bounds of the bisection bracket, -99.99% and the upper bound is raised until it brackets a root
+MIN_RATE, MAX_RATE = -0.9999, 1e6
+
+UNCLASSIFIED = "Unclassified"
+
+
+def _flow_signs() -> np.ndarray:
+    """Sign of the cash flow of every transaction type code, applied to abs(amount)"""
+    signs = np.zeros(len(TYPE_CODES), dtype=np.float64)
+    for type_ in ACQUISITION_TYPES - {TransactionType.DIVIDEND_REINVEST.value}:
+        signs[TYPE_CODES[type_]] = -1
+    for type_ in DISPOSAL_TYPES | {TransactionType.DIVIDEND_PAYOUT.value}:
+        signs[TYPE_CODES[type_]] = 1
+    for type_ in (TransactionType.STT_TAX, TransactionType.STAMP_DUTY_TAX):
+        signs[TYPE_CODES[type_.value]] = -1
+    return signs
+
+
+FLOW_SIGNS = _flow_signs()
+REVERSAL_CODE = TYPE_CODES[TransactionType.REVERSAL.value]
+
+
+class CashFlows(NamedTuple):
+    """Cash flows of many schemes as flat arrays
+
+    Attributes:
+        owners: int64 index of the scheme every flow belongs to
+        years: float64 years from the flow to the valuation date
+        amounts: float64 amounts in rupees, negative for outflows
+    """
+
+    owners: np.ndarray
+    years: np.ndarray
+    amounts: np.ndarray
+
+
+def _get_table(scheme) -> TransactionTable:
+    # Compact records carry their own table, models are converted
+    table = getattr(scheme, "table", None)
+    if table is None:
+        table = TransactionTable.from_transactions(scheme.transactions or [])
+    return table
+
+
+def get_cash_flows(schemes: List[Scheme], as_of: Optional[datetime.date] = None) -> CashFlows:
+    """Cash flows of every scheme up to as_of (default today), ending with the current value
+
+    Args:
+        schemes (List[Scheme]): schemes or compact scheme records
+        as_of (Optional[datetime.date]): valuation date
+
+    Returns:
+        CashFlows
+    """
+    as_of = to_datetime64(as_of or datetime.date.today())
+    owners, years, amounts = [], [], []
+    for index, scheme in enumerate(schemes):
+        table = _get_table(scheme)
+        mask = table.dates <= as_of
+        signs = np.where(table.types == REVERSAL_CODE, 0, FLOW_SIGNS[table.types])
+        flows = signs * np.abs(table.amounts)
+        # A reversal undoes the flow of what it reverses, its amount carries the sign of that
+        flows = np.where(table.types == REVERSAL_CODE, -table.amounts, flows)
+        mask &= flows != 0
+
+        scheme_amounts = flows[mask].astype(np.float64) / 10**AMOUNT_DECIMALS
+        scheme_years = (as_of - table.dates[mask]).astype(np.float64) / DAYS_PER_YEAR
+        value = float(scheme.units * scheme.nav) if scheme.nav is not None else 0.0
+
+        amounts.append(np.append(scheme_amounts, value))
+        years.append(np.append(scheme_years, 0.0))
+        owners.append(np.full(len(scheme_amounts) + 1, index, dtype=np.int64))
+
+    if not owners:
+        return CashFlows(np.empty(0, np.int64), np.empty(0), np.empty(0))
+    return CashFlows(np.concatenate(owners), np.concatenate(years), np.concatenate(amounts))
+
+
+def _future_value(amounts, years, groups, rates, n_groups):
+    """f(r) and f'(r) of every group"""
+    base = 1.0 + rates[groups]
+    growth = np.exp(years * np.log(base))
+    value = np.bincount(groups, weights=amounts * growth, minlength=n_groups)
+    slope = np.bincount(groups, weights=amounts * years * growth / base, minlength=n_groups)
+    return value, slope
+
+
+def xirr(cash_flows: CashFlows, groups: Optional[np.ndarray] = None) -> np.ndarray:
+    """XIRR of every group of cash flows, solved together
+
+    Args:
+        cash_flows (CashFlows): flows from get_cash_flows
+        groups (Optional[np.ndarray]): group of every owner of the flows, e.g. the index of a
+            scheme's type. Each owner is its own group by default.
+
+    Returns:
+        np.ndarray: annualized rate of every group, NaN for groups without both inflows and
+            outflows or without a solution
+    """
+    flow_groups = cash_flows.owners if groups is None else np.asarray(groups)[cash_flows.owners]
+    n_groups = (int(flow_groups.max()) + 1) if len(flow_groups) else 0
+    amounts, years = cash_flows.amounts, cash_flows.years
+
+    has_inflow = np.bincount(flow_groups, weights=amounts > 0, minlength=n_groups) > 0
+    has_outflow = np.bincount(flow_groups, weights=amounts < 0, minlength=n_groups) > 0
+    solvable = has_inflow & has_outflow
+    scale = np.bincount(flow_groups, weights=np.abs(amounts), minlength=n_groups)
+    scale[scale == 0] = 1.0
+
+    rates = np.full(n_groups, 0.1)
+    converged = ~solvable
+    with np.errstate(all="ignore"):
+        for _ in range(MAX_NEWTON_ITERATIONS):
+            value, slope = _future_value(amounts, years, flow_groups, rates, n_groups)
+            step = np.where(converged, 0.0, value / slope)
+            rates = rates - step
+            # Steps past -100% can't be recovered from, bisection takes over
+            diverged = ~np.isfinite(rates) | (rates <= -1)
+            rates[diverged] = 0.1
+            converged |= (np.abs(step) < TOLERANCE) & (np.abs(value) / scale < TOLERANCE)
+            converged &= ~diverged | ~solvable
+            if converged.all():
+                break
+
+        unsolved = np.flatnonzero(solvable & ~converged)
+        if len(unsolved):
+            rates[unsolved] = _bisect(amounts, years, flow_groups, unsolved)
+
+    rates[~solvable] = np.nan
+    return rates
+
+
+def _bisect(amounts, years, flow_groups, unsolved) -> np.ndarray:
+    """Rates of the unsolved groups by bisection, NaN where no root is bracketed"""
+    in_unsolved = np.isin(flow_groups, unsolved)
+    amounts, years = amounts[in_unsolved], years[in_unsolved]
+    # Renumber the unsolved groups 0..n-1
+    subset_groups = np.searchsorted(unsolved, flow_groups[in_unsolved])
+    n = len(unsolved)
+
+    def value_at(rates):
+        return _future_value(amounts, years, subset_groups, rates, n)[0]
+
+    low, high = np.full(n, MIN_RATE), np.full(n, 1.0)
+    value_low, value_high = value_at(low), value_at(high)
+    while True:
+        unbracketed = (np.sign(value_low) == np.sign(value_high)) & (high < MAX_RATE)
+        if not unbracketed.any():
+            break
+        high[unbracketed] *= 10
+        value_high = value_at(high)
+
+    bracketed = np.sign(value_low) != np.sign(value_high)
+    for _ in range(MAX_BISECTION_ITERATIONS):
+        middle = (low + high) / 2
+        value_middle = value_at(middle)
+        same_as_low = np.sign(value_middle) == np.sign(value_low)
+        low = np.where(same_as_low, middle, low)
+        value_low = np.where(same_as_low, value_middle, value_low)
+        high = np.where(same_as_low, high, middle)
+        if np.all(high - low < TOLERANCE):
+            break
+
+    return np.where(bracketed, (low + high) / 2, np.nan)
+
+
+def cagr(start_value, end_value, years) -> np.ndarray:
+    """Compound annual growth rate from start_value to end_value over years, elementwise"""
+    start_value, end_value, years = (
+        np.asarray(x, dtype=np.float64) for x in (start_value, end_value, years)
+    )
+    with np.errstate(all="ignore"):
+        rates = (end_value / start_value) ** (1 / years) - 1
+    return np.where((start_value > 0) & (years > 0), rates, np.nan)
+
+
+def _rate_or_none(rate) -> Optional[float]:
+    return None if np.isnan(rate) else float(rate)
+
+
+def get_returns_summary(schemes: List[Scheme], as_of: Optional[datetime.date] = None) -> dict:
+    """XIRR and CAGR of the whole portfolio, of every scheme type and of every subtype
+
+    CAGR grows the total amount invested into the current value plus everything withdrawn, over the
+    time since the first investment. It understates returns of money invested over time, like SIPs,
+    for which XIRR is the better measure.
+
+    Args:
+        schemes (List[Scheme]): schemes or compact scheme records
+        as_of (Optional[datetime.date]): valuation date, defaults to today
+
+    Returns:
+        dict: "invested", "withdrawn", "valuation", "xirr" and "cagr" of the portfolio, with the same
+            for every type under "types", and for every subtype under each type's "subtypes"
+    """
+    if not schemes:
+        return {**_group_summary(Decimal(0), Decimal(0), Decimal(0), np.nan, np.nan), "types": {}}
+
+    cash_flows = get_cash_flows(schemes, as_of)
+    flows, owners = cash_flows.amounts, cash_flows.owners
+    # The current value closes the flows of every scheme
+    is_value = np.append(owners[1:] != owners[:-1], True)
+    first_flow_years = np.zeros(len(schemes))
+    np.maximum.at(first_flow_years, owners, cash_flows.years)
+
+    # Group keys of every scheme at each level, the portfolio is a single group
+    levels = {
+        "portfolio": [None] * len(schemes),
+        "types": [scheme.type or UNCLASSIFIED for scheme in schemes],
+        "subtypes": [
+            (scheme.type or UNCLASSIFIED, scheme.subtype or UNCLASSIFIED) for scheme in schemes
+        ],
+    }
+    summaries: Dict[str, Dict] = {}
+    for level, scheme_keys in levels.items():
+        keys = list(dict.fromkeys(scheme_keys))
+        index = {key: position for position, key in enumerate(keys)}
+        scheme_groups = np.array([index[key] for key in scheme_keys], dtype=np.int64)
+        flow_groups = scheme_groups[owners]
+        n = len(keys)
+
+        outflows = np.bincount(flow_groups, weights=np.where(flows < 0, -flows, 0), minlength=n)
+        inflows = np.bincount(
+            flow_groups, weights=np.where((flows > 0) & ~is_value, flows, 0), minlength=n
+        )
+        valuations = [Decimal(0)] * n
+        for scheme, group in zip(schemes, scheme_groups):
+            if scheme.nav is not None:
+                valuations[group] += scheme.units * scheme.nav
+        years = np.zeros(n)
+        np.maximum.at(years, scheme_groups, first_flow_years)
+
+        growth = cagr(outflows, inflows + np.array([float(v) for v in valuations]), years)
+        rates = xirr(cash_flows, scheme_groups)
+        summaries[level] = {
+            key: _group_summary(
+                _to_decimal(outflows[group]),
+                _to_decimal(inflows[group]),
+                valuations[group],
+                rates[group],
+                growth[group],
+            )
+            for group, key in enumerate(keys)
+        }
+
+    summary = summaries["portfolio"][None]
+    summary["types"] = summaries["types"]
+    for type_summary in summary["types"].values():
+        type_summary["subtypes"] = {}
+    for (type_, subtype), subtype_summary in summaries["subtypes"].items():
+        summary["types"][type_]["subtypes"][subtype] = subtype_summary
+    return summary
+
+
+def _to_decimal(amount: float) -> Decimal:
+    return from_fixed(round(amount * 10**AMOUNT_DECIMALS), AMOUNT_DECIMALS)
+
+
+def _group_summary(invested, withdrawn, valuation, rate, growth) -> dict:
+    return {
+        "invested": invested,
+        "withdrawn": withdrawn,
+        "valuation": valuation,
+        "xirr": _rate_or_none(rate),
+        "cagr": _rate_or_none(growth),
+    }
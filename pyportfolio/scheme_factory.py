@@ -1,13 +1,16 @@
 import datetime
-from copy import deepcopy
 from decimal import Decimal
-from typing import List
+from enum import Enum
+from typing import Dict, List, Optional
 from pydantic.error_wrappers import ValidationError
 from casparser.types import CASParserDataType, SchemeType as CASParserSchemeType
 
-from .models import Scheme
+from . import metrics
+from .amfi import AMFINavMaster
+from .models import Scheme, Transaction
 from .constants import EQUITY
-from .mfhelper import get_scheme_details
+from .constants import DEFAULT_MAX_WORKERS
+from .mfhelper import get_scheme_details, get_scheme_details_bulk
 from .utils import logger
 
 
@@ -23,9 +26,44 @@ def create_scheme_from_casparser(scheme_dict: CASParserSchemeType) -> Scheme:
     Raises:
         ValidationError is dict parsing into Scheme model fails
     """
-    scheme_dict = __update_scheme_details(scheme_dict)
+    scheme_details = get_scheme_details(scheme_dict["amfi"])
+    return create_scheme_with_details(scheme_dict, scheme_details)
+
+
+def create_scheme_with_details(
+    scheme_dict: CASParserSchemeType, scheme_details: Optional[dict], validate: bool = False
+) -> Scheme:
+    """Create an object of Scheme model from casparser data and already fetched scheme details
+
+    casparser has already parsed and typed every value, so by default the models are constructed
+    directly from them, without copying the casparser dicts or validating the values again. The
+    models are identical either way.
+
+    Args:
+        scheme_dict (CASParserSchemeType): scheme dict from casparser
+        scheme_details (Optional[dict]): scheme info from mfhelper.get_scheme_details
+        validate (bool): validate every value with pydantic, for data not from casparser
+
+    Returns:
+        Scheme: instance of Scheme model
+
+    Raises:
+        ValidationError is dict parsing into Scheme model fails
+    """
+    metrics.increment("schemes.built")
+    metrics.increment("transactions.processed", len(scheme_dict["transactions"]))
+
+    # Schemes without an AMFI code or NAV don't conform to the model, validation reports them
+    if not validate and scheme_dict["amfi"] is not None and scheme_details:
+        with metrics.span("schemes.construct"):
+            return __construct_scheme(scheme_dict, scheme_details)
+
+    with metrics.span("schemes.copy"):
+        scheme_dict = __update_scheme_details(scheme_dict, scheme_details)
+
     try:
-        scheme_model = Scheme(**scheme_dict)
+        with metrics.span("schemes.validate"):
+            scheme_model = Scheme(**scheme_dict)
         return scheme_model
     except ValidationError:
         print(
@@ -34,31 +72,78 @@ def create_scheme_from_casparser(scheme_dict: CASParserSchemeType) -> Scheme:
         raise
 
 
-def __update_scheme_details(scheme_dict: CASParserSchemeType):
+def __get_scheme_category(scheme_details: Optional[dict]):
+    """Type, subtype and NAV of the scheme, all None without scheme details"""
+    if not scheme_details:
+        return None, None, None
+
+    scheme_type, scheme_subtype = scheme_details.get("scheme_category").split(" - ")
+    if scheme_type == "Other Scheme":
+        scheme_type = EQUITY
+    return scheme_type, scheme_subtype, Decimal(scheme_details.get("nav"))
+
+
+def __to_str(value) -> str:
+    # As pydantic validates str fields, enums become their values
+    return value.value if isinstance(value, Enum) else value
+
+
+def __construct_scheme(scheme_dict: CASParserSchemeType, scheme_details: dict) -> Scheme:
+    """Scheme model built straight from casparser's typed values, as validation would build it"""
+    today = datetime.date.today()
+    transactions = []
+    for transaction in scheme_dict["transactions"]:
+        t_date = transaction["date"]
+        transactions.append(
+            Transaction.construct(
+                date=datetime.datetime(t_date.year, t_date.month, t_date.day),
+                description=transaction["description"],
+                amount=transaction["amount"],
+                units=transaction["units"],
+                nav=transaction["nav"],
+                balance=transaction.get("balance"),
+                type=__to_str(transaction["type"]),
+                dividend_rate=transaction["dividend_rate"],
+                days=(today - t_date).days,
+            )
+        )
+
+    scheme_type, scheme_subtype, nav = __get_scheme_category(scheme_details)
+    units = scheme_dict["close_calculated"]
+    return Scheme.construct(
+        name=scheme_dict["scheme"],
+        amfi=str(scheme_dict["amfi"]),
+        units=units,
+        nav=nav,
+        type=scheme_type,
+        subtype=scheme_subtype,
+        folio=scheme_dict.get("folio"),
+        amc=scheme_dict.get("amc"),
+        valuation=units * nav,
+        transactions=transactions,
+    )
+
+
+def __update_scheme_details(scheme_dict: CASParserSchemeType, scheme_details: Optional[dict]):
     """Update scheme dict from casparser with additional metadata
 
     Args:
         scheme_dict (CASParserSchemeType): scheme dict from casparser
+        scheme_details (Optional[dict]): scheme info from mfhelper.get_scheme_details
 
     Returns:
         dict: copy of input dict with updated keys and values to conform to Scheme model
     """
-    scheme_dict = deepcopy(scheme_dict)
+    # Only the dicts are modified, the values in them are immutable
+    scheme_dict = dict(scheme_dict)
+    scheme_dict["transactions"] = [dict(transaction) for transaction in scheme_dict["transactions"]]
     __update_transaction_details(scheme_dict)
 
     scheme_dict["units"] = scheme_dict["close_calculated"]
     scheme_dict["name"] = scheme_dict["scheme"]
     scheme_dict.pop("valuation")
 
-    scheme_type, scheme_subtype, nav = None, None, None
-
-    scheme_details = get_scheme_details(scheme_dict["amfi"])
-    if scheme_details:
-        nav = Decimal(scheme_details.get("nav"))
-        scheme_type, scheme_subtype = scheme_details.get("scheme_category").split(" - ")
-        if scheme_type == "Other Scheme":
-            scheme_type = EQUITY
-
+    scheme_type, scheme_subtype, nav = __get_scheme_category(scheme_details)
     scheme_dict["type"] = scheme_type
     scheme_dict["subtype"] = scheme_subtype
     scheme_dict["nav"] = nav
@@ -80,20 +165,105 @@ def __update_transaction_details(scheme_dict: CASParserSchemeType):
         transaction["date"] = datetime.datetime(t_date.year, t_date.month, t_date.day)
 
 
-def initialize_and_get_schemes(data_dict: CASParserDataType) -> List[Scheme]:
+def add_folio_details(scheme_dict: CASParserSchemeType, folio_dict: dict) -> CASParserSchemeType:
+    """Shallow copy of the scheme dict with the folio number and AMC of the folio it is held in"""
+    return {**scheme_dict, "folio": folio_dict["folio"], "amc": folio_dict.get("amc")}
+
+
+def get_scheme_dicts(data_dict: CASParserDataType) -> List[CASParserSchemeType]:
+    """All scheme dicts across the folios in data from casparser.read_cas_pdf, with their folio"""
+    return [
+        add_folio_details(scheme_dict, folio)
+        for folio in data_dict["folios"]
+        for scheme_dict in folio["schemes"]
+    ]
+
+
+def resolve_scheme_details(
+    scheme_dicts: List[CASParserSchemeType],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    offline: bool = False,
+    scheme_details: Optional[Dict[str, Optional[dict]]] = None,
+    nav_master: Optional[AMFINavMaster] = None,
+) -> Dict[str, Optional[dict]]:
+    """Fetch scheme details for all unique AMFI codes of the schemes concurrently
+
+    Args:
+        scheme_dicts (List[CASParserSchemeType]): scheme dicts from casparser
+        max_workers (int): number of concurrent scheme detail requests
+        offline (bool): resolve scheme details only from the on-disk cache
+        scheme_details (Optional[Dict[str, Optional[dict]]]): scheme details by AMFI code, shared
+            between calls. Codes missing from it are fetched and added to it.
+        nav_master (Optional[AMFINavMaster]): AMFI NAV file to look schemes up in first, only
+            schemes missing from it are fetched from the API
+
+    Returns:
+        Dict[str, Optional[dict]]: scheme details by AMFI code
+    """
+    if scheme_details is None:
+        scheme_details = {}
+
+    missing_scheme_dicts = [
+        scheme_dict
+        for scheme_dict in scheme_dicts
+        if scheme_dict["amfi"] is not None and str(scheme_dict["amfi"]) not in scheme_details
+    ]
+
+    if nav_master is not None:
+        unresolved = []
+        for scheme_dict in missing_scheme_dicts:
+            details = nav_master.get(scheme_dict["amfi"], scheme_dict.get("isin"))
+            if details is None:
+                unresolved.append(scheme_dict)
+            else:
+                scheme_details[str(scheme_dict["amfi"])] = details
+        metrics.increment("amfi.hits", len(missing_scheme_dicts) - len(unresolved))
+        missing_scheme_dicts = unresolved
+
+    missing_amfi_codes = [scheme_dict["amfi"] for scheme_dict in missing_scheme_dicts]
+    with metrics.span("schemes.resolve"):
+        scheme_details.update(
+            get_scheme_details_bulk(missing_amfi_codes, max_workers=max_workers, offline=offline)
+        )
+
+    return scheme_details
+
+
+def initialize_and_get_schemes(
+    data_dict: CASParserDataType,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    offline: bool = False,
+    scheme_details: Optional[Dict[str, Optional[dict]]] = None,
+    nav_master: Optional[AMFINavMaster] = None,
+    validate: bool = False,
+) -> List[Scheme]:
     """Process schemes in dict provided by casparser into instances of Scheme model
 
+    Scheme details for all unique AMFI codes are fetched concurrently before any model is built.
+
     Args:
         data_dict (CASParserDataType): data from casparser.read_cas_pdf
+        max_workers (int): number of concurrent scheme detail requests
+        offline (bool): resolve scheme details only from the on-disk cache
+        scheme_details (Optional[Dict[str, Optional[dict]]]): scheme details by AMFI code, shared
+            between calls. Codes missing from it are fetched and added to it.
+        nav_master (Optional[AMFINavMaster]): AMFI NAV file to look schemes up in first
+        validate (bool): validate every value with pydantic instead of trusting casparser's types
 
     Returns:
         List[Scheme]: List of instances of Scheme model corresponding to all schemes in provided data
     """
+    scheme_dicts = get_scheme_dicts(data_dict)
+    scheme_details = resolve_scheme_details(
+        scheme_dicts, max_workers, offline, scheme_details, nav_master
+    )
+
     schemes: List[Scheme] = []
-    for folio in data_dict["folios"]:
-        for scheme_dict in folio["schemes"]:
-            scheme = create_scheme_from_casparser(scheme_dict)
-            schemes.append(scheme)
-            logger.debug(f"Done loading {scheme.name}")
+    for scheme_dict in scheme_dicts:
+        scheme = create_scheme_with_details(
+            scheme_dict, scheme_details.get(str(scheme_dict["amfi"])), validate
+        )
+        schemes.append(scheme)
+        logger.debug(f"Done loading {scheme.name}")
 
     return schemes
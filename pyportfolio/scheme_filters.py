@@ -2,6 +2,7 @@ from typing import Callable
 
 from .constants import DEBT, EQUITY
 from .models import Scheme
+from .utils import indexed
 
 
 SchemeFilterType = Callable[[Scheme], bool]
@@ -11,7 +12,14 @@ def get_scheme_type_filter(scheme_type: str) -> SchemeFilterType:
     def scheme_type_filter(scheme: Scheme):
         return scheme.type == scheme_type
 
-    return scheme_type_filter
+    return indexed(scheme_type_filter, "type", scheme_type)
+
+
+def get_scheme_subtype_filter(scheme_type: str, scheme_subtype: str) -> SchemeFilterType:
+    def scheme_subtype_filter(scheme: Scheme):
+        return scheme.type == scheme_type and scheme.subtype == scheme_subtype
+
+    return indexed(scheme_subtype_filter, "subtype", scheme_type, scheme_subtype)
 
 
 # Filters
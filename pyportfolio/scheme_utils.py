@@ -1,9 +1,12 @@
+import datetime
 from decimal import Decimal
-from typing import List
+from itertools import takewhile
+from typing import List, Optional
 
+from . import metrics
 from .constants import ELSS, EQUITY
-from .models import Scheme
-from .transaction_utils import get_purchase_transactions_for_active_units, get_filtered_transactions
+from .models import Scheme, Transaction
+from .lots import LotLedger
 from .transaction_filters import get_transaction_older_than_filter
 from .scheme_filters import SchemeFilterType
 from .utils import logger
@@ -14,35 +17,51 @@ def get_filtered_schemes(filter_to_apply: SchemeFilterType, schemes: List[Scheme
     return list(filter(filter_to_apply, schemes))
 
 
-def analyze_ltcg_tax_harvesting(scheme: Scheme):
+def get_ltcg_holding_days(scheme: Scheme) -> Optional[int]:
+    """Days units of an equity scheme must be held to qualify as long term, None for others"""
+    if scheme.type == EQUITY:
+        if scheme.subtype == ELSS:
+            return 365 * 3
+        return 365
+    return None
+
+
+def get_transactions_until(transactions: List[Transaction], as_of: Optional[datetime.date]):
+    """Transactions made on or before as_of, all of them if as_of is None"""
+    if as_of is None:
+        return transactions
+    as_of = as_of.toordinal()
+    return [transaction for transaction in transactions if transaction.date.toordinal() <= as_of]
+
+
+def analyze_ltcg_tax_harvesting(scheme: Scheme, as_of: Optional[datetime.date] = None):
     """Analyze Long Term Capital Gains opportunities
 
     Args:
         scheme (Scheme):
+        as_of (Optional[datetime.date]): date of the sale, today by default. Holding periods are
+            counted up to it, at the scheme's current NAV.
 
     Returns:
         dict: ltgc stats for given scheme
     """
     logger.debug(f"LTCG Tax Harvesting for Scheme: {scheme.name}")
 
-    if scheme.type == EQUITY:
-        if scheme.subtype == ELSS:
-            num_days = 365 * 3
-        else:
-            num_days = 365
-    else:
+    num_days = get_ltcg_holding_days(scheme)
+    if num_days is None:
         logger.debug("Non-Equity Scheme - Skipping")
         return {}
 
-    eligible_transactions_filter = get_transaction_older_than_filter(num_days)
+    transactions = get_transactions_until(scheme.transactions, as_of)
+    metrics.increment("transactions.analyzed", len(transactions))
 
-    # Get transactions for active units
-    active_purchase_transactions = get_purchase_transactions_for_active_units(scheme.transactions)
+    eligible_transactions_filter = get_transaction_older_than_filter(num_days, as_of)
 
-    # Get eligible purchase transactions
-    eligible_purchase_transactions = get_filtered_transactions(
-        eligible_transactions_filter, active_purchase_transactions
-    )
+    # Get lots of active units
+    ledger = LotLedger(transactions)
+
+    # Get eligible purchase lots, open lots are in date order so they are the oldest ones
+    eligible_purchase_transactions = list(takewhile(eligible_transactions_filter, ledger))
 
     total_eligible_units = sum(
         [transaction.units for transaction in eligible_purchase_transactions]
@@ -54,6 +73,10 @@ def analyze_ltcg_tax_harvesting(scheme: Scheme):
         transaction.dict() for transaction in eligible_purchase_transactions
     ]
 
+    as_of = as_of or datetime.date.today()
+    for transaction in eligible_purchase_transactions:
+        transaction["days"] = (as_of - transaction["date"].date()).days
+
     if total_eligible_units > 0:
         for transaction in eligible_purchase_transactions:
             profit_loss = (scheme.nav - transaction["nav"]) * transaction["units"]
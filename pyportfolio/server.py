@@ -0,0 +1,464 @@
+"""Local HTTP/JSON service that keeps parsed portfolios and scheme details warm between requests
+
+    GET    /health                          status and number of loaded portfolios
+    GET    /portfolios                      ids of the loaded portfolios
+    POST   /portfolios[?id=<id>]            load a CAS pdf sent as the request body, with its
+                                            password in the X-CAS-Password header
+    GET    /portfolios/<id>/ltcg            LTCG tax harvesting summary, optionally ?as_of=<date>
+    GET    /portfolios/<id>/ltcg/calendar   dates on which open lots become long term
+    GET    /portfolios/<id>/valuation       valuation summary
+    GET    /portfolios/<id>/valuation/history
+                                            value and invested amount on every date, optionally
+                                            ?frequency=D|W|M&start=<date>&end=<date>
+    GET    /portfolios/<id>/gains           realized capital gains by financial year and scheme
+    DELETE /portfolios/<id>                 forget a portfolio
+    POST   /navs/refresh                    fetch the latest NAVs of every loaded scheme
+    GET    /metrics                         timings and counters, with metrics enabled
+
+PDFs are parsed in a thread pool and portfolios are only touched from a single analysis thread, so
+requests never see a portfolio half way through an update. NAVs older than the refresh interval are
+refreshed before a summary is served; concurrent requests wait on the same refresh.
+"""
+
+import asyncio
+import datetime
+import hashlib
+import io
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from casparser.encoder import CASDataEncoder
+from casparser.exceptions import CASParseError
+
+from . import metrics
+from .amfi import AMFINavMaster
+from .cache import DEFAULT_NAV_TTL, CASDataCache
+from .constants import DEFAULT_MAX_WORKERS
+from .mfhelper import get_scheme_details_bulk
+from .portfolio import Portfolio, read_cas_data
+from .timeseries import DAILY, FREQUENCIES
+from .utils import logger
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+PASSWORD_HEADER = "x-cas-password"
+PORTFOLIO_ID_LENGTH = 16
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    query: Dict[str, List[str]]
+    headers: Dict[str, str]
+    body: bytes
+
+
+class AnalysisService:
+    """Portfolios loaded from uploaded CAS pdfs, sharing one scheme details lookup
+
+    Args:
+        max_workers (int): number of concurrent scheme detail requests
+        offline (bool): resolve scheme details only from the on-disk cache, NAVs are never refreshed
+        nav_master (Optional[AMFINavMaster]): AMFI NAV file to resolve schemes from, a refresh
+            rereads it if it was parsed from a local file and downloads the latest one otherwise
+        nav_ttl (float): seconds after which NAVs are refreshed before serving a summary
+        use_cas_cache (bool): reuse parsed statements of pdfs uploaded before with the same
+            password, stored unencrypted in the cache directory
+    """
+
+    def __init__(
+        self,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        offline: bool = False,
+        nav_master: Optional[AMFINavMaster] = None,
+        nav_ttl: float = DEFAULT_NAV_TTL,
+        use_cas_cache: bool = False,
+    ) -> None:
+        self.portfolios: Dict[str, Portfolio] = {}
+        self._max_workers = max_workers
+        self._offline = offline
+        self._nav_master = nav_master
+        self._nav_ttl = nav_ttl
+        self._cas_cache = CASDataCache() if use_cas_cache else None
+        self._scheme_details: Dict[str, Optional[dict]] = {}
+        self._navs_updated = time.time()
+        self._refresh: Optional[asyncio.Future] = None
+        # Portfolios aren't thread safe, everything touching them runs on this one thread
+        self._analysis = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analysis")
+
+    async def _analyze(self, function: Callable, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._analysis, partial(function, *args))
+
+    def get_portfolio(self, portfolio_id: str) -> Portfolio:
+        try:
+            return self.portfolios[portfolio_id]
+        except KeyError:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"No portfolio with id {portfolio_id}")
+
+    async def add_portfolio(
+        self, pdf_bytes: bytes, password: str, portfolio_id: Optional[str] = None
+    ) -> dict:
+        """Parse a CAS pdf and load all its schemes, replacing any portfolio with the same id
+
+        Args:
+            pdf_bytes (bytes): contents of the CAS pdf
+            password (str): CAS pdf password
+            portfolio_id (Optional[str]): id to serve the portfolio under, derived from the
+                contents of the pdf by default
+
+        Returns:
+            dict: "id" and number of "schemes" of the portfolio
+        """
+        portfolio_id = portfolio_id or hashlib.sha256(pdf_bytes).hexdigest()[:PORTFOLIO_ID_LENGTH]
+        loop = asyncio.get_running_loop()
+        try:
+            data = await loop.run_in_executor(
+                None, read_cas_data, io.BytesIO(pdf_bytes), password, self._cas_cache
+            )
+        except CASParseError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Could not parse CAS pdf: {e}")
+
+        schemes = await self._analyze(self.__load_portfolio, portfolio_id, data)
+        logger.info(f"Loaded portfolio {portfolio_id} with {schemes} schemes")
+        return {"id": portfolio_id, "schemes": schemes}
+
+    def __load_portfolio(self, portfolio_id: str, data: dict) -> int:
+        portfolio = Portfolio.from_cas_data(
+            data,
+            max_workers=self._max_workers,
+            offline=self._offline,
+            scheme_details=self._scheme_details,
+            nav_master=self._nav_master,
+        )
+        # Resolve every scheme now, so the first summary request doesn't wait for it
+        schemes = len(portfolio.schemes)
+        self.portfolios[portfolio_id] = portfolio
+        return schemes
+
+    async def remove_portfolio(self, portfolio_id: str) -> dict:
+        self.get_portfolio(portfolio_id)
+        await self._analyze(self.portfolios.pop, portfolio_id)
+        return {"id": portfolio_id}
+
+    async def ltcg_tax_harvesting_summary(
+        self, portfolio_id: str, as_of: Optional[datetime.date] = None
+    ) -> bytes:
+        """Summary encoded as JSON, see Portfolio.ltcg_tax_harvesting_summary"""
+        portfolio = self.get_portfolio(portfolio_id)
+        await self.ensure_fresh_navs()
+        summary = partial(portfolio.ltcg_tax_harvesting_summary, as_of)
+        return await self._analyze(_encode_result, summary)
+
+    async def ltcg_eligibility_calendar(
+        self, portfolio_id: str, as_of: Optional[datetime.date] = None
+    ) -> bytes:
+        """Calendar encoded as JSON, see Portfolio.ltcg_eligibility_calendar"""
+        portfolio = self.get_portfolio(portfolio_id)
+        await self.ensure_fresh_navs()
+        calendar = partial(portfolio.ltcg_eligibility_calendar, as_of)
+        return await self._analyze(_encode_result, calendar)
+
+    async def valuation_summary(self, portfolio_id: str) -> bytes:
+        """Summary encoded as JSON, see Portfolio.get_valuation_summary"""
+        portfolio = self.get_portfolio(portfolio_id)
+        await self.ensure_fresh_navs()
+        return await self._analyze(_encode_result, portfolio.get_valuation_summary)
+
+    async def valuation_series(
+        self,
+        portfolio_id: str,
+        start: Optional[datetime.date] = None,
+        end: Optional[datetime.date] = None,
+        frequency: str = DAILY,
+    ) -> bytes:
+        """Series encoded as JSON, see Portfolio.valuation_series"""
+        portfolio = self.get_portfolio(portfolio_id)
+        await self.ensure_fresh_navs()
+        series = partial(portfolio.valuation_series, start, end, frequency)
+        return await self._analyze(_encode_result, lambda: series().to_dict())
+
+    async def realized_gains_summary(self, portfolio_id: str) -> bytes:
+        """Summary encoded as JSON, see Portfolio.realized_gains_summary"""
+        portfolio = self.get_portfolio(portfolio_id)
+        return await self._analyze(_encode_result, portfolio.realized_gains_summary)
+
+    async def ensure_fresh_navs(self) -> None:
+        if not self._offline and time.time() - self._navs_updated > self._nav_ttl:
+            await self.refresh_navs()
+
+    async def refresh_navs(self, force: bool = False) -> dict:
+        """Fetch the latest NAVs of every scheme of every loaded portfolio
+
+        A refresh requested while another is running waits for that one instead of starting its
+        own.
+
+        Args:
+            force (bool): download the AMFI NAV file even if the cached copy is fresh
+
+        Returns:
+            dict: number of "schemes" refreshed
+        """
+        if self._offline:
+            raise HTTPError(HTTPStatus.CONFLICT, "NAVs can't be refreshed in offline mode")
+
+        if self._refresh is None:
+            self._refresh = asyncio.ensure_future(self.__refresh_navs(force))
+            self._refresh.add_done_callback(self.__refresh_done)
+        else:
+            metrics.increment("server.refreshes_shared")
+        # A cancelled request mustn't cancel the refresh other requests are waiting on
+        return await asyncio.shield(self._refresh)
+
+    def __refresh_done(self, _: asyncio.Future) -> None:
+        self._refresh = None
+
+    async def __refresh_navs(self, force: bool) -> dict:
+        loop = asyncio.get_running_loop()
+        with metrics.span("server.refresh_navs"):
+            # Every loaded portfolio resolved its schemes into the shared lookup
+            codes = list(self._scheme_details)
+            scheme_details = await loop.run_in_executor(
+                None, self.__fetch_latest_details, codes, force
+            )
+            await self._analyze(self.__apply_details, scheme_details)
+
+        self._navs_updated = time.time()
+        logger.info(f"Refreshed NAVs of {len(scheme_details)} schemes")
+        return {"schemes": len(scheme_details)}
+
+    def __fetch_latest_details(self, codes: List[str], force: bool) -> Dict[str, Optional[dict]]:
+        scheme_details = {}
+        if self._nav_master is not None:
+            # A NAV file given by the user is read again, it is never swapped for a download
+            self._nav_master = AMFINavMaster.load(
+                self._nav_master.path, max_age=0 if force else self._nav_ttl
+            )
+            for code in codes:
+                details = self._nav_master.get(code)
+                if details is not None:
+                    scheme_details[code] = details
+
+        missing = [code for code in codes if code not in scheme_details]
+        scheme_details.update(
+            get_scheme_details_bulk(missing, max_workers=self._max_workers, refresh=True)
+        )
+        return scheme_details
+
+    def __apply_details(self, scheme_details: Dict[str, Optional[dict]]) -> None:
+        self._scheme_details.update(scheme_details)
+        for portfolio in self.portfolios.values():
+            portfolio.refresh_navs(scheme_details)
+
+    def close(self) -> None:
+        self._analysis.shutdown(wait=False)
+
+
+def _encode(payload) -> bytes:
+    return json.dumps(payload, cls=CASDataEncoder).encode()
+
+
+def _encode_result(function: Callable) -> bytes:
+    return _encode(function())
+
+
+class AnalysisServer:
+    """HTTP/1.1 front end of an AnalysisService, see the module docstring for the endpoints"""
+
+    def __init__(self, service: AnalysisService) -> None:
+        self.service = service
+        self.routes: List[Tuple[str, re.Pattern, Callable]] = [
+            ("GET", re.compile(r"/health"), self.health),
+            ("GET", re.compile(r"/metrics"), self.show_metrics),
+            ("GET", re.compile(r"/portfolios"), self.list_portfolios),
+            ("POST", re.compile(r"/portfolios"), self.add_portfolio),
+            ("GET", re.compile(r"/portfolios/([^/]+)/ltcg"), self.ltcg),
+            ("GET", re.compile(r"/portfolios/([^/]+)/ltcg/calendar"), self.ltcg_calendar),
+            ("GET", re.compile(r"/portfolios/([^/]+)/valuation"), self.valuation),
+            ("GET", re.compile(r"/portfolios/([^/]+)/valuation/history"), self.valuation_history),
+            ("GET", re.compile(r"/portfolios/([^/]+)/gains"), self.gains),
+            ("DELETE", re.compile(r"/portfolios/([^/]+)"), self.remove_portfolio),
+            ("POST", re.compile(r"/navs/refresh"), self.refresh_navs),
+        ]
+
+    async def health(self, request: Request):
+        return {"status": "ok", "portfolios": len(self.service.portfolios)}
+
+    async def show_metrics(self, request: Request):
+        collector = metrics.get_metrics()
+        return collector.as_dict() if collector is not None else {"spans": {}, "counters": {}}
+
+    async def list_portfolios(self, request: Request):
+        return {"portfolios": list(self.service.portfolios)}
+
+    async def add_portfolio(self, request: Request):
+        password = request.headers.get(PASSWORD_HEADER)
+        if password is None or not request.body:
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST,
+                "Send the CAS pdf as the body, its password in X-CAS-Password",
+            )
+        portfolio_id = request.query.get("id", [None])[0]
+        return await self.service.add_portfolio(request.body, password, portfolio_id)
+
+    async def ltcg(self, request: Request, portfolio_id: str):
+        return await self.service.ltcg_tax_harvesting_summary(portfolio_id, _get_as_of(request))
+
+    async def ltcg_calendar(self, request: Request, portfolio_id: str):
+        return await self.service.ltcg_eligibility_calendar(portfolio_id, _get_as_of(request))
+
+    async def valuation(self, request: Request, portfolio_id: str):
+        return await self.service.valuation_summary(portfolio_id)
+
+    async def valuation_history(self, request: Request, portfolio_id: str):
+        frequency = request.query.get("frequency", [DAILY])[0]
+        if frequency not in FREQUENCIES:
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST, f"frequency must be one of {', '.join(FREQUENCIES)}"
+            )
+        return await self.service.valuation_series(
+            portfolio_id, _get_date(request, "start"), _get_date(request, "end"), frequency
+        )
+
+    async def gains(self, request: Request, portfolio_id: str):
+        return await self.service.realized_gains_summary(portfolio_id)
+
+    async def remove_portfolio(self, request: Request, portfolio_id: str):
+        return await self.service.remove_portfolio(portfolio_id)
+
+    async def refresh_navs(self, request: Request):
+        return await self.service.refresh_navs(force=True)
+
+    async def dispatch(self, request: Request) -> Tuple[HTTPStatus, bytes]:
+        allowed = False
+        for method, pattern, handler in self.routes:
+            match = pattern.fullmatch(request.path.rstrip("/") or "/")
+            if match is None:
+                continue
+            if method != request.method:
+                allowed = True
+                continue
+            result = await handler(request, *match.groups())
+            return HTTPStatus.OK, result if isinstance(result, bytes) else _encode(result)
+
+        if allowed:
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f"{request.method} is not allowed")
+        raise HTTPError(HTTPStatus.NOT_FOUND, f"No such endpoint: {request.path}")
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Serve requests on a connection until the client closes it or asks to"""
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await _read_request(reader)
+                    if request is None:
+                        break
+                    keep_alive = request.headers.get("connection", "").lower() != "close"
+                    metrics.increment("server.requests")
+                    with metrics.span("server.request"):
+                        status, body = await self.dispatch(request)
+                except HTTPError as e:
+                    status, body = e.status, _encode({"error": str(e)})
+                except Exception as e:
+                    logger.exception(f"Request failed: {e}")
+                    status = HTTPStatus.INTERNAL_SERVER_ERROR
+                    body = _encode({"error": f"{type(e).__name__}: {e}"})
+
+                writer.write(_format_response(status, body, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info(f"Serving portfolio analysis on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.service.close()
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+    """Next request on the connection, None once the client closed it"""
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, target, _ = request_line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed Content-Length")
+    if length > MAX_UPLOAD_BYTES:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "CAS pdf is too large")
+    body = await reader.readexactly(length) if length else b""
+
+    url = urlsplit(target)
+    return Request(method.upper(), url.path, parse_qs(url.query), headers, body)
+
+
+def _get_date(request: Request, name: str) -> Optional[datetime.date]:
+    value = request.query.get(name, [None])[0]
+    if value is None:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"{name} is not a YYYY-MM-DD date: {value}")
+
+
+def _get_as_of(request: Request) -> Optional[datetime.date]:
+    return _get_date(request, "as_of")
+
+
+def _format_response(status: HTTPStatus, body: bytes, keep_alive: bool) -> bytes:
+    head = (
+        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        "\r\n"
+    )
+    return head.encode("latin-1") + body
+
+
+def run_server(
+    service: AnalysisService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT
+) -> None:
+    """Serve until interrupted"""
+    try:
+        asyncio.run(AnalysisServer(service).serve(host, port))
+    except KeyboardInterrupt:
+        logger.info("Stopped serving")
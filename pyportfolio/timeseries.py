@@ -0,0 +1,253 @@
+"""Value and invested amount of a portfolio on every date of a daily, weekly or monthly grid
+
+Nothing is revalued date by date. Every scheme is swept once:
+
+    - units held and their cost after every transaction come from TransactionTable.running_holdings
+    - the NAV as of every grid date is the latest one published on or before it, from the scheme's
+      NAV history in a NavStore merged with the NAVs of its own transactions, and from today on
+      the scheme's current NAV where those are older, like the valuation summary
+    - a binary search of the grid dates in both series gives the holdings and the NAV on every date
+
+so a scheme costs a few vectorized searches over its transactions and NAVs, and the results are
+arrays with one row per scheme and one column per date.
+"""
+
+import datetime
+from decimal import Decimal
+from typing import Iterable, List, NamedTuple, Optional
+
+import numpy as np
+
+from . import metrics
+from .columnar import NAV_DECIMALS, UNITS_DECIMALS, TransactionTable, to_datetime64, to_fixed
+from .constants import DEFAULT_MAX_WORKERS
+from .mfhelper import refresh_nav_histories
+from .models import Scheme
+from .navstore import NavStore, get_default_nav_store
+
+DAILY, WEEKLY, MONTHLY = "D", "W", "M"
+FREQUENCIES = (DAILY, WEEKLY, MONTHLY)
+# Histories whose last NAV is older than this, counted back from the end of the grid, are fetched
+# again. NAVs aren't published on weekends and market holidays.
+STALE_NAV_DAYS = 4
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+_VALUE_SCALE = 10.0 ** (UNITS_DECIMALS + NAV_DECIMALS)
+
+
+class ValuationSeries(NamedTuple):
+    """Valuation of every scheme on every date of a grid
+
+    Attributes:
+        dates: datetime64[D] dates of the grid, ascending
+        schemes: names of the schemes, in the order of the rows
+        values: float64 value in rupees of the units held, one row per scheme
+        invested: float64 cost in rupees of the units held (FIFO, like the cost in the valuation
+            cube), one row per scheme
+    """
+
+    dates: np.ndarray
+    schemes: List[str]
+    values: np.ndarray
+    invested: np.ndarray
+
+    @property
+    def total_value(self) -> np.ndarray:
+        return self.values.sum(axis=0)
+
+    @property
+    def total_invested(self) -> np.ndarray:
+        return self.invested.sum(axis=0)
+
+    def to_dict(self) -> dict:
+        """Series as lists, for JSON"""
+        return {
+            "dates": np.datetime_as_string(self.dates).tolist(),
+            "value": self.total_value.round(2).tolist(),
+            "invested": self.total_invested.round(2).tolist(),
+            "schemes": [
+                {"scheme": name, "value": values.tolist(), "invested": invested.tolist()}
+                for name, values, invested in zip(
+                    self.schemes, self.values.round(2), self.invested.round(2)
+                )
+            ],
+        }
+
+
+def get_date_grid(start: datetime.date, end: datetime.date, frequency: str = DAILY) -> np.ndarray:
+    """Dates from start to end, both included, every day, week or month
+
+    Weekly grids step back from end in weeks, monthly grids are the ends of the months before the
+    month of end, followed by end.
+
+    Args:
+        start (datetime.date): first date
+        end (datetime.date): last date, always on the grid unless it is before start
+        frequency (str): one of FREQUENCIES
+
+    Returns:
+        np.ndarray: datetime64[D] dates, ascending
+    """
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"Unknown frequency {frequency}, must be one of {FREQUENCIES}")
+    first, last = to_datetime64(start), to_datetime64(end)
+    if last < first:
+        return np.empty(0, dtype="datetime64[D]")
+
+    if frequency == DAILY:
+        return np.arange(first, last + 1)
+    if frequency == WEEKLY:
+        return np.arange(last, first - 1, -7)[::-1]
+
+    months = np.arange(first.astype("datetime64[M]"), last.astype("datetime64[M]"))
+    month_ends = (months + 1).astype("datetime64[D]") - 1
+    return np.concatenate((month_ends[month_ends >= first], [last]))
+
+
+def _get_table(scheme) -> TransactionTable:
+    # Compact records carry their own table, models are converted
+    table = getattr(scheme, "table", None)
+    if table is None:
+        table = TransactionTable.from_transactions(scheme.transactions or [])
+    return table
+
+
+def _as_of(dates: np.ndarray, grid: np.ndarray) -> np.ndarray:
+    """Index of the latest of the sorted dates on or before every grid date, -1 if none is"""
+    return np.searchsorted(dates, grid, side="right") - 1
+
+
+def get_nav_histories(
+    amfi_ids: Iterable,
+    end: datetime.date,
+    nav_store: Optional[NavStore] = None,
+    offline: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> NavStore:
+    """Store with the NAV histories of the schemes, fetching those that don't reach end
+
+    Schemes that fail to fetch keep their stored NAVs, the series falls back on them and on the NAVs
+    of the scheme's transactions.
+
+    Args:
+        amfi_ids (Iterable): scheme codes
+        end (datetime.date): last date NAVs are needed for
+        nav_store (Optional[NavStore]): store to read from and record into, defaults to the
+            default store or one in the cache directory
+        offline (bool): only use stored NAVs
+        max_workers (int): number of concurrent NAV history requests
+
+    Returns:
+        NavStore: the store
+    """
+    nav_store = nav_store or get_default_nav_store() or NavStore()
+    stale_before = (end - datetime.timedelta(days=STALE_NAV_DAYS)).toordinal()
+    codes = list(dict.fromkeys(str(amfi_id) for amfi_id in amfi_ids))
+
+    stale = [
+        code
+        for code in codes
+        if len(nav_store.history(code)) == 0 or nav_store.history(code)["date"][-1] < stale_before
+    ]
+    if stale and not offline:
+        refresh_nav_histories(stale, nav_store, max_workers)
+    return nav_store
+
+
+def _scheme_series(
+    table: TransactionTable,
+    history: np.ndarray,
+    grid: np.ndarray,
+    nav: Optional[Decimal] = None,
+    nav_date: Optional[datetime.date] = None,
+):
+    """Value and invested amount of a scheme on the grid, with 8 implied decimals
+
+    nav is the current NAV of the scheme, used from nav_date on where the history is older.
+    """
+    if len(table) == 0:
+        return np.zeros(len(grid), dtype=np.int64), np.zeros(len(grid), dtype=np.int64)
+
+    units, cost = table.running_holdings()
+    rows = _as_of(table.dates, grid)
+    held = rows >= 0
+    units_held = np.where(held, units[rows], 0)
+    invested = np.where(held, cost[rows], 0)
+
+    # NAVs of the scheme's own transactions, for dates the stored history doesn't cover
+    navs = np.zeros(len(grid), dtype=np.int64)
+    nav_ordinals = np.zeros(len(grid), dtype=np.int64)
+    priced = np.flatnonzero(table.navs > 0)
+    if len(priced):
+        rows = _as_of(table.dates[priced], grid)
+        found = rows >= 0
+        navs = np.where(found, table.navs[priced][rows], 0)
+        nav_ordinals = np.where(
+            found, table.dates[priced][rows].astype(np.int64) + _EPOCH_ORDINAL, 0
+        )
+
+    grid_ordinals = grid.astype(np.int64) + _EPOCH_ORDINAL
+    if len(history):
+        rows = _as_of(history["date"], grid_ordinals)
+        newer = (rows >= 0) & (history["date"][rows] >= nav_ordinals)
+        navs = np.where(newer, history["nav"][rows], navs)
+        nav_ordinals = np.where(newer, history["date"][rows], nav_ordinals)
+
+    if nav is not None and nav_date is not None:
+        current = (grid_ordinals >= nav_date.toordinal()) & (nav_ordinals < nav_date.toordinal())
+        navs = np.where(current, to_fixed(nav, NAV_DECIMALS), navs)
+
+    return units_held * navs, invested
+
+
+def get_valuation_series(
+    schemes: List[Scheme],
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    frequency: str = DAILY,
+    nav_store: Optional[NavStore] = None,
+    offline: bool = False,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> ValuationSeries:
+    """Value and invested amount of every scheme on a grid of dates, see the module docstring
+
+    Args:
+        schemes (List[Scheme]): schemes or compact scheme records
+        start (Optional[datetime.date]): first date, the first transaction by default
+        end (Optional[datetime.date]): last date, today by default
+        frequency (str): "D", "W" or "M", see get_date_grid
+        nav_store (Optional[NavStore]): store of NAV histories, see get_nav_histories
+        offline (bool): only use stored NAVs
+        max_workers (int): number of concurrent NAV history requests
+
+    Returns:
+        ValuationSeries: arrays with one row per scheme and one column per date
+    """
+    today = datetime.date.today()
+    end = end or today
+    tables = [_get_table(scheme) for scheme in schemes]
+    if start is None:
+        firsts = [table.dates[0] for table in tables if len(table)]
+        start = min(firsts).astype(object) if firsts else end
+    grid = get_date_grid(start, end, frequency)
+
+    with metrics.span("timeseries.navs"):
+        nav_store = get_nav_histories(
+            [scheme.amfi for scheme in schemes if scheme.amfi],
+            end,
+            nav_store,
+            offline,
+            max_workers,
+        )
+
+    values = np.zeros((len(schemes), len(grid)), dtype=np.float64)
+    invested = np.zeros((len(schemes), len(grid)), dtype=np.float64)
+    with metrics.span("timeseries.sweep"):
+        for row, (scheme, table) in enumerate(zip(schemes, tables)):
+            history = nav_store.history(scheme.amfi) if scheme.amfi else np.empty(0)
+            values[row], invested[row] = _scheme_series(table, history, grid, scheme.nav, today)
+    values /= _VALUE_SCALE
+    invested /= _VALUE_SCALE
+    metrics.increment("timeseries.points", values.size)
+
+    return ValuationSeries(grid, [scheme.name for scheme in schemes], values, invested)
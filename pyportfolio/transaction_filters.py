@@ -1,8 +1,9 @@
-from typing import Callable
+import datetime
+from typing import Callable, Optional
 from casparser.enums import TransactionType
 
 from .models import Transaction
-from .utils import or_filter
+from .utils import indexed, or_filter
 
 TransactionFilterType = Callable[[Transaction], bool]
 
@@ -11,14 +12,20 @@ def get_transaction_type_filter(transaction_type: TransactionType) -> Transactio
     def transaction_type_filter(transaction: Transaction):
         return transaction.type == transaction_type
 
-    return transaction_type_filter
+    return indexed(transaction_type_filter, "type", transaction_type)
 
 
-def get_transaction_older_than_filter(days: int) -> TransactionFilterType:
+def get_transaction_older_than_filter(
+    days: int, as_of: Optional[datetime.date] = None
+) -> TransactionFilterType:
+    """Transactions more than the given days old as of a date, today by default"""
+    # Held for more than days as of as_of means made before the cutoff
+    cutoff = (as_of or datetime.date.today()).toordinal() - days
+
     def transaction_older_than_filter(transaction: Transaction):
-        return transaction.days > days
+        return transaction.date.toordinal() < cutoff
 
-    return transaction_older_than_filter
+    return indexed(transaction_older_than_filter, "before", cutoff)
 
 
 # Filters
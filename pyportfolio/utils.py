@@ -1,3 +1,5 @@
+import copy
+import functools
 import logging
 
 logging.basicConfig()
@@ -6,13 +8,45 @@ logger.setLevel(logging.INFO)
 
 
 # Filter Utils
+def indexed(predicate, *index):
+    """Describe what a filter selects, so that query indexes can answer it without calling it"""
+    predicate.index = index
+    return predicate
+
+
 def and_filter(filters):
-    return lambda x: all(f(x) for f in filters)
+    filters = tuple(filters)
+    return indexed(lambda x: all(f(x) for f in filters), "and", filters)
 
 
 def or_filter(filters):
-    return lambda x: any(f(x) for f in filters)
+    filters = tuple(filters)
+    return indexed(lambda x: any(f(x) for f in filters), "or", filters)
 
 
 def filter_dict(mydict, keys):
     return {key: mydict[key] for key in keys}
+
+
+def memoize(method=None, *, copy_result: bool = True):
+    """Cache results of a method on the instance, in its _memo dict, keyed by the arguments
+
+    Callers get a deep copy of the cached result, so changing it doesn't change later results.
+    Methods returning objects meant to be shared, such as indexes, pass copy_result=False. Calls
+    with unhashable arguments are not cached.
+    """
+    if method is None:
+        return functools.partial(memoize, copy_result=copy_result)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return method(self, *args, **kwargs)
+        if key not in self._memo:
+            self._memo[key] = method(self, *args, **kwargs)
+        return copy.deepcopy(self._memo[key]) if copy_result else self._memo[key]
+
+    return wrapper